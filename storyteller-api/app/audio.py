@@ -0,0 +1,125 @@
+"""
+Helpers for chunked speech synthesis: splitting story text into requests the
+synthesize API accepts, and stitching the LINEAR16 results back into one WAV
+file on disk without holding the whole story's audio in memory.
+"""
+import io
+import re
+import wave
+
+# Written between sections by the story generator.
+PAUSE_MARKER = "[pause long]"
+
+# The synthesize API rejects input over 5000 bytes; leave some headroom.
+MAX_CHUNK_BYTES = 4500
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def _byte_len(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+def _split_oversized(text: str, max_bytes: int) -> list[str]:
+    """Splits a single paragraph into sentence-aligned pieces of at most `max_bytes`."""
+    pieces = []
+    for sentence in _SENTENCE_END.split(text):
+        while _byte_len(sentence) > max_bytes:
+            # A run-on "sentence": cut at the last space that fits.
+            cut = sentence.encode("utf-8")[:max_bytes].decode("utf-8", "ignore")
+            space = cut.rfind(" ")
+            if space > 0:
+                cut = cut[:space]
+            pieces.append(cut)
+            sentence = sentence[len(cut):].lstrip()
+        if sentence:
+            pieces.append(sentence)
+    return pieces
+
+def split_for_synthesis(text: str, max_bytes: int = MAX_CHUNK_BYTES) -> list[tuple[str, bool]]:
+    """
+    Splits story text into `(chunk, pause_after)` pairs in reading order.
+
+    Chunks never cross a pause marker and are packed from whole paragraphs
+    (or sentences, for very long paragraphs) up to `max_bytes`. `pause_after`
+    is True for the last chunk before each pause marker.
+    """
+    chunks = []
+    parts = text.split(PAUSE_MARKER)
+    for part_index, part in enumerate(parts):
+        pieces = []
+        for paragraph in re.split(r"\n\s*\n", part):
+            paragraph = " ".join(paragraph.split())
+            if not paragraph:
+                continue
+            if _byte_len(paragraph) > max_bytes:
+                pieces.extend(_split_oversized(paragraph, max_bytes))
+            else:
+                pieces.append(paragraph)
+
+        current = ""
+        for piece in pieces:
+            candidate = f"{current}\n\n{piece}" if current else piece
+            if _byte_len(candidate) > max_bytes:
+                chunks.append((current, False))
+                current = piece
+            else:
+                current = candidate
+        if current:
+            chunks.append((current, False))
+
+        followed_by_pause = part_index < len(parts) - 1
+        if followed_by_pause and chunks:
+            chunks[-1] = (chunks[-1][0], True)
+    return chunks
+
+class WavStitcher:
+    """
+    Appends LINEAR16 WAV chunks and silence to a WAV file as they arrive.
+    Only the chunk being written is ever in memory.
+    """
+
+    def __init__(self, path: str, sample_rate: int, channels: int = 1, sample_width: int = 2):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.frames_written = 0
+        self._writer = wave.open(path, "wb")
+        self._writer.setnchannels(channels)
+        self._writer.setsampwidth(sample_width)
+        self._writer.setframerate(sample_rate)
+
+    @property
+    def duration_seconds(self) -> float:
+        return self.frames_written / self.sample_rate
+
+    def append_wav(self, data: bytes):
+        """Appends the frames of an in-memory WAV file, which must match this file's format."""
+        with wave.open(io.BytesIO(data), "rb") as chunk:
+            params = (chunk.getnchannels(), chunk.getsampwidth(), chunk.getframerate())
+            expected = (self.channels, self.sample_width, self.sample_rate)
+            if params != expected:
+                raise ValueError(f"WAV chunk format {params} does not match {expected}")
+            frames = chunk.readframes(chunk.getnframes())
+        self.append_pcm(frames)
+
+    def append_pcm(self, frames: bytes):
+        """Appends raw PCM frames in this file's format."""
+        self._writer.writeframesraw(frames)
+        self.frames_written += len(frames) // (self.channels * self.sample_width)
+
+    def append_silence(self, seconds: float):
+        frame_count = int(seconds * self.sample_rate)
+        block = b"\x00" * (self.sample_rate * self.channels * self.sample_width)
+        while frame_count > 0:
+            frames = min(frame_count, self.sample_rate)
+            self.append_pcm(block[:frames * self.channels * self.sample_width])
+            frame_count -= frames
+
+    def close(self):
+        # Closing rewrites the header with the final length.
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
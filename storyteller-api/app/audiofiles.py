@@ -0,0 +1,126 @@
+"""
+Serving published audio files from the local blob store.
+
+`AudioFileResponse` answers byte-range requests (a single range; anything
+else gets the whole file), so players can seek, and sends a strong ETag and
+Cache-Control. The file body never passes through Python buffers when it can
+be avoided:
+
+    ASGI servers with the zero-copy extension get the open file, offset and
+    length and send it with sendfile; with the path-send extension, whole
+    files are sent by path. Otherwise the file is memory-mapped and sent as
+    slices of the mapping, read straight from the page cache without copying
+    it into Python first.
+
+Configured with:
+    AUDIO_CACHE_MAX_AGE_SECONDS  max-age for audio responses; a story's audio never
+                                 changes once published
+    AUDIO_STREAM_CHUNK_BYTES     size of each slice sent from a memory-mapped file
+"""
+import mmap
+import os
+from email.utils import formatdate
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from . import transcode
+
+AUDIO_CACHE_MAX_AGE_SECONDS = int(os.getenv("AUDIO_CACHE_MAX_AGE_SECONDS", "86400"))
+AUDIO_STREAM_CHUNK_BYTES = int(os.getenv("AUDIO_STREAM_CHUNK_BYTES", str(1024 * 1024)))
+
+CACHE_CONTROL = f"public, max-age={AUDIO_CACHE_MAX_AGE_SECONDS}"
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def etag(path: str, stat_result: os.stat_result) -> str:
+    """
+    Strong ETag for a published file. Blob names are content hashes, so the
+    name and size identify the bytes without reading them.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    return f'"{name}-{stat_result.st_size:x}"'
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    The [start, end) byte range a Range header asks for, or None to send the
+    whole file (no header, several ranges, or one we cannot parse). Raises
+    RangeNotSatisfiable if the range lies beyond the end of the file.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header.removeprefix("bytes=").strip().partition("-")
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable()
+            return max(size - suffix, 0), size
+        start = int(first)
+        end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end <= start:
+        return None
+    return start, min(end, size)
+
+class AudioFileResponse(Response):
+    """A published audio file, answering Range and If-Range from the request."""
+
+    def __init__(self, path: str, stat_result: os.stat_result, headers: dict | None = None):
+        self.path = path
+        self.stat_result = stat_result
+        self.status_code = 200
+        self.media_type = transcode.content_type(path)
+        self.background = None
+        self.init_headers({
+            "Accept-Ranges": "bytes",
+            "ETag": etag(path, stat_result),
+            "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "Cache-Control": CACHE_CONTROL,
+            **(headers or {}),
+        })
+
+    async def __call__(self, scope, receive, send):
+        size = self.stat_result.st_size
+        request_headers = Headers(scope=scope)
+        byte_range = None
+        # If-Range: only honour the range if the client's copy is this file.
+        if request_headers.get("if-range") in (None, self.headers["etag"]):
+            try:
+                byte_range = parse_range(request_headers.get("range"), size)
+            except RangeNotSatisfiable:
+                response = Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+                return await response(scope, receive, send)
+
+        start, end = byte_range or (0, size)
+        headers = MutableHeaders(raw=list(self.raw_headers))
+        headers["content-length"] = str(end - start)
+        if byte_range:
+            headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+        await send({"type": "http.response.start", "status": 206 if byte_range else 200, "headers": headers.raw})
+
+        if scope["method"] == "HEAD" or start == end:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopy" in extensions:
+            with open(self.path, "rb") as f:
+                await send({"type": "http.response.zerocopy", "file": f, "offset": start, "count": end - start})
+        elif "http.response.pathsend" in extensions and byte_range is None:
+            await send({"type": "http.response.pathsend", "path": self.path})
+        else:
+            await self._send_mapped(send, start, end)
+
+    async def _send_mapped(self, send, start: int, end: int):
+        with open(self.path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            mapped.madvise(mmap.MADV_SEQUENTIAL, start - start % mmap.PAGESIZE)
+        # The mapping is left to be unmapped once the server has released the
+        # last slice, which it may still hold in its write buffer.
+        view = memoryview(mapped)
+        for offset in range(start, end, AUDIO_STREAM_CHUNK_BYTES):
+            chunk_end = min(offset + AUDIO_STREAM_CHUNK_BYTES, end)
+            await send({"type": "http.response.body", "body": view[offset:chunk_end], "more_body": chunk_end < end})
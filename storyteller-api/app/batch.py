@@ -0,0 +1,125 @@
+"""
+Bulk story submission.
+
+A batch is a set of prompts submitted at once, through `POST /stories:batch`
+or this module's command line. Its stories are inserted with a single bulk
+write and queued at BATCH_PRIORITY, below interactive stories, so a catalogue
+of thousands never delays a listener waiting on their own story. Batch
+stories have admission limits of their own instead of the interactive ones:
+a client may have BATCH_CLIENT_MAX_ACTIVE_STORIES batch stories queued or
+generating, and batches are refused while BATCH_QUEUE_MAX_PENDING are
+waiting (0 disables either). The command line, run by operators, skips them.
+
+Progress is reported for the batch as a whole (stories per status), from
+`GET /batches/{id}` or periodically by the command line:
+
+    python -m app.batch prompts.txt --name seasonal --concurrency 16
+
+where prompts.txt has one prompt per line. The command queues the batch and
+then generates it with a worker tuned for throughput: BATCH_WORKER_CONCURRENCY
+stories at once, all sharing one event loop, so their Gemini and
+Text-to-Speech requests are pooled behind the process-wide rate limits and the
+LLM_MAX_CONCURRENCY semaphore and keep the provider quota fully used. With
+`--concurrency 0` the batch is only queued for other workers.
+"""
+import argparse
+import logging
+import os
+import time
+from sqlalchemy.orm import Session
+from . import crud, database, telemetry
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_PROMPTS = int(os.getenv("BATCH_MAX_PROMPTS", "10000"))
+# Longest prompt, in characters, a batch may contain.
+BATCH_PROMPT_MAX_CHARS = int(os.getenv("BATCH_PROMPT_MAX_CHARS", "2000"))
+# Queue priority of batch stories; interactive stories are queued at 0.
+BATCH_PRIORITY = int(os.getenv("BATCH_PRIORITY", "-10"))
+BATCH_CLIENT_MAX_ACTIVE_STORIES = int(os.getenv("BATCH_CLIENT_MAX_ACTIVE_STORIES", "5000"))
+BATCH_QUEUE_MAX_PENDING = int(os.getenv("BATCH_QUEUE_MAX_PENDING", "20000"))
+BATCH_WORKER_CONCURRENCY = int(os.getenv("BATCH_WORKER_CONCURRENCY", "16"))
+BATCH_PROGRESS_SECONDS = float(os.getenv("BATCH_PROGRESS_SECONDS", "10"))
+
+FINISHED_STATUSES = ("complete", "failed")
+
+def submit(db: Session, prompts: list[str], name: str | None = None, client_id: str | None = None):
+    """Queues a story for every prompt as one batch. Returns the batch."""
+    if not prompts:
+        raise RuntimeError("A batch needs at least one prompt.")
+    if len(prompts) > BATCH_MAX_PROMPTS:
+        raise RuntimeError(f"A batch may have at most {BATCH_MAX_PROMPTS} prompts, got {len(prompts)}.")
+    if any(len(prompt) > BATCH_PROMPT_MAX_CHARS for prompt in prompts):
+        raise RuntimeError(f"Batch prompts may be at most {BATCH_PROMPT_MAX_CHARS} characters long.")
+    batch = crud.create_story_batch(db, prompts, name=name, client_id=client_id, priority=BATCH_PRIORITY)
+    logger.info("Queued batch %s with %d stories", batch.id, batch.total, extra={"batch_id": batch.id})
+    return batch
+
+def progress(db: Session, batch) -> dict:
+    """The batch's stories per status, and whether every one of them has finished."""
+    counts = crud.count_batch_statuses(db, batch.id)
+    finished = sum(counts.get(status, 0) for status in FINISHED_STATUSES)
+    return {
+        "batch_id": batch.id,
+        "name": batch.name,
+        "total": batch.total,
+        "counts": counts,
+        "complete": counts.get("complete", 0),
+        "failed": counts.get("failed", 0),
+        "finished": finished >= batch.total,
+        "created_at": batch.created_at,
+    }
+
+def _read_prompts(path: str) -> list[str]:
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+def _progress(batch_id: int) -> dict:
+    db = database.SessionLocal()
+    try:
+        return progress(db, crud.get_batch(db, batch_id))
+    finally:
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Queue and generate a batch of stories.")
+    parser.add_argument("prompts", help="File with one prompt per line.")
+    parser.add_argument("--name", help="Label for the batch.")
+    parser.add_argument("--concurrency", type=int, default=BATCH_WORKER_CONCURRENCY,
+                        help="Stories to generate at once in this process; 0 to only queue them for other workers.")
+    parser.add_argument("--progress-seconds", type=float, default=BATCH_PROGRESS_SECONDS,
+                        help="How often to report the batch's progress.")
+    args = parser.parse_args()
+
+    telemetry.configure_logging()
+    database.init_db()
+    db = database.SessionLocal()
+    try:
+        batch_id = submit(db, _read_prompts(args.prompts), name=args.name).id
+    finally:
+        db.close()
+    if args.concurrency <= 0:
+        return
+
+    from . import worker
+
+    batch_worker = worker.Worker(concurrency=args.concurrency)
+    batch_worker.start()
+    started = time.monotonic()
+    try:
+        while True:
+            state = _progress(batch_id)
+            logger.info("Batch %s: %d of %d complete, %d failed (%s)", batch_id, state["complete"], state["total"],
+                        state["failed"], ", ".join(f"{s} {n}" for s, n in sorted(state["counts"].items())),
+                        extra={"batch_id": batch_id})
+            if state["finished"]:
+                break
+            time.sleep(args.progress_seconds)
+    finally:
+        batch_worker.stop(timeout=0)
+    elapsed = time.monotonic() - started
+    logger.info("Batch %s finished in %.0f seconds (%.2f stories per minute)", batch_id, elapsed,
+                state["total"] * 60 / max(elapsed, 1e-9), extra={"batch_id": batch_id})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Content-addressed cache for generated outlines, sections and audio chunks.
+
+Keys are hashes of everything that determines a result (prompt, model,
+generation config, voice, ...), so an identical request is served from the
+cache without calling Gemini or Text-to-Speech again. Both backends are
+bounded by size and evict the least recently used entries first.
+
+Configured with:
+    CACHE_BACKEND    "disk" (default), "gcs" or "none"
+    CACHE_DIR        directory for the disk backend
+    CACHE_MAX_BYTES  size bound for either backend
+    CACHE_GCS_PREFIX object prefix for the GCS backend
+"""
+import hashlib
+from datetime import datetime, timezone
+import json
+import os
+import tempfile
+import threading
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "disk")
+CACHE_DIR = os.getenv("CACHE_DIR", "/var/data/cache")
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+CACHE_GCS_PREFIX = os.getenv("CACHE_GCS_PREFIX", "cache/")
+
+def make_key(*parts) -> str:
+    """Hashes the JSON form of `parts` into a cache key."""
+    encoded = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+class DiskCache:
+    """Stores one file per key under `directory`; file mtimes track recency."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return value
+
+    def set(self, key: str, value: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so readers never see a partial entry.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(value)
+
+        with self._lock:
+            # An overwritten entry gives back its old size.
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(value) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        """Deletes least recently used entries until the cache is at 90% of its bound."""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        size = sum(entry_size for _, entry_size, _ in entries)
+        target = self.max_bytes * 0.9
+        for path, entry_size, _ in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        self._size = size
+
+class GCSCache:
+    """
+    Stores one object per key in a bucket. Hits patch the object's metadata,
+    which bumps its `updated` time, so eviction can drop the least recently
+    used objects first. Eviction lists the prefix, so it only runs every
+    `evict_every` writes.
+    """
+
+    def __init__(self, bucket_name: str, prefix: str, max_bytes: int, evict_every: int = 50):
+        from . import clients
+
+        self.bucket = clients.bucket(bucket_name)
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        from google.api_core.exceptions import NotFound
+
+        blob = self.bucket.blob(self.prefix + key)
+        try:
+            value = blob.download_as_bytes()
+        except NotFound:
+            return None
+        blob.metadata = {"last_access": datetime.now(timezone.utc).isoformat()}
+        blob.patch()
+        return value
+
+    def set(self, key: str, value: bytes):
+        self.bucket.blob(self.prefix + key).upload_from_string(value)
+        with self._lock:
+            self._writes += 1
+            due = self._writes % self.evict_every == 0
+        if due:
+            self._evict()
+
+    def _evict(self):
+        blobs = sorted(self.bucket.list_blobs(prefix=self.prefix), key=lambda blob: blob.updated)
+        size = sum(blob.size or 0 for blob in blobs)
+        target = self.max_bytes * 0.9
+        for blob in blobs:
+            if size <= target:
+                break
+            blob.delete()
+            size -= blob.size or 0
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Returns the configured cache backend, or None if caching is disabled."""
+    global _cache
+    if CACHE_BACKEND == "none":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            if CACHE_BACKEND == "gcs":
+                from .providers import GCS_BUCKET_NAME
+                _cache = GCSCache(GCS_BUCKET_NAME, CACHE_GCS_PREFIX, CACHE_MAX_BYTES)
+            elif CACHE_BACKEND == "disk":
+                _cache = DiskCache(CACHE_DIR, CACHE_MAX_BYTES)
+            else:
+                raise ValueError(f"Unknown cache backend: {CACHE_BACKEND}")
+        return _cache
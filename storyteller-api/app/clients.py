@@ -0,0 +1,116 @@
+"""
+Process-wide Google API clients.
+
+Credentials, the Cloud Storage client and Gemini models (with the API key
+configured on first use, not at import) are created once per process and
+reused, so their HTTP/gRPC connection pools stay warm between stories. The
+async Text-to-Speech clients hold gRPC channels that belong to the event
+loop they were created on, so those are kept once per loop.
+
+Everything is dropped in a forked child (gRPC channels and HTTP sessions
+must not be shared across a fork) and recreated there on first use. This
+covers uvicorn and gunicorn workers forked from a parent that has already
+made a client.
+"""
+import logging
+import os
+import threading
+import weakref
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_pid = os.getpid()
+_clients = {}
+_loop_clients = weakref.WeakKeyDictionary()
+
+def _reset():
+    global _lock, _pid
+    _lock = threading.Lock()
+    _pid = os.getpid()
+    _clients.clear()
+    _loop_clients.clear()
+
+os.register_at_fork(after_in_child=_reset)
+
+def _shared(name, factory):
+    """Returns the process's `name` client, creating it with `factory` on first use."""
+    if os.getpid() != _pid:
+        _reset()
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+def _per_loop(name, factory):
+    """Like `_shared`, but keeps one client per running event loop."""
+    import asyncio
+
+    if os.getpid() != _pid:
+        _reset()
+    loop = asyncio.get_running_loop()
+    clients = _loop_clients.setdefault(loop, {})
+    client = clients.get(name)
+    if client is None:
+        client = clients[name] = factory()
+    return client
+
+def credentials():
+    """The service account credentials named by GOOGLE_APPLICATION_CREDENTIALS."""
+    def load():
+        from google.oauth2 import service_account
+
+        gcp_credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+        if not gcp_credentials_path:
+            raise RuntimeError("GOOGLE_APPLICATION_CREDENTIALS not set.")
+        return service_account.Credentials.from_service_account_file(gcp_credentials_path)
+    return _shared("credentials", load)
+
+def storage_client():
+    def create():
+        from google.cloud import storage
+        return storage.Client()
+    return _shared("storage", create)
+
+def bucket(bucket_name: str):
+    return storage_client().bucket(bucket_name)
+
+def _configure_genai():
+    import google.generativeai as genai
+
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai
+
+def generative_model(model_name: str):
+    genai = _shared("genai", _configure_genai)
+    return _shared(f"gemini:{model_name}", lambda: genai.GenerativeModel(model_name))
+
+def tts_client():
+    """The async Text-to-Speech client for the running event loop."""
+    def create():
+        from google.cloud import texttospeech_v1 as texttospeech
+        return texttospeech.TextToSpeechAsyncClient(credentials=credentials())
+    return _per_loop("tts", create)
+
+def long_audio_client():
+    """The async Long Audio Synthesis client for the running event loop."""
+    def create():
+        from google.cloud import texttospeech_v1 as texttospeech
+        return texttospeech.TextToSpeechLongAudioSynthesizeAsyncClient(credentials=credentials())
+    return _per_loop("long_audio", create)
+
+def warm(model_names=()):
+    """
+    Creates the shared clients ahead of the first story, so connection setup
+    is not on its critical path. Failures are logged and left for the first
+    real use to report.
+    """
+    factories = [credentials, storage_client] + [lambda name=name: generative_model(name) for name in model_names]
+    for factory in factories:
+        try:
+            factory()
+        except Exception as e:
+            logger.warning("Could not create Google clients ahead of time: %s", e)
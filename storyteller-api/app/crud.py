@@ -1,34 +1,429 @@
+from datetime import timedelta
+import hashlib
+import json
+from sqlalchemy import func, insert, or_
 from sqlalchemy.orm import Session
-from . import database
+from . import database, events, storytext
 
-def create_story_task(db: Session, prompt: str):
-    """Creates an initial record for a story generation task."""
-    db_story = database.StoryDB(prompt=prompt, status="pending")
+# Statuses a story can be in while it still needs (or is receiving) work.
+ACTIVE_STATUSES = ("pending", "generating_story", "generating_audio")
+
+def prompt_hash(prompt: str) -> str:
+    """Hash of the prompt with case and whitespace normalized, for spotting duplicate requests."""
+    normalized = " ".join(prompt.lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+def create_story_task(db: Session, prompt: str, client_id: str | None = None, idempotency_key: str | None = None):
+    """
+    Creates an initial record for a story generation task. Raises
+    IntegrityError if `client_id` already used `idempotency_key`.
+    """
+    db_story = database.StoryDB(
+        prompt=prompt,
+        status="pending",
+        client_id=client_id,
+        idempotency_key=idempotency_key,
+        prompt_hash=prompt_hash(prompt),
+    )
     db.add(db_story)
     db.commit()
     db.refresh(db_story)
     return db_story
 
+def create_story_batch(db: Session, prompts: list[str], name: str | None = None,
+                       client_id: str | None = None, priority: int = 0):
+    """
+    Creates a batch and a pending story for every prompt in it, with a single
+    multi-row INSERT for the stories and one commit for the lot.
+    """
+    batch = database.StoryBatchDB(name=name, client_id=client_id, total=len(prompts))
+    db.add(batch)
+    db.flush()
+    now = database.utcnow()
+    db.execute(
+        insert(database.StoryDB),
+        [
+            {
+                "prompt": prompt,
+                "status": "pending",
+                "client_id": client_id,
+                "prompt_hash": prompt_hash(prompt),
+                "batch_id": batch.id,
+                "priority": priority,
+                "created_at": now,
+            }
+            for prompt in prompts
+        ],
+    )
+    db.commit()
+    db.refresh(batch)
+    return batch
+
+def get_batch(db: Session, batch_id: int):
+    return db.query(database.StoryBatchDB).filter(database.StoryBatchDB.id == batch_id).first()
+
+def count_batch_statuses(db: Session, batch_id: int) -> dict[str, int]:
+    """Number of the batch's stories in each status."""
+    rows = (
+        db.query(database.StoryDB.status, func.count(database.StoryDB.id))
+        .filter(database.StoryDB.batch_id == batch_id)
+        .group_by(database.StoryDB.status)
+        .all()
+    )
+    return {status: count for status, count in rows}
+
+def get_story_by_idempotency_key(db: Session, client_id: str | None, idempotency_key: str):
+    return (
+        db.query(database.StoryDB)
+        .filter(database.StoryDB.client_id == client_id, database.StoryDB.idempotency_key == idempotency_key)
+        .first()
+    )
+
+def get_active_story_by_prompt(db: Session, prompt: str):
+    """
+    The newest story outside batches for the same normalized prompt that is
+    still queued or being generated. Batch stories are queued at a lower
+    priority, so an interactive request is never attached to one.
+    """
+    return (
+        db.query(database.StoryDB)
+        .filter(
+            database.StoryDB.prompt_hash == prompt_hash(prompt),
+            database.StoryDB.status.in_(ACTIVE_STATUSES),
+            database.StoryDB.batch_id.is_(None),
+        )
+        .order_by(database.StoryDB.id.desc())
+        .first()
+    )
+
+def _in_batch(batched: bool):
+    return database.StoryDB.batch_id.isnot(None) if batched else database.StoryDB.batch_id.is_(None)
+
+def count_active_stories(db: Session, client_id: str | None = None, batched: bool = False) -> int:
+    """
+    Stories queued or being generated, optionally only those `client_id` asked
+    for. Counts either stories outside batches or, with `batched`, batch stories.
+    """
+    query = db.query(func.count(database.StoryDB.id)).filter(
+        database.StoryDB.status.in_(ACTIVE_STATUSES), _in_batch(batched)
+    )
+    if client_id is not None:
+        query = query.filter(database.StoryDB.client_id == client_id)
+    return query.scalar()
+
+def count_pending_stories(db: Session, batched: bool = False) -> int:
+    """Stories outside batches (or, with `batched`, batch stories) waiting for a worker."""
+    return (
+        db.query(func.count(database.StoryDB.id))
+        .filter(database.StoryDB.status == "pending", _in_batch(batched))
+        .scalar()
+    )
+
 def get_story(db: Session, story_id: int):
     """Gets a story by its ID."""
     return db.query(database.StoryDB).filter(database.StoryDB.id == story_id).first()
 
 def update_story_status(db: Session, story_id: int, status: str):
-    """Updates the status of a story."""
+    """
+    Updates the status of a story. Each stage's timestamps are only recorded
+    the first time it is reached, so attempts resumed after a failure still
+    count from when the story was first started.
+    """
     db_story = get_story(db, story_id)
     if db_story:
         db_story.status = status
+        now = database.utcnow()
+        if status == "generating_story":
+            db_story.story_started_at = db_story.story_started_at or now
+        elif status == "generating_audio":
+            db_story.story_finished_at = db_story.story_finished_at or now
+            db_story.audio_started_at = db_story.audio_started_at or now
         db.commit()
         db.refresh(db_story)
+        events.publish(story_id, {"status": status})
     return db_story
 
 def complete_story(db: Session, story_id: int, story_text: str, audio_url: str):
     """Marks a story as complete and saves the final data."""
     db_story = get_story(db, story_id)
     if db_story:
-        db_story.story_text = story_text
+        db.merge(_story_text_row(story_id, story_text))
+        # The finished text supersedes the generation checkpoints.
+        db.query(database.StorySectionDB).filter(database.StorySectionDB.story_id == story_id).delete()
         db_story.audio_url = audio_url
         db_story.status = "complete"
+        db_story.audio_finished_at = database.utcnow()
         db.commit()
         db.refresh(db_story)
+        events.publish(story_id, {"status": "complete", "audio_url": audio_url})
     return db_story
+
+def _story_text_row(story_id: int, text: str):
+    encoding, body = storytext.encode(text)
+    return database.StoryTextDB(
+        story_id=story_id,
+        encoding=encoding,
+        body=body,
+        etag=storytext.etag(text),
+        size=len(text.encode("utf-8")),
+    )
+
+def get_story_text(db: Session, story_id: int):
+    """Gets a story's text row; its `body` is only read from the database when accessed."""
+    return db.query(database.StoryTextDB).filter(database.StoryTextDB.story_id == story_id).first()
+
+def claim_next_story(db: Session, worker_id: str, lease_seconds: int, max_attempts: int):
+    """
+    Claims the oldest story of the highest priority that needs work and
+    leases it to `worker_id`.
+
+    Unclaimed pending stories are eligible, as are stories of any active status
+    whose lease has expired (their worker died mid-job). The claim is a
+    conditional UPDATE, so two workers racing for the same row cannot both win;
+    on Postgres, rows another worker is busy claiming are skipped altogether.
+    Stories that have already used up `max_attempts` are marked failed instead.
+    """
+    StoryDB = database.StoryDB
+    while True:
+        now = database.utcnow()
+        candidate = (
+            db.query(StoryDB.id, StoryDB.attempts)
+            .filter(
+                StoryDB.status.in_(ACTIVE_STATUSES),
+                or_(StoryDB.claimed_by.is_(None), StoryDB.lease_expires_at < now),
+            )
+            .order_by(StoryDB.priority.desc(), StoryDB.id)
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+        if candidate is None:
+            return None
+
+        claimable = (
+            StoryDB.id == candidate.id,
+            StoryDB.status.in_(ACTIVE_STATUSES),
+            or_(StoryDB.claimed_by.is_(None), StoryDB.lease_expires_at < now),
+        )
+        if (candidate.attempts or 0) >= max_attempts:
+            failed = db.query(StoryDB).filter(*claimable).update(
+                {"status": "failed", "claimed_by": None, "lease_expires_at": None},
+                synchronize_session=False,
+            )
+            db.commit()
+            if failed:
+                events.publish(candidate.id, {"status": "failed"})
+            continue
+
+        claimed = db.query(StoryDB).filter(*claimable).update(
+            {
+                "claimed_by": worker_id,
+                "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                "heartbeat_at": now,
+                "attempts": StoryDB.attempts + 1,
+            },
+            synchronize_session=False,
+        )
+        db.commit()
+        if claimed:
+            return get_story(db, candidate.id)
+
+def heartbeat_stories(db: Session, worker_id: str, story_ids, lease_seconds: int) -> int:
+    """Extends the lease on every story in `story_ids` still held by `worker_id`."""
+    if not story_ids:
+        return 0
+    now = database.utcnow()
+    updated = (
+        db.query(database.StoryDB)
+        .filter(database.StoryDB.id.in_(list(story_ids)), database.StoryDB.claimed_by == worker_id)
+        .update(
+            {"heartbeat_at": now, "lease_expires_at": now + timedelta(seconds=lease_seconds)},
+            synchronize_session=False,
+        )
+    )
+    db.commit()
+    return updated
+
+def requeue_story(db: Session, story_id: int):
+    """
+    Puts a story whose attempt failed back in the queue. It becomes claimable
+    again once its worker releases it, and resumes from its checkpoints.
+    """
+    db.query(database.StoryDB).filter(database.StoryDB.id == story_id).update(
+        {"status": "pending"}, synchronize_session=False
+    )
+    db.commit()
+    events.publish(story_id, {"status": "pending", "retrying": True})
+
+def retry_story(db: Session, story_id: int) -> bool:
+    """
+    Queues a failed story for another round of attempts, timed afresh.
+    Returns False if it has not failed.
+    """
+    retried = db.query(database.StoryDB).filter(
+        database.StoryDB.id == story_id, database.StoryDB.status == "failed"
+    ).update(
+        {
+            "status": "pending", "attempts": 0, "claimed_by": None, "lease_expires_at": None,
+            "story_started_at": None, "story_finished_at": None,
+            "audio_started_at": None, "audio_finished_at": None,
+        },
+        synchronize_session=False,
+    )
+    db.commit()
+    if retried:
+        events.publish(story_id, {"status": "pending", "retrying": True})
+    return bool(retried)
+
+def release_story(db: Session, story_id: int, worker_id: str):
+    """Drops `worker_id`'s claim on a story once it has finished with it."""
+    db.query(database.StoryDB).filter(
+        database.StoryDB.id == story_id, database.StoryDB.claimed_by == worker_id
+    ).update({"claimed_by": None, "lease_expires_at": None}, synchronize_session=False)
+    db.commit()
+
+def save_segment(db: Session, story_id: int, idx: int, **fields):
+    """Creates or updates the segment `idx` of a story."""
+    segment = (
+        db.query(database.StorySegmentDB)
+        .filter(database.StorySegmentDB.story_id == story_id, database.StorySegmentDB.idx == idx)
+        .first()
+    )
+    if segment is None:
+        segment = database.StorySegmentDB(story_id=story_id, idx=idx)
+        db.add(segment)
+    for name, value in fields.items():
+        setattr(segment, name, value)
+    db.commit()
+    db.refresh(segment)
+    if segment.status == "ready":
+        events.publish(story_id, {"segment": idx, "segment_url": segment.audio_url})
+    return segment
+
+def save_outline(db: Session, story_id: int, story_points: list[str]):
+    db.query(database.StoryDB).filter(database.StoryDB.id == story_id).update(
+        {"outline": json.dumps(story_points)}, synchronize_session=False
+    )
+    db.commit()
+
+def save_section_checkpoint(db: Session, story_id: int, idx: int, **fields):
+    """Creates or updates the checkpoint for section `idx` of a story."""
+    section = (
+        db.query(database.StorySectionDB)
+        .filter(database.StorySectionDB.story_id == story_id, database.StorySectionDB.idx == idx)
+        .first()
+    )
+    if section is None:
+        section = database.StorySectionDB(story_id=story_id, idx=idx)
+        db.add(section)
+    for name, value in fields.items():
+        setattr(section, name, value)
+    db.commit()
+
+def get_checkpoint(db: Session, story_id: int) -> tuple[list[str] | None, dict]:
+    """Returns a story's saved outline (or None) and its section checkpoints by index."""
+    outline = db.query(database.StoryDB.outline).filter(database.StoryDB.id == story_id).scalar()
+    sections = (
+        db.query(database.StorySectionDB)
+        .filter(database.StorySectionDB.story_id == story_id)
+        .all()
+    )
+    return (
+        json.loads(outline) if outline else None,
+        {section.idx: {"context": section.context, "text": section.text} for section in sections},
+    )
+
+def get_pool_entries(db: Session, status: str | None = None):
+    """Pool entries, optionally only those whose story has `status`."""
+    query = db.query(database.StoryPoolDB)
+    if status is not None:
+        query = query.join(database.StoryDB, database.StoryDB.id == database.StoryPoolDB.story_id).filter(
+            database.StoryDB.status == status
+        )
+    return query.order_by(database.StoryPoolDB.id).all()
+
+def save_pool_entry(db: Session, seed_prompt: str, story_id: int):
+    """Points the pool entry for `seed_prompt` at `story_id`, creating it if needed."""
+    entry = db.query(database.StoryPoolDB).filter(database.StoryPoolDB.seed_prompt == seed_prompt).first()
+    if entry is None:
+        entry = database.StoryPoolDB(seed_prompt=seed_prompt)
+        db.add(entry)
+    entry.story_id = story_id
+    db.commit()
+
+def mark_pool_entry_served(db: Session, entry_id: int):
+    db.query(database.StoryPoolDB).filter(database.StoryPoolDB.id == entry_id).update(
+        {"served": database.StoryPoolDB.served + 1}, synchronize_session=False
+    )
+    db.commit()
+
+def get_segments(db: Session, story_id: int):
+    """Gets a story's segments in playback order."""
+    return (
+        db.query(database.StorySegmentDB)
+        .filter(database.StorySegmentDB.story_id == story_id)
+        .order_by(database.StorySegmentDB.idx)
+        .all()
+    )
+
+def has_segments(db: Session, story_id: int) -> bool:
+    """Whether any audio segments have been recorded for a story."""
+    return db.query(
+        db.query(database.StorySegmentDB).filter(database.StorySegmentDB.story_id == story_id).exists()
+    ).scalar()
+
+def _add_llm_calls(db: Session, story_id: int, llm_calls):
+    for call in llm_calls:
+        db.add(database.LLMCallDB(
+            story_id=story_id,
+            kind=call["kind"],
+            section=call.get("section"),
+            model=call.get("model"),
+            prompt_tokens=call.get("prompt_tokens"),
+            output_tokens=call.get("output_tokens"),
+            cached_tokens=call.get("cached_tokens"),
+            latency_ms=call.get("latency_ms"),
+            retries=call.get("retries", 0),
+            cached=call.get("cached", False),
+        ))
+
+def record_section_progress(db: Session, story_id: int, sections_done: int, sections_total: int, llm_calls=()):
+    """
+    Saves the section counter together with the LLM calls made since the last
+    write, in a single commit.
+    """
+    db.query(database.StoryDB).filter(database.StoryDB.id == story_id).update(
+        {"sections_done": sections_done, "sections_total": sections_total}, synchronize_session=False
+    )
+    _add_llm_calls(db, story_id, llm_calls)
+    db.commit()
+    events.publish(story_id, {"status": "generating_story", "sections_done": sections_done, "sections_total": sections_total})
+
+def record_llm_calls(db: Session, story_id: int, llm_calls):
+    """Saves LLM call records for a story."""
+    _add_llm_calls(db, story_id, llm_calls)
+    db.commit()
+
+def get_llm_calls(db: Session, story_id: int):
+    """Gets the LLM calls made for a story, in order."""
+    return (
+        db.query(database.LLMCallDB)
+        .filter(database.LLMCallDB.story_id == story_id)
+        .order_by(database.LLMCallDB.id)
+        .all()
+    )
+
+def get_recent_timings(db: Session, limit: int):
+    """Gets the creation and stage timestamps of the most recently completed stories."""
+    StoryDB = database.StoryDB
+    return (
+        db.query(StoryDB.created_at, StoryDB.story_started_at, StoryDB.story_finished_at,
+                 StoryDB.audio_started_at, StoryDB.audio_finished_at)
+        .filter(StoryDB.status == "complete")
+        .order_by(StoryDB.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+def get_recent_llm_calls(db: Session, limit: int):
+    """Gets the most recent LLM call records across all stories."""
+    return db.query(database.LLMCallDB).order_by(database.LLMCallDB.id.desc()).limit(limit).all()
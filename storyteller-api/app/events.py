@@ -0,0 +1,49 @@
+"""
+In-process pub/sub for story status changes.
+
+`crud` publishes an event whenever it writes a story's status, and the
+`/stories/{id}/events` stream forwards them to listeners, so clients do not
+have to poll the database. Publishers may run in any thread; every
+subscriber receives events on its own event loop.
+
+Events only reach subscribers in the same process. When stories are
+generated by separate worker processes, the stream falls back to an
+occasional database re-check.
+"""
+import asyncio
+import threading
+from contextlib import contextmanager
+
+_subscribers = {}
+_lock = threading.Lock()
+
+def publish(story_id: int, event: dict):
+    """Sends `event` to everyone subscribed to `story_id`."""
+    event = {"task_id": story_id, **event}
+    with _lock:
+        subscribers = list(_subscribers.get(story_id, ()))
+    for loop, queue in subscribers:
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+        except RuntimeError:
+            # The subscriber's loop has closed; it unsubscribes itself.
+            pass
+
+@contextmanager
+def subscribe(story_id: int):
+    """
+    Yields an asyncio.Queue that receives the events published for
+    `story_id` until the block exits. Must be used inside a running loop.
+    """
+    subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+    with _lock:
+        _subscribers.setdefault(story_id, set()).add(subscriber)
+    try:
+        yield subscriber[1]
+    finally:
+        with _lock:
+            subscribers = _subscribers.get(story_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del _subscribers[story_id]
@@ -1,9 +1,54 @@
 import os
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+import math
+import json
+import asyncio
+import ipaddress
+import logging
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
+from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.orm import Session
-from . import models, services, crud, database
+from . import models, audiofiles, batch, crud, database, worker, events, pool, providers, storytext, telemetry
+
+# Number of job slots the API process runs itself. Set to 0 when stories are
+# generated by separate `python -m app.worker` processes.
+EMBEDDED_WORKER_CONCURRENCY = int(os.getenv("EMBEDDED_WORKER_CONCURRENCY", str(worker.WORKER_CONCURRENCY)))
+
+# How long an event stream waits without events before re-reading the story
+# from the database. Only matters when a separate worker process, whose
+# events never reach this one, is generating the story.
+EVENTS_RECHECK_SECONDS = float(os.getenv("EVENTS_RECHECK_SECONDS", "30"))
+
+# Admission control for new stories. A client may have
+# CLIENT_MAX_ACTIVE_STORIES queued or generating at once, and no new story is
+# accepted while STORY_QUEUE_MAX_PENDING are waiting for a worker. 0 disables
+# either limit. Rejections carry Retry-After: ADMISSION_RETRY_AFTER_SECONDS.
+CLIENT_MAX_ACTIVE_STORIES = int(os.getenv("CLIENT_MAX_ACTIVE_STORIES", "5"))
+STORY_QUEUE_MAX_PENDING = int(os.getenv("STORY_QUEUE_MAX_PENDING", "100"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "30"))
+
+# A client is identified by its address. Requests from the proxies in
+# TRUSTED_PROXY_IPS (comma-separated addresses or CIDRs, see the Dockerfile)
+# are attributed to the rightmost X-Forwarded-For hop that is not itself a
+# trusted proxy: hops to its left are whatever the client chose to send. The
+# X-Client-Id header is only used instead when TRUST_CLIENT_ID_HEADER is set,
+# i.e. when a gateway in front of the API sets it; anyone can send a new value
+# on every request.
+TRUSTED_PROXY_IPS = [
+    ipaddress.ip_network(network.strip(), strict=False)
+    for network in os.getenv("TRUSTED_PROXY_IPS", "").split(",") if network.strip()
+]
+TRUST_CLIENT_ID_HEADER = os.getenv("TRUST_CLIENT_ID_HEADER", "").lower() in ("1", "true", "yes")
+
+# Retry-After sent with the 503 for a request that timed out waiting for a
+# database lock, e.g. while SQLite is held by a long write.
+DATABASE_BUSY_RETRY_AFTER_SECONDS = int(os.getenv("DATABASE_BUSY_RETRY_AFTER_SECONDS", "5"))
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
+embedded_worker = None
 
 # Dependency to get a DB session
 def get_db():
@@ -15,26 +60,178 @@ def get_db():
 
 @app.on_event("startup")
 def on_startup():
+    global embedded_worker
+    telemetry.configure_logging()
     database.init_db()
+    if EMBEDDED_WORKER_CONCURRENCY > 0:
+        embedded_worker = worker.Worker(concurrency=EMBEDDED_WORKER_CONCURRENCY)
+        embedded_worker.start()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    if embedded_worker:
+        embedded_worker.stop(timeout=0)
+
+@app.exception_handler(OperationalError)
+def database_busy(request: Request, exc: OperationalError):
+    """A request that could not get the database, typically a lock timeout, is a 503 the client may retry."""
+    logger.warning("Database unavailable for %s %s: %s", request.method, request.url.path, exc.orig)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The database is busy, try again shortly"},
+        headers={"Retry-After": str(DATABASE_BUSY_RETRY_AFTER_SECONDS)},
+    )
+
+def _trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXY_IPS)
+
+def _client_address(http_request: Request) -> str | None:
+    """The address of the client, looking through X-Forwarded-For only as far as trusted proxies added to it."""
+    host = http_request.client.host if http_request.client else None
+    if not host or not _trusted_proxy(host):
+        return host
+    hops = [hop.strip() for value in http_request.headers.getlist("x-forwarded-for") for hop in value.split(",")]
+    for hop in reversed([hop for hop in hops if hop]):
+        host = hop
+        if not _trusted_proxy(hop):
+            break
+    return host
+
+def _client_id(http_request: Request, x_client_id: str | None) -> str | None:
+    if TRUST_CLIENT_ID_HEADER and x_client_id:
+        return x_client_id
+    return _client_address(http_request)
+
+def _reject(status_code: int, result: str, detail: str):
+    telemetry.ADMISSIONS_TOTAL.inc(result=result)
+    raise HTTPException(
+        status_code=status_code, detail=detail, headers={"Retry-After": str(ADMISSION_RETRY_AFTER_SECONDS)}
+    )
+
+def _idempotent_replay(story, prompt: str) -> dict:
+    """The response for a repeated Idempotency-Key, which must come with the same prompt."""
+    if story.prompt_hash != crud.prompt_hash(prompt):
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different prompt")
+    telemetry.ADMISSIONS_TOTAL.inc(result="idempotent")
+    return {"task_id": story.id, "status": story.status, "duplicate": True}
 
 @app.post("/stories", response_model=models.StoryTaskResponse)
-async def create_story_task(
+def create_story_task(
     request: models.StoryRequest,
-    background_tasks: BackgroundTasks,
+    http_request: Request,
+    idempotency_key: str | None = Header(None),
+    x_client_id: str | None = Header(None),
     db: Session = Depends(get_db)
 ):
     """
-    Accepts a prompt and starts a background task to generate the story.
+    Accepts a prompt and queues the story for generation by a worker.
     Returns a task ID to check for status.
+
+    A repeated Idempotency-Key from the same client, or a prompt matching a
+    story that is still queued or generating, returns that story instead of
+    starting another; reusing a key with a different prompt is a 422. With
+    `allow_pooled`, a close enough match from the pre-generated pool is
+    returned already complete. New stories are refused with 429 when the
+    client is over its quota and with 503 when the queue is full.
     """
-    new_story = crud.create_story_task(db=db, prompt=request.prompt)
-    background_tasks.add_task(
-        services.generate_story_and_audio,
-        story_id=new_story.id,
-        prompt=request.prompt
-    )
+    client_id = _client_id(http_request, x_client_id)
+    if idempotency_key:
+        story = crud.get_story_by_idempotency_key(db=db, client_id=client_id, idempotency_key=idempotency_key)
+        if story:
+            return _idempotent_replay(story, request.prompt)
+    if request.allow_pooled:
+        story = pool.find_match(db=db, prompt=request.prompt)
+        if story:
+            telemetry.ADMISSIONS_TOTAL.inc(result="pooled")
+            return {"task_id": story.id, "status": story.status, "pooled": True}
+    story = crud.get_active_story_by_prompt(db=db, prompt=request.prompt)
+    if story:
+        telemetry.ADMISSIONS_TOTAL.inc(result="deduplicated")
+        return {"task_id": story.id, "status": story.status, "duplicate": True}
+
+    if CLIENT_MAX_ACTIVE_STORIES and crud.count_active_stories(db=db, client_id=client_id) >= CLIENT_MAX_ACTIVE_STORIES:
+        _reject(429, "client_quota", f"At most {CLIENT_MAX_ACTIVE_STORIES} stories may be in progress per client")
+    if STORY_QUEUE_MAX_PENDING and crud.count_pending_stories(db=db) >= STORY_QUEUE_MAX_PENDING:
+        _reject(503, "queue_full", "Too many stories are waiting to be generated")
+
+    try:
+        new_story = crud.create_story_task(
+            db=db, prompt=request.prompt, client_id=client_id, idempotency_key=idempotency_key
+        )
+    except IntegrityError:
+        # A concurrent request with the same Idempotency-Key won the race.
+        db.rollback()
+        story = crud.get_story_by_idempotency_key(db=db, client_id=client_id, idempotency_key=idempotency_key)
+        return _idempotent_replay(story, request.prompt)
+    telemetry.ADMISSIONS_TOTAL.inc(result="created")
+    if embedded_worker:
+        embedded_worker.notify()
     return {"task_id": new_story.id, "status": "pending"}
 
+@app.post("/stories:batch", response_model=models.StoryBatchResponse, status_code=202)
+def create_story_batch(
+    request: models.StoryBatchRequest,
+    http_request: Request,
+    x_client_id: str | None = Header(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Queues a story for every prompt, up to BATCH_MAX_PROMPTS of at most
+    BATCH_PROMPT_MAX_CHARS characters each, as one batch. Batch stories wait
+    behind interactive ones. A batch is refused with 429
+    when it would take the client over BATCH_CLIENT_MAX_ACTIVE_STORIES batch
+    stories in progress and with 503 when it would take the batch queue over
+    BATCH_QUEUE_MAX_PENDING. Progress is reported for the whole batch at `status_url`.
+    """
+    if any(not prompt.strip() for prompt in request.prompts):
+        raise HTTPException(status_code=422, detail="Every prompt must be non-empty")
+    client_id = _client_id(http_request, x_client_id)
+    size = len(request.prompts)
+    if batch.BATCH_CLIENT_MAX_ACTIVE_STORIES:
+        active = crud.count_active_stories(db=db, client_id=client_id, batched=True)
+        if active + size > batch.BATCH_CLIENT_MAX_ACTIVE_STORIES:
+            _reject(429, "batch_client_quota",
+                    f"At most {batch.BATCH_CLIENT_MAX_ACTIVE_STORIES} batch stories may be in progress per client")
+    if batch.BATCH_QUEUE_MAX_PENDING:
+        pending = crud.count_pending_stories(db=db, batched=True)
+        if pending + size > batch.BATCH_QUEUE_MAX_PENDING:
+            _reject(503, "batch_queue_full", "Too many batch stories are waiting to be generated")
+    try:
+        new_batch = batch.submit(db=db, prompts=request.prompts, name=request.name, client_id=client_id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    telemetry.ADMISSIONS_TOTAL.inc(result="batch_created")
+    if embedded_worker:
+        embedded_worker.notify()
+    return {"batch_id": new_batch.id, "total": new_batch.total, "status_url": f"/batches/{new_batch.id}"}
+
+@app.get("/batches/{batch_id}", response_model=models.StoryBatchStatusResponse)
+def get_batch_status(batch_id: int, db: Session = Depends(get_db)):
+    """Returns how many of a batch's stories are in each status."""
+    story_batch = crud.get_batch(db=db, batch_id=batch_id)
+    if not story_batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch.progress(db=db, batch=story_batch)
+
+@app.post("/stories/{story_id}/retry", response_model=models.StoryTaskResponse)
+def retry_story_task(story_id: int, db: Session = Depends(get_db)):
+    """
+    Queues a failed story again. It continues from the sections written
+    before it failed.
+    """
+    story = crud.get_story(db=db, story_id=story_id)
+    if not story:
+        raise HTTPException(status_code=404, detail="Story not found")
+    if not crud.retry_story(db=db, story_id=story_id):
+        raise HTTPException(status_code=409, detail=f"Story is {story.status}, not failed")
+    if embedded_worker:
+        embedded_worker.notify()
+    return {"task_id": story_id, "status": "pending"}
+
 @app.get("/stories/{story_id}", response_model=models.StoryStatusResponse)
 def get_story_status(story_id: int, db: Session = Depends(get_db)):
     """
@@ -43,9 +240,298 @@ def get_story_status(story_id: int, db: Session = Depends(get_db)):
     story = crud.get_story(db=db, story_id=story_id)
     if not story:
         raise HTTPException(status_code=404, detail="Story not found")
+    playlist_url = None
+    if crud.has_segments(db=db, story_id=story.id):
+        playlist_url = f"/stories/{story.id}/playlist.m3u8"
     return {
         "task_id": story.id,
         "status": story.status,
-        "audio_url": story.audio_url,
-        "story_text": story.story_text
+        "audio_url": _audio_url(story.id, story.audio_url),
+        "text_url": f"/stories/{story.id}/text" if story.status == "complete" else None,
+        "playlist_url": playlist_url,
+        "sections_done": story.sections_done,
+        "sections_total": story.sections_total,
+        "story_started_at": story.story_started_at,
+        "story_finished_at": story.story_finished_at,
+        "audio_started_at": story.audio_started_at,
+        "audio_finished_at": story.audio_finished_at
     }
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # If-None-Match uses weak comparison, so a W/ prefix still matches.
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+@app.get("/stories/{story_id}/text")
+def get_story_text(
+    story_id: int,
+    if_none_match: str | None = Header(None),
+    accept_encoding: str | None = Header(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Returns a finished story's text as plain UTF-8. Supports If-None-Match,
+    and serves gzip-stored text as-is to clients that accept gzip.
+    """
+    text_row = crud.get_story_text(db=db, story_id=story_id)
+    if not text_row:
+        if not crud.get_story(db=db, story_id=story_id):
+            raise HTTPException(status_code=404, detail="Story not found")
+        raise HTTPException(status_code=404, detail="Story text is not ready")
+
+    # The gzip body is a different representation, so it gets its own ETag.
+    gzipped = text_row.encoding == "gzip" and "gzip" in (accept_encoding or "")
+    etag = text_row.etag[:-1] + '-gzip"' if gzipped else text_row.etag
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=text_row.body, media_type="text/plain; charset=utf-8", headers=headers)
+    text = storytext.decode(text_row.encoding, text_row.body)
+    return Response(content=text, media_type="text/plain; charset=utf-8", headers=headers)
+
+@app.api_route("/stories/{story_id}/audio", methods=["GET", "HEAD"])
+def get_story_audio(story_id: int, if_none_match: str | None = Header(None), db: Session = Depends(get_db)):
+    """
+    Returns a finished story's audio. Audio in the local store is served
+    here, with byte ranges, a strong ETag and Cache-Control; audio in GCS is
+    a redirect to its public URL.
+    """
+    story = crud.get_story(db=db, story_id=story_id)
+    if not story:
+        raise HTTPException(status_code=404, detail="Story not found")
+    if not story.audio_url:
+        raise HTTPException(status_code=404, detail="Story audio is not ready")
+
+    path = providers.get_blob_store().local_path(story.audio_url)
+    if path is None:
+        return RedirectResponse(story.audio_url, status_code=307)
+    return _audio_file_response(path, if_none_match)
+
+def _audio_file_response(path: str, if_none_match: str | None):
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Audio is missing from storage")
+    etag = audiofiles.etag(path, stat_result)
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": audiofiles.CACHE_CONTROL})
+    return audiofiles.AudioFileResponse(path, stat_result)
+
+def get_local_audio_file(name: str, if_none_match: str | None = Header(None)):
+    """
+    Serves a file from the local blob store (section segments, and the URLs
+    stored for finished stories) the same way as /stories/{id}/audio.
+    """
+    path = providers.get_blob_store().local_path(f"{providers.LOCAL_STORAGE_URL.rstrip('/')}/{name}")
+    if path is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return _audio_file_response(path, if_none_match)
+
+if providers.STORAGE_PROVIDER == "local":
+    # Audio published to the local blob store is served by the API itself.
+    app.add_api_route(f"{providers.LOCAL_STORAGE_URL.rstrip('/')}/{{name}}", get_local_audio_file, methods=["GET", "HEAD"])
+
+def _audio_url(story_id: int, audio_url: str | None) -> str | None:
+    """Where clients should fetch a story's audio: this API for the local store, else its public URL."""
+    if audio_url and providers.get_blob_store().local_path(audio_url) is not None:
+        return f"/stories/{story_id}/audio"
+    return audio_url
+
+def _seconds_between(start, end):
+    if start is None or end is None:
+        return None
+    return (end - start).total_seconds()
+
+def _stage_seconds(story) -> dict:
+    return {
+        "queue_wait": _seconds_between(story.created_at, story.story_started_at),
+        "story": _seconds_between(story.story_started_at, story.story_finished_at),
+        "audio": _seconds_between(story.audio_started_at, story.audio_finished_at),
+        "total": _seconds_between(story.created_at, story.audio_finished_at),
+    }
+
+def _percentile(values: list, fraction: float):
+    """Nearest-rank percentile of `values`, or None if there are none."""
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return values[min(len(values) - 1, math.ceil(fraction * len(values)) - 1)]
+
+def _summarize(values: list) -> dict:
+    return {"p50": _percentile(values, 0.5), "p95": _percentile(values, 0.95), "count": len([v for v in values if v is not None])}
+
+@app.get("/stories/{story_id}/metrics", response_model=models.StoryMetricsResponse)
+def get_story_metrics(story_id: int, db: Session = Depends(get_db)):
+    """
+    Returns how long each stage of a story took and every LLM call it made,
+    with token counts, latency and retries.
+    """
+    story = crud.get_story(db=db, story_id=story_id)
+    if not story:
+        raise HTTPException(status_code=404, detail="Story not found")
+    return {
+        "task_id": story.id,
+        "status": story.status,
+        "stage_seconds": _stage_seconds(story),
+        "llm_calls": crud.get_llm_calls(db=db, story_id=story_id),
+    }
+
+@app.get("/health")
+def get_health():
+    """200 while the embedded worker (if any) can process stories, 503 otherwise."""
+    if embedded_worker and not embedded_worker.healthy:
+        return Response(content="worker unhealthy\n", status_code=503, media_type="text/plain")
+    return Response(content="ok\n", media_type="text/plain")
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics for this process, including its embedded worker."""
+    return Response(content=telemetry.render_metrics(), media_type=telemetry.METRICS_CONTENT_TYPE)
+
+@app.get("/metrics/stages", response_model=models.StageMetricsResponse)
+def get_stage_metrics(limit: int = 500, db: Session = Depends(get_db)):
+    """
+    Returns p50/p95 stage durations over the last `limit` completed stories,
+    and p50/p95 latency and tokens per LLM call kind over the last
+    `limit` * 30 calls.
+    """
+    stories = crud.get_recent_timings(db=db, limit=limit)
+    stage_values = {}
+    for story in stories:
+        for stage, seconds in _stage_seconds(story).items():
+            stage_values.setdefault(stage, []).append(seconds)
+
+    call_values = {}
+    for call in crud.get_recent_llm_calls(db=db, limit=limit * 30):
+        kind = call_values.setdefault(call.kind, {"latency_ms": [], "prompt_tokens": [], "output_tokens": [], "retries": []})
+        kind["latency_ms"].append(call.latency_ms)
+        kind["prompt_tokens"].append(call.prompt_tokens)
+        kind["output_tokens"].append(call.output_tokens)
+        kind["retries"].append(call.retries)
+
+    llm_calls = {}
+    for kind, values in call_values.items():
+        llm_calls[kind] = {"count": len(values["latency_ms"]), "retries": sum(values["retries"])}
+        for field in ("latency_ms", "prompt_tokens", "output_tokens"):
+            llm_calls[kind][f"{field}_p50"] = _percentile(values[field], 0.5)
+            llm_calls[kind][f"{field}_p95"] = _percentile(values[field], 0.95)
+
+    return {
+        "stories": len(stories),
+        "stages": {stage: _summarize(values) for stage, values in stage_values.items()},
+        "llm_calls": llm_calls,
+    }
+
+def _story_snapshot(story_id: int):
+    db = database.SessionLocal()
+    try:
+        story = crud.get_story(db=db, story_id=story_id)
+        if not story:
+            return None
+        return {"task_id": story.id, "status": story.status, "audio_url": _audio_url(story.id, story.audio_url)}
+    finally:
+        db.close()
+
+def _sse(event: dict) -> str:
+    return f"event: status\ndata: {json.dumps(event)}\n\n"
+
+@app.get("/stories/{story_id}/events")
+async def stream_story_events(story_id: int):
+    """
+    Streams a story's status changes as Server-Sent Events: the current
+    status first, then every status, section and segment update as it is
+    written. The stream ends once the story is complete or failed.
+    """
+    snapshot = await run_in_threadpool(_story_snapshot, story_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Story not found")
+
+    async def event_stream():
+        terminal = ("complete", "failed")
+        with events.subscribe(story_id) as queue:
+            # Re-read after subscribing so no update can slip in between.
+            last = await run_in_threadpool(_story_snapshot, story_id)
+            # A snapshot of None means the story was deleted; end the stream.
+            if last is None:
+                return
+            yield _sse(last)
+            if last["status"] in terminal:
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENTS_RECHECK_SECONDS)
+                except asyncio.TimeoutError:
+                    event = await run_in_threadpool(_story_snapshot, story_id)
+                    if event is None:
+                        return
+                    if event == last:
+                        yield ": keep-alive\n\n"
+                        continue
+                    last = event
+                else:
+                    if event.get("audio_url"):
+                        event = {**event, "audio_url": _audio_url(story_id, event["audio_url"])}
+                    if "status" in event:
+                        # `last` is the status the client has been sent, by
+                        # either path, so neither one sends it twice.
+                        sent = {"task_id": story_id, "status": event["status"], "audio_url": event.get("audio_url")}
+                        if sent == last:
+                            continue
+                        last = sent
+                yield _sse(event)
+                if event.get("status") in terminal:
+                    return
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/stories/{story_id}/playlist.m3u8")
+def get_story_playlist(story_id: int, db: Session = Depends(get_db)):
+    """
+    Returns an HLS-style event playlist of the story's audio segments. Only the
+    unbroken run of ready segments from the start is listed, and the playlist
+    is closed with EXT-X-ENDLIST once the story is complete, so players can
+    start after the first section and keep reloading until then.
+    """
+    story = crud.get_story(db=db, story_id=story_id)
+    if not story:
+        raise HTTPException(status_code=404, detail="Story not found")
+
+    segments = crud.get_segments(db=db, story_id=story_id)
+    if not segments:
+        # Only progressively generated stories have segments, and they are
+        # advertised in `playlist_url` once the first one is recorded.
+        raise HTTPException(status_code=404, detail="Story has no audio segments")
+
+    ready = []
+    for segment in segments:
+        if segment.idx != len(ready) or segment.status != "ready":
+            break
+        ready.append(segment)
+
+    target_duration = max((math.ceil(s.duration_seconds or 0) for s in ready), default=0)
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        "#EXT-X-PLAYLIST-TYPE:EVENT",
+        f"#EXT-X-TARGETDURATION:{target_duration}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+    ]
+    for segment in ready:
+        lines.append(f"#EXTINF:{segment.duration_seconds:.3f},")
+        lines.append(segment.audio_url)
+    if story.status in ("complete", "failed"):
+        lines.append("#EXT-X-ENDLIST")
+    return Response(
+        content="\n".join(lines) + "\n",
+        media_type="application/vnd.apple.mpegurl",
+        headers={"Cache-Control": "no-cache"},
+    )
@@ -0,0 +1,147 @@
+"""
+Versioned schema migrations.
+
+`create_all` creates tables that do not exist yet but never changes existing
+ones, so every other schema change is a numbered migration in MIGRATIONS.
+The version applied so far is kept in the one-row `schema_version` table, and
+`run` applies anything newer in order, each in its own transaction.
+
+Table creation and each migration hold a write lock on `schema_version`
+while they run, so API and worker processes starting at the same time apply
+them exactly once. Migrations
+must also be safe to run on a database whose tables `create_all` has just
+created with the latest columns, which `add_column` takes care of.
+
+Run them ahead of a deploy with:
+
+    python -m app.migrations
+"""
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from . import database, storytext
+
+logger = logging.getLogger(__name__)
+
+def add_column(conn, table_name: str, column_name: str):
+    """Adds a column, as currently declared on the model, unless it already exists."""
+    existing = {column["name"] for column in inspect(conn).get_columns(table_name)}
+    if column_name in existing:
+        return
+    column = database.Base.metadata.tables[table_name].columns[column_name]
+    column_type = column.type.compile(dialect=conn.dialect)
+    default = ""
+    if column.server_default is not None:
+        default = f" DEFAULT '{column.server_default.arg}'"
+    elif not column.nullable:
+        default = " DEFAULT 0"
+    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}{default}"))
+
+def _add_queue_and_timing_columns(conn):
+    """Columns added to `stories` before migrations existed."""
+    for column_name in (
+        "status", "created_at",
+        "claimed_by", "lease_expires_at", "heartbeat_at", "attempts",
+        "sections_done", "sections_total",
+        "story_started_at", "story_finished_at", "audio_started_at", "audio_finished_at",
+    ):
+        add_column(conn, "stories", column_name)
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_stories_status ON stories (status)"))
+
+def _move_story_text(conn):
+    """Moves finished stories' text from `stories.story_text` into `story_texts`."""
+    existing = {column["name"] for column in inspect(conn).get_columns("stories")}
+    if "story_text" not in existing:
+        return
+    rows = conn.execute(text(
+        "SELECT id, story_text FROM stories WHERE story_text IS NOT NULL "
+        "AND id NOT IN (SELECT story_id FROM story_texts)"
+    ))
+    for story_id, story_text in rows.fetchall():
+        encoding, body = storytext.encode(story_text)
+        conn.execute(
+            database.StoryTextDB.__table__.insert().values(
+                story_id=story_id,
+                encoding=encoding,
+                body=body,
+                etag=storytext.etag(story_text),
+                size=len(story_text.encode("utf-8")),
+                created_at=database.utcnow(),
+            )
+        )
+    conn.execute(text("ALTER TABLE stories DROP COLUMN story_text"))
+
+def _add_outline_column(conn):
+    add_column(conn, "stories", "outline")
+
+def _add_admission_columns(conn):
+    for column_name in ("client_id", "idempotency_key", "prompt_hash"):
+        add_column(conn, "stories", column_name)
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_stories_client_id ON stories (client_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_stories_prompt_hash ON stories (prompt_hash)"))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_stories_client_idempotency_key ON stories (client_id, idempotency_key)"
+    ))
+
+def _add_cached_tokens_column(conn):
+    add_column(conn, "llm_calls", "cached_tokens")
+
+def _add_batch_columns(conn):
+    for column_name in ("batch_id", "priority"):
+        add_column(conn, "stories", column_name)
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_stories_batch_id ON stories (batch_id)"))
+
+# (version, description, function taking a connection), in order.
+MIGRATIONS = [
+    (1, "add status, job queue and stage timing columns to stories", _add_queue_and_timing_columns),
+    (2, "move story text into story_texts", _move_story_text),
+    (3, "add outline checkpoint to stories", _add_outline_column),
+    (4, "add client, idempotency key and prompt hash to stories", _add_admission_columns),
+    (5, "add cached prompt token counts to llm_calls", _add_cached_tokens_column),
+    (6, "add batch and queue priority to stories", _add_batch_columns),
+]
+
+def _ensure_version_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (id INTEGER PRIMARY KEY, version INTEGER NOT NULL)"))
+    try:
+        with engine.begin() as conn:
+            if conn.execute(text("SELECT 1 FROM schema_version WHERE id = 1")).first() is None:
+                conn.execute(text("INSERT INTO schema_version (id, version) VALUES (1, 0)"))
+    except IntegrityError:
+        # Another process inserted the row first.
+        pass
+
+def current_version(engine) -> int:
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT version FROM schema_version WHERE id = 1")).scalar_one()
+
+def _lock(conn):
+    """
+    Takes the write lock on `schema_version` for the rest of the transaction,
+    so the version read next cannot go stale while a migration runs.
+    """
+    conn.execute(text("UPDATE schema_version SET version = version WHERE id = 1"))
+
+def run(engine):
+    """Creates missing tables, then applies every migration newer than the database's schema version."""
+    _ensure_version_table(engine)
+    with engine.begin() as conn:
+        _lock(conn)
+        database.Base.metadata.create_all(bind=conn)
+    for version, description, migrate in MIGRATIONS:
+        with engine.begin() as conn:
+            _lock(conn)
+            applied = conn.execute(text("SELECT version FROM schema_version WHERE id = 1")).scalar_one()
+            if applied >= version:
+                continue
+            logger.info("Applying migration %d: %s", version, description)
+            migrate(conn)
+            conn.execute(text("UPDATE schema_version SET version = :version WHERE id = 1"), {"version": version})
+
+if __name__ == "__main__":
+    from . import telemetry
+
+    telemetry.configure_logging()
+    database.init_db()
+    logger.info("Database is at schema version %d", current_version(database.engine))
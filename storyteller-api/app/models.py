@@ -1,17 +1,80 @@
-from pydantic import BaseModel
+from datetime import datetime
+from typing import Annotated
+from pydantic import BaseModel, ConfigDict, Field, StringConstraints
+from .batch import BATCH_MAX_PROMPTS, BATCH_PROMPT_MAX_CHARS
 
 class StoryRequest(BaseModel):
     prompt: str
+    # Accept an already finished story from the pool if one matches the prompt closely.
+    allow_pooled: bool = False
 
 class StoryTaskResponse(BaseModel):
     task_id: int
     status: str
+    # True when the request was attached to an existing task instead of starting one.
+    duplicate: bool = False
+    # True when a finished story from the pre-generated pool was returned.
+    pooled: bool = False
+
+class StoryBatchRequest(BaseModel):
+    prompts: list[Annotated[str, StringConstraints(max_length=BATCH_PROMPT_MAX_CHARS)]] = Field(
+        ..., min_length=1, max_length=BATCH_MAX_PROMPTS
+    )
+    name: str | None = None
+
+class StoryBatchResponse(BaseModel):
+    batch_id: int
+    total: int
+    status_url: str
+
+class StoryBatchStatusResponse(BaseModel):
+    batch_id: int
+    name: str | None = None
+    total: int
+    # Number of the batch's stories in each status.
+    counts: dict[str, int]
+    complete: int = 0
+    failed: int = 0
+    # True once every story is complete or failed.
+    finished: bool = False
+    created_at: datetime | None = None
 
 class StoryStatusResponse(BaseModel):
     task_id: int
     status: str
     audio_url: str | None = None
-    story_text: str | None = None
+    text_url: str | None = None
+    playlist_url: str | None = None
+    sections_done: int = 0
+    sections_total: int | None = None
+    story_started_at: datetime | None = None
+    story_finished_at: datetime | None = None
+    audio_started_at: datetime | None = None
+    audio_finished_at: datetime | None = None
+
+class LLMCall(BaseModel):
+    kind: str
+    section: int | None = None
+    model: str | None = None
+    prompt_tokens: int | None = None
+    output_tokens: int | None = None
+    cached_tokens: int | None = None
+    latency_ms: int | None = None
+    retries: int = 0
+    cached: bool = False
+
+    model_config = ConfigDict(from_attributes=True)
+
+class StoryMetricsResponse(BaseModel):
+    task_id: int
+    status: str
+    stage_seconds: dict[str, float | None]
+    llm_calls: list[LLMCall]
+
+class StageMetricsResponse(BaseModel):
+    stories: int
+    stages: dict[str, dict[str, float | None]]
+    llm_calls: dict[str, dict[str, float | None]]
 
 class StorySection(BaseModel):
     story_section_text: str
@@ -19,9 +82,7 @@ class StorySection(BaseModel):
 class Story(BaseModel):
     id: int
     prompt: str
-    story_text: str | None = None
     audio_url: str | None = None
     status: str = "pending"
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,143 @@
+"""
+A pool of stories generated ahead of time for common themes.
+
+Stories for a list of seed prompts are generated offline through the normal
+queue and pipeline. A request that opts in with `allow_pooled` and whose
+prompt is close enough to a seed then gets that finished story straight
+away instead of waiting for a new one.
+
+Prompts are matched by keyword overlap: the Jaccard similarity of their
+content words, after lowercasing and dropping stop words and plural "s".
+A seed matches when the similarity is at least POOL_MIN_SIMILARITY.
+
+Fill or top up the pool with:
+
+    python -m app.pool --seeds seeds.txt --concurrency 4
+
+where seeds.txt has one prompt per line (DEFAULT_SEED_PROMPTS otherwise).
+Seeds whose story is finished or still being generated are left alone.
+"""
+import argparse
+import logging
+import os
+import re
+import time
+from sqlalchemy.orm import Session
+from . import crud, database, telemetry
+
+logger = logging.getLogger(__name__)
+
+POOL_MIN_SIMILARITY = float(os.getenv("POOL_MIN_SIMILARITY", "0.5"))
+# The client id pool stories are queued under.
+POOL_CLIENT_ID = "pool"
+
+DEFAULT_SEED_PROMPTS = [
+    "A sleepy cat curling up by a warm fire",
+    "A quiet walk through a moonlit garden",
+    "Drifting on gentle ocean waves under the stars",
+    "Floating slowly through space past distant planets",
+    "A snowy forest cabin on a calm winter night",
+    "A soft rain falling on a cozy countryside cottage",
+]
+
+_STOP_WORDS = {
+    "a", "an", "and", "the", "of", "to", "in", "on", "at", "by", "for", "with", "about", "into", "through",
+    "under", "over", "past", "from", "is", "are", "be", "my", "me", "i", "please", "tell", "write", "make",
+    "story", "stories", "tale", "bedtime", "sleep", "sleepy", "some", "that", "this", "who", "where",
+}
+_WORD = re.compile(r"[a-z]+")
+
+def keywords(prompt: str) -> set[str]:
+    """The prompt's content words, lowercased and with a plural "s" removed."""
+    words = set()
+    for word in _WORD.findall(prompt.lower()):
+        if word in _STOP_WORDS or len(word) < 3:
+            continue
+        if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+            word = word[:-1]
+        words.add(word)
+    return words
+
+def similarity(a: set[str], b: set[str]) -> float:
+    """Jaccard similarity of two keyword sets."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def find_match(db: Session, prompt: str, min_similarity: float = POOL_MIN_SIMILARITY):
+    """
+    Returns the finished pool story whose seed is most similar to `prompt`,
+    or None if none reaches `min_similarity`. Counts the story as served.
+    """
+    wanted = keywords(prompt)
+    best, best_score = None, min_similarity
+    for entry in crud.get_pool_entries(db, status="complete"):
+        score = similarity(wanted, keywords(entry.seed_prompt))
+        if score >= best_score:
+            best, best_score = entry, score
+    if best is None:
+        return None
+    crud.mark_pool_entry_served(db, best.id)
+    logger.info("Serving pooled story %s for seed %r (similarity %.2f)", best.story_id, best.seed_prompt, best_score)
+    return crud.get_story(db, best.story_id)
+
+def queue_seeds(db: Session, seed_prompts: list[str]) -> list[int]:
+    """Queues a story for every seed without a finished or in-progress one. Returns the new story ids."""
+    entries = {entry.seed_prompt: entry for entry in crud.get_pool_entries(db)}
+    queued = []
+    for seed_prompt in seed_prompts:
+        entry = entries.get(seed_prompt)
+        if entry is not None:
+            story = crud.get_story(db, entry.story_id)
+            if story and story.status != "failed":
+                continue
+        story = crud.create_story_task(db, prompt=seed_prompt, client_id=POOL_CLIENT_ID)
+        crud.save_pool_entry(db, seed_prompt, story.id)
+        queued.append(story.id)
+    return queued
+
+def _read_seeds(path: str | None) -> list[str]:
+    if not path:
+        return DEFAULT_SEED_PROMPTS
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate stories for the pre-generated story pool.")
+    parser.add_argument("--seeds", help="File with one seed prompt per line.")
+    parser.add_argument("--concurrency", type=int, default=2,
+                        help="Stories to generate at once in this process; 0 to only queue them for other workers.")
+    args = parser.parse_args()
+
+    telemetry.configure_logging()
+    database.init_db()
+    db = database.SessionLocal()
+    try:
+        story_ids = queue_seeds(db, _read_seeds(args.seeds))
+    finally:
+        db.close()
+    logger.info("Queued %d pool stories", len(story_ids))
+    if not story_ids or args.concurrency <= 0:
+        return
+
+    from . import worker
+
+    pool_worker = worker.Worker(concurrency=args.concurrency)
+    pool_worker.start()
+    try:
+        while True:
+            db = database.SessionLocal()
+            try:
+                statuses = [crud.get_story(db, story_id).status for story_id in story_ids]
+            finally:
+                db.close()
+            if all(status in ("complete", "failed") for status in statuses):
+                break
+            time.sleep(5)
+    finally:
+        pool_worker.stop(timeout=0)
+    logger.info("Pool stories finished: %d complete, %d failed",
+                statuses.count("complete"), statuses.count("failed"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Per-stage model and generation settings for story text.
+
+Every LLM call belongs to a stage (outline, plan, summary, section or
+continuity), and each stage has a profile: the model to call and tuning
+settings (temperature, max_output_tokens, top_p, top_k) merged into that
+call's generation config. Output format settings stay in the code.
+
+Profiles are built from, in increasing precedence:
+    LLM_PROFILE        a built-in set: "default" (every stage on DEFAULT_MODEL) or
+                       "economy" (the internal plan, summary and continuity calls on
+                       a smaller, faster model)
+    LLM_PROFILE_FILE   a JSON file mapping a stage, or "default" for every stage,
+                       to {"model": ..., "config": {...}}
+    LLM_MODEL_<STAGE>, LLM_TEMPERATURE_<STAGE>, LLM_MAX_OUTPUT_TOKENS_<STAGE>
+                       environment variables, e.g. LLM_MODEL_SUMMARY=gemini-1.5-flash-8b-001
+"""
+import json
+import os
+from dataclasses import dataclass, field
+
+STAGES = ("outline", "plan", "summary", "section", "continuity")
+# Stable, pinned versions, so a story's output (and its response cache keys)
+# do not change when Google moves the "gemini-1.5-flash" alias.
+DEFAULT_MODEL = "gemini-1.5-flash-002"
+SMALL_MODEL = "gemini-1.5-flash-8b-001"
+
+LLM_PROFILE = os.getenv("LLM_PROFILE", "default")
+LLM_PROFILE_FILE = os.getenv("LLM_PROFILE_FILE")
+
+# Stage (or "default") -> {"model": ..., "config": {...}}. Every profile is
+# applied on top of "default".
+BUILTIN_PROFILES = {
+    "default": {
+        "default": {"model": DEFAULT_MODEL},
+        "plan": {"config": {"temperature": 0.5}},
+        "summary": {"config": {"temperature": 0.5, "max_output_tokens": 512}},
+        "section": {"config": {"temperature": 0.7, "max_output_tokens": 8192}},
+        "continuity": {"config": {"temperature": 0.5, "max_output_tokens": 1024}},
+    },
+    "economy": {
+        "plan": {"model": SMALL_MODEL},
+        "summary": {"model": SMALL_MODEL},
+        "continuity": {"model": SMALL_MODEL},
+    },
+}
+
+@dataclass(frozen=True)
+class StageProfile:
+    model: str
+    config: dict = field(default_factory=dict)
+
+def _apply(profiles: dict, overrides: dict, source: str):
+    for stage, override in overrides.items():
+        targets = STAGES if stage == "default" else (stage,)
+        if stage != "default" and stage not in STAGES:
+            raise RuntimeError(f"Unknown stage {stage!r} in {source}; expected one of {', '.join(STAGES)}.")
+        for target in targets:
+            if "model" in override:
+                profiles[target]["model"] = override["model"]
+            profiles[target]["config"].update(override.get("config", {}))
+
+def load(profile_name: str = LLM_PROFILE, profile_file: str | None = LLM_PROFILE_FILE, environ=os.environ) -> dict:
+    """Builds the profile for every stage from the built-in set, the profile file and the environment."""
+    if profile_name not in BUILTIN_PROFILES:
+        raise RuntimeError(f"Unknown LLM_PROFILE {profile_name!r}; expected one of {', '.join(BUILTIN_PROFILES)}.")
+    profiles = {stage: {"model": DEFAULT_MODEL, "config": {}} for stage in STAGES}
+    _apply(profiles, BUILTIN_PROFILES["default"], "the default profile")
+    _apply(profiles, BUILTIN_PROFILES[profile_name], f"the {profile_name} profile")
+    if profile_file:
+        try:
+            with open(profile_file, encoding="utf-8") as f:
+                _apply(profiles, json.load(f), profile_file)
+        except (OSError, ValueError) as e:
+            raise RuntimeError(f"Could not read LLM_PROFILE_FILE {profile_file}: {e}")
+    for stage in STAGES:
+        suffix = stage.upper()
+        if environ.get(f"LLM_MODEL_{suffix}"):
+            profiles[stage]["model"] = environ[f"LLM_MODEL_{suffix}"]
+        if environ.get(f"LLM_TEMPERATURE_{suffix}"):
+            profiles[stage]["config"]["temperature"] = float(environ[f"LLM_TEMPERATURE_{suffix}"])
+        if environ.get(f"LLM_MAX_OUTPUT_TOKENS_{suffix}"):
+            profiles[stage]["config"]["max_output_tokens"] = int(environ[f"LLM_MAX_OUTPUT_TOKENS_{suffix}"])
+    return {stage: StageProfile(**values) for stage, values in profiles.items()}
+
+PROFILES = load()
+
+def get(stage: str) -> StageProfile:
+    return PROFILES[stage]
+
+def models() -> list[str]:
+    """Every model some stage uses."""
+    return sorted({profile.model for profile in PROFILES.values()})
+
+def generation_config(stage: str, base: dict) -> dict:
+    """`base` (the call's output format settings) with the stage's tuning settings added."""
+    return {**PROFILES[stage].config, **base}
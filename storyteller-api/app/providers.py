@@ -0,0 +1,281 @@
+"""
+Pluggable backends for text generation, speech synthesis and audio storage.
+
+The pipeline only talks to the three interfaces below, so each backend can
+be swapped per deployment:
+
+    LLM_PROVIDER      "gemini" (default) or "fake"
+    TTS_PROVIDER      "google" (default) or "fake"
+    STORAGE_PROVIDER  "gcs" (default) or "local"
+
+The local implementations need no network or credentials, so the whole
+pipeline can be run and load-tested offline:
+
+    FakeTextGenerator   deterministic text derived from the prompt, after
+                        FAKE_LLM_LATENCY_SECONDS per call
+    FakeSpeechSynthesizer  a quiet tone (or silence, FAKE_TTS_WAVEFORM=silence)
+                        as long as the text would take to read, after
+                        FAKE_TTS_LATENCY_SECONDS per request
+    LocalBlobStore      files under LOCAL_STORAGE_DIR, served by the API at
+                        LOCAL_STORAGE_URL and from GET /stories/{id}/audio
+"""
+import array
+import asyncio
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import wave
+from dataclasses import dataclass
+from . import clients
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+TTS_PROVIDER = os.getenv("TTS_PROVIDER", "google")
+STORAGE_PROVIDER = os.getenv("STORAGE_PROVIDER", "gcs")
+
+GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME", "storyteller-audio-bucket-mblevin")
+# Uploads are sent as resumable uploads in parts of this size, so a dropped
+# connection only resends the current part. Must be a multiple of 256 KiB.
+GCS_UPLOAD_CHUNK_BYTES = int(os.getenv("GCS_UPLOAD_CHUNK_BYTES", str(8 * 1024 * 1024)))
+
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", "/var/data/audio")
+LOCAL_STORAGE_URL = os.getenv("LOCAL_STORAGE_URL", "/files")
+
+FAKE_LLM_LATENCY_SECONDS = float(os.getenv("FAKE_LLM_LATENCY_SECONDS", "0.05"))
+FAKE_LLM_SECTION_WORDS = int(os.getenv("FAKE_LLM_SECTION_WORDS", "400"))
+FAKE_LLM_OUTLINE_POINTS = int(os.getenv("FAKE_LLM_OUTLINE_POINTS", "15"))
+FAKE_TTS_LATENCY_SECONDS = float(os.getenv("FAKE_TTS_LATENCY_SECONDS", "0.05"))
+FAKE_TTS_WORDS_PER_SECOND = float(os.getenv("FAKE_TTS_WORDS_PER_SECOND", "2.5"))
+FAKE_TTS_WAVEFORM = os.getenv("FAKE_TTS_WAVEFORM", "sine")
+
+@dataclass
+class TextResult:
+    text: str
+    prompt_tokens: int | None = None
+    output_tokens: int | None = None
+    # How many of the prompt tokens the provider served from its cache.
+    cached_tokens: int | None = None
+
+class TextGenerator:
+    """
+    Generates text for a prompt. `config` holds Gemini-style generation
+    settings (temperature, max_output_tokens, response_mime_type,
+    response_schema); `kind` names the pipeline step asking.
+    """
+    model_name: str
+
+    async def generate(self, prompt: str, config: dict, kind: str | None = None) -> TextResult:
+        raise NotImplementedError
+
+class SpeechSynthesizer:
+    """Reads text aloud, returning a mono LINEAR16 WAV file at `sample_rate`."""
+    name: str
+
+    async def synthesize(self, text: str, voice_name: str, sample_rate: int) -> bytes:
+        raise NotImplementedError
+
+class BlobStore:
+    """Stores published audio files under content-addressed names."""
+
+    def exists(self, name: str) -> bool:
+        raise NotImplementedError
+
+    def upload(self, path: str, name: str, content_type: str) -> str:
+        """Stores the file at `path` as `name`, publicly readable, and returns its URL."""
+        raise NotImplementedError
+
+    def public_url(self, name: str) -> str:
+        raise NotImplementedError
+
+    def local_path(self, url: str) -> str | None:
+        """The file on this machine behind a URL this store returned, or None if it is stored remotely."""
+        return None
+
+class GeminiTextGenerator(TextGenerator):
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    async def generate(self, prompt: str, config: dict, kind: str | None = None) -> TextResult:
+        model = clients.generative_model(self.model_name)
+        response = await model.generate_content_async(prompt, generation_config=config)
+        usage = getattr(response, "usage_metadata", None)
+        return TextResult(
+            text=response.text,
+            prompt_tokens=getattr(usage, "prompt_token_count", None),
+            output_tokens=getattr(usage, "candidates_token_count", None),
+            cached_tokens=getattr(usage, "cached_content_token_count", None),
+        )
+
+class GoogleSpeechSynthesizer(SpeechSynthesizer):
+    name = "google"
+
+    async def synthesize(self, text: str, voice_name: str, sample_rate: int) -> bytes:
+        from google.cloud import texttospeech_v1 as texttospeech
+
+        response = await clients.tts_client().synthesize_speech(
+            input=texttospeech.SynthesisInput(text=text),
+            voice=texttospeech.VoiceSelectionParams(language_code="en-US", name=voice_name),
+            audio_config=texttospeech.AudioConfig(
+                audio_encoding=texttospeech.AudioEncoding.LINEAR16,
+                sample_rate_hertz=sample_rate,
+            ),
+        )
+        return response.audio_content
+
+class GCSBlobStore(BlobStore):
+    def __init__(self, bucket_name: str):
+        self.bucket_name = bucket_name
+
+    def exists(self, name: str) -> bool:
+        return clients.bucket(self.bucket_name).blob(name).exists()
+
+    def upload(self, path: str, name: str, content_type: str) -> str:
+        blob = clients.bucket(self.bucket_name).blob(name, chunk_size=GCS_UPLOAD_CHUNK_BYTES)
+        # Object names are content hashes, so a published object never changes.
+        blob.cache_control = "public, max-age=31536000, immutable"
+        blob.upload_from_filename(path, content_type=content_type)
+        blob.make_public()
+        return self.public_url(name)
+
+    def public_url(self, name: str) -> str:
+        return f"https://storage.googleapis.com/{self.bucket_name}/{name}"
+
+class FakeTextGenerator(TextGenerator):
+    """
+    Answers every prompt with deterministic filler text in the shape the
+    pipeline expects for `kind`, after a fixed delay. The same prompt always
+    gets the same answer.
+    """
+    def __init__(self, model_name: str = "fake", latency_seconds: float = FAKE_LLM_LATENCY_SECONDS):
+        # Only reported, so calls can be told apart by the model they were routed to.
+        self.model_name = model_name
+        self.latency_seconds = latency_seconds
+
+    def _words(self, rng: random.Random, count: int) -> str:
+        vocabulary = ("soft", "moonlight", "drifting", "quiet", "meadow", "breathing", "slowly",
+                      "warm", "stars", "gentle", "river", "dreaming", "clouds", "calm", "night")
+        return " ".join(rng.choice(vocabulary) for _ in range(count))
+
+    def _answer(self, prompt: str, config: dict, kind: str | None) -> str:
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+        if kind == "outline":
+            return json.dumps({"outline": [f"Point {i + 1}: {self._words(rng, 6)}" for i in range(FAKE_LLM_OUTLINE_POINTS)]})
+        if kind == "plan":
+            return json.dumps({"states": [self._words(rng, 20) for _ in range(FAKE_LLM_OUTLINE_POINTS)]})
+        if kind == "summary":
+            return self._words(rng, 80)
+        if kind == "continuity":
+            return json.dumps({"story_section_text": self._words(rng, 40) + "."})
+        paragraphs = [self._words(rng, 80) + "." for _ in range(max(FAKE_LLM_SECTION_WORDS // 80, 1))]
+        text = "\n\n".join(paragraphs)
+        if config.get("response_mime_type") == "application/json":
+            return json.dumps({"story_section_text": text})
+        return text
+
+    async def generate(self, prompt: str, config: dict, kind: str | None = None) -> TextResult:
+        await asyncio.sleep(self.latency_seconds)
+        text = self._answer(prompt, config, kind)
+        return TextResult(text=text, prompt_tokens=len(prompt) // 4, output_tokens=len(text) // 4)
+
+class FakeSpeechSynthesizer(SpeechSynthesizer):
+    """Returns a quiet 200 Hz tone, or silence, as long as the text takes to read."""
+    name = "fake"
+
+    def __init__(self, latency_seconds: float = FAKE_TTS_LATENCY_SECONDS, waveform: str = FAKE_TTS_WAVEFORM):
+        self.latency_seconds = latency_seconds
+        self.waveform = waveform
+        self._seconds = {}
+
+    def _second(self, sample_rate: int) -> bytes:
+        """One second of the waveform as 16-bit PCM."""
+        if sample_rate not in self._seconds:
+            if self.waveform == "silence":
+                samples = array.array("h", bytes(2 * sample_rate))
+            else:
+                frequency = 200
+                samples = array.array("h", (int(1000 * math.sin(2 * math.pi * frequency * i / sample_rate))
+                                            for i in range(sample_rate)))
+            self._seconds[sample_rate] = samples.tobytes()
+        return self._seconds[sample_rate]
+
+    async def synthesize(self, text: str, voice_name: str, sample_rate: int) -> bytes:
+        await asyncio.sleep(self.latency_seconds)
+        seconds = len(text.split()) / FAKE_TTS_WORDS_PER_SECOND
+        second = self._second(sample_rate)
+        whole, part = divmod(int(seconds * sample_rate), sample_rate)
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes(second * whole + second[:part * 2])
+        return buffer.getvalue()
+
+class LocalBlobStore(BlobStore):
+    """Keeps files in `directory`; the API serves them under `base_url`."""
+
+    def __init__(self, directory: str, base_url: str):
+        self.directory = directory
+        self.base_url = base_url.rstrip("/")
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(os.path.join(self.directory, name))
+
+    def upload(self, path: str, name: str, content_type: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        os.close(fd)
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        return self.public_url(name)
+
+    def public_url(self, name: str) -> str:
+        return f"{self.base_url}/{name}"
+
+    def local_path(self, url: str) -> str | None:
+        name = url.removeprefix(self.base_url + "/")
+        if name == url or not name or name != os.path.basename(name) or name.startswith("."):
+            return None
+        return os.path.join(self.directory, name)
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+def _get(name: str, factory):
+    with _providers_lock:
+        if name not in _providers:
+            _providers[name] = factory()
+        return _providers[name]
+
+def warm(model_names=()):
+    """Creates the Google clients the configured providers use ahead of the first story."""
+    model_names = list(model_names) if LLM_PROVIDER == "gemini" else []
+    if model_names or TTS_PROVIDER == "google" or STORAGE_PROVIDER == "gcs":
+        clients.warm(model_names)
+
+def get_text_generator(model_name: str) -> TextGenerator:
+    """The LLM_PROVIDER text generator for `model_name`."""
+    if LLM_PROVIDER == "fake":
+        return _get(f"llm:fake:{model_name}", lambda: FakeTextGenerator(model_name))
+    if LLM_PROVIDER == "gemini":
+        return _get(f"llm:gemini:{model_name}", lambda: GeminiTextGenerator(model_name))
+    raise ValueError(f"Unknown LLM provider: {LLM_PROVIDER}")
+
+def get_speech_synthesizer() -> SpeechSynthesizer:
+    if TTS_PROVIDER == "fake":
+        return _get("tts:fake", FakeSpeechSynthesizer)
+    if TTS_PROVIDER == "google":
+        return _get("tts:google", GoogleSpeechSynthesizer)
+    raise ValueError(f"Unknown TTS provider: {TTS_PROVIDER}")
+
+def get_blob_store() -> BlobStore:
+    if STORAGE_PROVIDER == "local":
+        return _get("storage:local", lambda: LocalBlobStore(LOCAL_STORAGE_DIR, LOCAL_STORAGE_URL))
+    if STORAGE_PROVIDER == "gcs":
+        return _get("storage:gcs", lambda: GCSBlobStore(GCS_BUCKET_NAME))
+    raise ValueError(f"Unknown storage provider: {STORAGE_PROVIDER}")
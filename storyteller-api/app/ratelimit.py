@@ -0,0 +1,136 @@
+"""
+Rate limiting and retries for Gemini and Text-to-Speech requests.
+
+Every request first takes a token from its service's bucket, so a burst of
+stories queues up behind the project quota instead of tripping it. A request
+that still fails with a quota or transient error (429, 500, 503, 504,
+timeouts) is retried with jittered exponential backoff, but never past the
+deadline of the job it belongs to.
+
+Configured with:
+    LLM_REQUESTS_PER_MINUTE   Gemini requests per minute for this process (0: unlimited)
+    TTS_REQUESTS_PER_MINUTE   Text-to-Speech requests per minute for this process (0: unlimited)
+    RATE_LIMIT_BURST_SECONDS  how many seconds' worth of requests may be sent at once
+    RETRY_MAX_ATTEMPTS        attempts per request, including the first
+    RETRY_BASE_SECONDS        backoff before the first retry; doubles each time
+    RETRY_MAX_BACKOFF_SECONDS upper bound on a single backoff
+    JOB_DEADLINE_SECONDS      time budget for retries within one story
+
+Quotas are per project, so with several worker processes set the per-minute
+limits to each process's share.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from . import telemetry
+
+logger = logging.getLogger(__name__)
+
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "300"))
+TTS_REQUESTS_PER_MINUTE = float(os.getenv("TTS_REQUESTS_PER_MINUTE", "300"))
+RATE_LIMIT_BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", "2"))
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = float(os.getenv("RETRY_BASE_SECONDS", "1"))
+RETRY_MAX_BACKOFF_SECONDS = float(os.getenv("RETRY_MAX_BACKOFF_SECONDS", "60"))
+JOB_DEADLINE_SECONDS = float(os.getenv("JOB_DEADLINE_SECONDS", "1800"))
+
+# HTTP status codes (as carried by google.api_core exceptions) worth retrying.
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average, with bursts of up to
+    `capacity`. Shared by every thread and event loop in the process: each
+    caller reserves the next token under a lock and then sleeps until it is
+    due, so waiting requests go out evenly spaced, in the order they asked.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Takes a token and returns how many seconds to wait before using it."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    async def acquire(self, service: str):
+        wait = self.reserve()
+        if wait > 0:
+            telemetry.RATE_LIMIT_WAIT_SECONDS.observe(wait, service=service)
+            await asyncio.sleep(wait)
+
+def _bucket(requests_per_minute: float) -> TokenBucket:
+    rate = requests_per_minute / 60
+    return TokenBucket(rate, rate * RATE_LIMIT_BURST_SECONDS)
+
+BUCKETS = {
+    "llm": _bucket(LLM_REQUESTS_PER_MINUTE),
+    "tts": _bucket(TTS_REQUESTS_PER_MINUTE),
+}
+
+# Monotonic time after which the current job stops retrying, if set.
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+@contextmanager
+def deadline(seconds: float = JOB_DEADLINE_SECONDS):
+    """Limits retries within the block, and any tasks it starts, to `seconds` from now."""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether `error` is a quota or transient failure that may succeed if sent again."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, "code", None)
+    if callable(code):
+        # gRPC errors expose their status through a method.
+        code = getattr(code(), "name", None)
+        return code in ("RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED", "INTERNAL")
+    return code in RETRYABLE_CODES
+
+def backoff_seconds(retry: int) -> float:
+    """Full-jitter exponential backoff before retry number `retry` (starting at 1)."""
+    return random.uniform(0, min(RETRY_MAX_BACKOFF_SECONDS, RETRY_BASE_SECONDS * 2 ** (retry - 1)))
+
+async def call(service: str, fn, *args, max_attempts: int = RETRY_MAX_ATTEMPTS, **kwargs):
+    """
+    Awaits `fn(*args, **kwargs)` under `service`'s rate limit ("llm" or
+    "tts"), retrying retryable errors. Returns `(result, retries)`. The last
+    error is raised once attempts or the job's deadline run out.
+    """
+    bucket = BUCKETS[service]
+    retries = 0
+    while True:
+        await bucket.acquire(service)
+        try:
+            return await fn(*args, **kwargs), retries
+        except Exception as e:
+            if not is_retryable(e) or retries + 1 >= max_attempts:
+                raise
+            delay = backoff_seconds(retries + 1)
+            job_deadline = _deadline.get()
+            if job_deadline is not None and time.monotonic() + delay > job_deadline:
+                logger.warning("Not retrying %s request: backing off would run past the job's deadline", service)
+                raise
+            retries += 1
+            telemetry.RETRIES_TOTAL.inc(service=service)
+            logger.warning("Retrying %s request in %.1f seconds (retry %d): %s", service, delay, retries, e)
+            await asyncio.sleep(delay)
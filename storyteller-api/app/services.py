@@ -1,43 +1,297 @@
 import os
-import requests
+import asyncio
+import contextvars
+import time
 import json
-import random
-from sqlalchemy.orm import Session
-from google.cloud import storage
-from . import models, crud, database
-import google.generativeai as genai
-
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
-GCS_BUCKET_NAME = "storyteller-audio-bucket-mblevin"
+import hashlib
+import logging
+import weakref
+import collections
+import tempfile
+import shutil
+import wave
+from . import models, crud, database, audio, cache, clients, profiles, providers, ratelimit, telemetry, transcode
+
+logger = logging.getLogger(__name__)
+
+GCS_BUCKET_NAME = providers.GCS_BUCKET_NAME
+
+
+VOICES = [
+    "en-US-Chirp3-HD-Achernar",
+    "en-US-Chirp3-HD-Gacrux",
+    "en-US-Chirp3-HD-Leda",
+    "en-US-Chirp3-HD-Sulafat",
+]
+
+# "chunked" synthesizes the story in pieces and stitches them locally;
+# "long_audio" submits it as a single Long Audio Synthesis job.
+TTS_ENGINE = os.getenv("TTS_ENGINE", "chunked")
+TTS_MAX_CONCURRENCY = int(os.getenv("TTS_MAX_CONCURRENCY", "4"))
+TTS_SAMPLE_RATE = 24000
+# Publish each section's audio as a segment as soon as it is written.
+PROGRESSIVE_AUDIO = os.getenv("PROGRESSIVE_AUDIO", "").lower() in ("1", "true", "yes")
+# Silence inserted for each "[pause long]" marker by the chunked engine.
+PAUSE_LONG_SECONDS = float(os.getenv("PAUSE_LONG_SECONDS", "2.0"))
+
+# Upper bound on Gemini requests in flight per event loop. Every story driven
+# by the same loop shares it, so many stories can run concurrently without
+# exceeding the API's concurrency quota.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+
+# "sequential" writes each section after summarizing the story so far;
+# "parallel" plans every section up front and writes them all at once.
+STORY_GENERATION_MODE = os.getenv("STORY_GENERATION_MODE", "sequential")
+
+# "full" re-summarizes the whole story before every section; "rolling" updates
+# the previous summary with just the newest section, so the prompt stays small.
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "full")
+
+# Appended after every section; the TTS step turns it into a long pause.
+SECTION_SEPARATOR = "\n\n[pause long]\n\n"
+
+_llm_semaphores = weakref.WeakKeyDictionary()
+
+# Per-story list that `_generate_content` appends call statistics to, if set.
+_llm_calls = contextvars.ContextVar("llm_calls", default=None)
+
+async def _cache_get(key: str, kind: str) -> bytes | None:
+    backend = cache.get_cache()
+    if backend is None:
+        return None
+    try:
+        value = await asyncio.to_thread(backend.get, key)
+    except Exception as e:
+        logger.warning("Cache read failed: %s", e)
+        return None
+    telemetry.CACHE_LOOKUPS_TOTAL.inc(kind=kind, result="hit" if value is not None else "miss")
+    return value
+
+async def _cache_set(key: str, value: bytes):
+    backend = cache.get_cache()
+    if backend is None:
+        return
+    try:
+        await asyncio.to_thread(backend.set, key, value)
+    except Exception as e:
+        logger.warning("Cache write failed: %s", e)
+
+def _llm_semaphore() -> asyncio.Semaphore:
+    """Returns the LLM semaphore for the running event loop."""
+    loop = asyncio.get_running_loop()
+    semaphore = _llm_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        _llm_semaphores[loop] = semaphore
+    return semaphore
+
+async def _generate_content(prompt: str, generation_config: dict, kind: str,
+                            section: int | None = None) -> providers.TextResult:
+    """
+    Calls the text generator under the LLM rate limit and semaphore, retrying
+    quota and transient errors, and records the call's token counts, latency
+    and retries. `kind` is the pipeline step ("outline", "summary", "section",
+    ...) and `section` the zero-based section index, where there is one. The
+    model and tuning settings come from the step's profile (see `profiles`),
+    added to the output format settings in `generation_config`.
+
+    Responses are cached by model, prompt and generation config, so a repeat
+    of the same call costs no tokens.
+    """
+    model = providers.get_text_generator(profiles.get(kind).model)
+    generation_config = profiles.generation_config(kind, generation_config)
+    key = cache.make_key("llm", model.model_name, prompt, repr(generation_config))
+    started = time.perf_counter()
+    cached = await _cache_get(key, "llm")
+    retries = 0
+    if cached is not None:
+        response = providers.TextResult(cached.decode("utf-8"), prompt_tokens=0, output_tokens=0)
+        latency_ms = round((time.perf_counter() - started) * 1000)
+    else:
+        async def attempt():
+            # The semaphore is only held while a request is in flight, not during backoff.
+            async with _llm_semaphore():
+                with telemetry.span("llm." + kind, model=model.model_name, section=section if section is not None else -1):
+                    started = time.perf_counter()
+                    response = await model.generate(prompt, generation_config, kind=kind)
+                    elapsed = time.perf_counter() - started
+                telemetry.LLM_CALL_SECONDS.observe(elapsed, kind=kind, model=model.model_name)
+                return response, elapsed
+
+        (response, elapsed), retries = await ratelimit.call("llm", attempt)
+        latency_ms = round(elapsed * 1000)
+        if response.text:
+            await _cache_set(key, response.text.encode("utf-8"))
+
+    call = {
+        "kind": kind,
+        "section": section,
+        "model": model.model_name,
+        "prompt_tokens": response.prompt_tokens,
+        "output_tokens": response.output_tokens,
+        "cached_tokens": response.cached_tokens,
+        "latency_ms": latency_ms,
+        "cached": cached is not None,
+        "retries": retries,
+    }
+    for token_type in ("prompt", "output", "cached"):
+        count = call[f"{token_type}_tokens"]
+        if count:
+            telemetry.LLM_TOKENS_TOTAL.inc(count, kind=kind, model=model.model_name, type=token_type)
+    logger.info("Gemini %s call finished", kind, extra={"llm_call": call})
+    calls = _llm_calls.get()
+    if calls is not None:
+        calls.append(call)
+    return response
+
+def _log_llm_usage(calls: list[dict]):
+    """Logs prompt/output token totals and latency per call kind."""
+    totals = {}
+    for call in calls:
+        total = totals.setdefault(call["kind"], {"calls": 0, "prompt_tokens": 0, "output_tokens": 0, "latency_ms": 0})
+        total["calls"] += 1
+        total["prompt_tokens"] += call["prompt_tokens"] or 0
+        total["output_tokens"] += call["output_tokens"] or 0
+        total["latency_ms"] += call["latency_ms"]
+    for kind, total in totals.items():
+        logger.info("Gemini usage for %s: %d calls, %d prompt tokens, %d output tokens, %d ms",
+                    kind, total["calls"], total["prompt_tokens"], total["output_tokens"], total["latency_ms"],
+                    extra={"llm_usage": {"kind": kind, **total}})
 
 def generate_story_and_audio(story_id: int, prompt: str):
     """
     The background task that generates the story, converts it to audio,
     and updates the database.
     """
-    db = database.SessionLocal()
+    asyncio.run(generate_story_and_audio_async(story_id, prompt))
+
+async def generate_story_and_audio_async(story_id: int, prompt: str, final_attempt: bool = True):
+    """
+    Async version of `generate_story_and_audio`. With PROGRESSIVE_AUDIO set,
+    each section is synthesized and published as a segment as soon as it is
+    written, so playback can start long before the whole story is done.
+
+    The outline and every section are checkpointed as they are generated, and
+    a story that already has checkpoints continues from them. If this is not
+    the `final_attempt`, a failed story goes back in the queue to be resumed
+    instead of being marked failed.
+    """
+    progress = _ProgressRecorder(story_id)
+    checkpoint = _Checkpoint(story_id)
+    telemetry.JOBS_IN_FLIGHT.inc()
     try:
-        crud.update_story_status(db, story_id, "generating_story")
-        story_text = generate_story_text(prompt)
-        
-        crud.update_story_status(db, story_id, "generating_audio")
-        audio_url = convert_text_to_audio(story_text)
-        
-        crud.complete_story(db, story_id, story_text, audio_url)
-        
+        with telemetry.span("story", story_id=story_id), telemetry.STAGE_SECONDS.time(stage="total"), \
+                ratelimit.deadline():
+            await checkpoint.load()
+            await _run_crud(crud.update_story_status, story_id, "generating_story")
+            if PROGRESSIVE_AUDIO:
+                story_text, audio_url = await _generate_progressively(story_id, prompt, progress, checkpoint)
+            else:
+                with telemetry.span("story.text"), telemetry.STAGE_SECONDS.time(stage="story"):
+                    story_text = await generate_story_text_async(
+                        prompt, llm_calls=progress.llm_calls, on_section=progress.section_done,
+                        checkpoint=checkpoint,
+                    )
+                await progress.flush()
+
+                await _run_crud(crud.update_story_status, story_id, "generating_audio")
+                with telemetry.span("story.audio"), telemetry.STAGE_SECONDS.time(stage="audio"):
+                    audio_url = await convert_text_to_audio_async(story_text)
+
+            await _run_crud(crud.complete_story, story_id, story_text, audio_url)
+        telemetry.JOBS_TOTAL.inc(outcome="complete")
+        logger.info("Story %s complete", story_id, extra={"story_id": story_id})
+
     except Exception as e:
-        print(f"!!! [ERROR] Background task failed for story {story_id}: {e}")
-        crud.update_story_status(db, story_id, "failed")
+        await progress.flush()
+        if final_attempt:
+            telemetry.JOBS_TOTAL.inc(outcome="failed")
+            logger.exception("Background task failed for story %s: %s", story_id, e, extra={"story_id": story_id})
+            await _run_crud(crud.update_story_status, story_id, "failed")
+        else:
+            telemetry.JOBS_TOTAL.inc(outcome="retried")
+            logger.exception("Attempt failed for story %s, requeueing it: %s", story_id, e, extra={"story_id": story_id})
+            await _run_crud(crud.requeue_story, story_id)
+    finally:
+        telemetry.JOBS_IN_FLIGHT.dec()
+
+class _Checkpoint:
+    """
+    A story's saved generation progress: its outline and, per section, the
+    context the section is written from and its text. Each is saved as soon
+    as it is produced. With no `story_id`, nothing is loaded or saved.
+    """
+
+    def __init__(self, story_id: int | None = None):
+        self.story_id = story_id
+        self.outline = None
+        self.sections = {}
+
+    async def load(self):
+        if self.story_id is None:
+            return
+        self.outline, self.sections = await _run_crud(crud.get_checkpoint, self.story_id)
+        if self.outline:
+            done = sum(1 for section in self.sections.values() if section["text"] is not None)
+            logger.info("Resuming story %s with %d of %d sections already written",
+                        self.story_id, done, len(self.outline), extra={"story_id": self.story_id})
+
+    def context(self, i: int) -> str | None:
+        return self.sections.get(i, {}).get("context")
+
+    def text(self, i: int) -> str | None:
+        return self.sections.get(i, {}).get("text")
+
+    async def save_outline(self, story_points: list[str]):
+        self.outline = story_points
+        if self.story_id is not None:
+            await _run_crud(crud.save_outline, self.story_id, story_points)
+
+    async def save_section(self, i: int, **fields):
+        self.sections.setdefault(i, {"context": None, "text": None}).update(fields)
+        if self.story_id is not None:
+            await _run_crud(crud.save_section_checkpoint, self.story_id, i, **fields)
+
+class _ProgressRecorder:
+    """
+    Persists a story's section counter along with the LLM calls made since
+    the previous write, so progress costs one small commit per section.
+    """
+
+    def __init__(self, story_id: int):
+        self.story_id = story_id
+        self.llm_calls = []
+        self._written = 0
+
+    def _unwritten_calls(self) -> list[dict]:
+        calls = self.llm_calls[self._written:]
+        self._written = len(self.llm_calls)
+        return calls
+
+    async def section_done(self, i: int, total: int, section_text: str):
+        await _run_crud(crud.record_section_progress, self.story_id, i + 1, total, self._unwritten_calls())
+
+    async def flush(self):
+        calls = self._unwritten_calls()
+        if calls:
+            await _run_crud(crud.record_llm_calls, self.story_id, calls)
+
+def _with_session(fn, *args, **kwargs):
+    db = database.SessionLocal()
+    try:
+        return fn(db, *args, **kwargs)
     finally:
         db.close()
 
-def generate_story_text(prompt: str) -> str:
-    print("--- [LOG] Starting story generation process. ---")
-    
-    # 1. Call Gemini 2.5 Pro to generate a story outline from the prompt.
-    print("--- [LOG] Generating story outline. ---")
-    outline_prompt = f"""
+async def _run_crud(fn, *args, **kwargs):
+    """
+    Runs a `crud` function in a worker thread with its own session, so
+    concurrent tasks of the same story never share one.
+    """
+    return await asyncio.to_thread(_with_session, fn, *args, **kwargs)
+
+def _outline_prompt(prompt: str) -> str:
+    return f"""
     Create a 15-point story outline for a 30-minute sleep story about: {prompt}.
     The story should be appropriate for a child aged 8-12.
     The outline should follow a "gradual unwind" structure, starting in a calm and peaceful setting and becoming progressively more relaxing and dreamlike.
@@ -52,59 +306,33 @@ def generate_story_text(prompt: str) -> str:
     **IMPORTANT:** Format the output as a JSON object with a single key "outline" which is an array of strings.
     Example: {{"outline": ["Point 1", "Point 2", "Point 3", "Point 4", "Point 5", "Point 6", "Point 7", "Point 8", "Point 9", "Point 10", "Point 11", "Point 12", "Point 13", "Point 14", "Point 15"]}}
     """
-    
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    try:
-        print("--- [LOG] Sending request to Gemini for outline. ---")
-        response = model.generate_content(
-            outline_prompt,
-            generation_config=genai.types.GenerationConfig(
-                response_mime_type="application/json"
-            )
-        )
-        print("--- [LOG] Received response from Gemini for outline. ---")
-        
-        outline_data = json.loads(response.text)
-        story_points = outline_data.get("outline", [])
-        outline = "\n".join(story_points)
-        print(f"--- [LOG] Successfully parsed outline with {len(story_points)} points. ---")
 
-    except Exception as e:
-        print(f"!!! [ERROR] Failed to call Gemini API for outline: {e}")
-        raise RuntimeError(f"Failed to call Gemini API for outline: {e}")
-
-    # 2. Loop through each outline point, generating that section of the story.
-    full_story = ""
-    summary_of_previous_sections = "The story has not yet begun."
-    
-    print("--- [LOG] Starting to generate story sections. ---")
-    for i, point in enumerate(story_points):
-        print(f"--- [LOG] Generating section {i+1}/{len(story_points)}: '{point}' ---")
-        # Generate an interim summary if we have some story text
-        if full_story:
-            print(f"--- [LOG] Generating summary for section {i+1}. ---")
-            summarization_prompt = f"""
+def _summary_prompt(full_story: str) -> str:
+    return f"""
             Based on the story written so far, provide a brief summary. Include the main characters, their current situation, and the key events that have occurred.
 
             **Story So Far:**
             {full_story}
             """
-            try:
-                print(f"--- [LOG] Sending request to Gemini for summary. ---")
-                summary_response = model.generate_content(
-                    summarization_prompt,
-                    generation_config=genai.types.GenerationConfig(
-                        temperature=0.5,
-                        max_output_tokens=512
-                    )
-                )
-                summary_of_previous_sections = summary_response.text
-                print(f"--- [LOG] Successfully generated summary for section {i+1}. ---")
-            except Exception as e:
-                print(f"!!! [ERROR] Could not generate summary: {e}")
-                summary_of_previous_sections = "No summary available."
 
-        section_prompt = f"""
+def _rolling_summary_prompt(previous_summary: str, latest_section: str) -> str:
+    return f"""
+            Here is a summary of a story so far, followed by the section that was just written. Update the summary so that it also covers the new section. Keep it brief: include the main characters, their current situation, and the key events that have occurred.
+
+            **Summary So Far:**
+            {previous_summary}
+
+            **Newest Section:**
+            {latest_section}
+            """
+
+def _section_prefix(prompt: str, outline: str) -> str:
+    """
+    The part of every section prompt that stays the same throughout a story.
+    It goes first, so a provider that caches repeated prompt prefixes can
+    reuse it from one section request to the next.
+    """
+    return f"""
         You are a master storyteller, crafting a section of a 30-minute sleep story for a child aged 8-12. Your writing should be calm, soothing, and poetic.
 
         **Style Guidelines:**
@@ -117,7 +345,11 @@ def generate_story_text(prompt: str) -> str:
 
         **Full Story Outline:**
         {outline}
+        """
 
+def _section_prompt(summary_of_previous_sections: str, full_story: str, point: str) -> str:
+    """The rest of a sequential section prompt, following `_section_prefix`."""
+    return f"""
         **Summary of Previous Sections:**
         {summary_of_previous_sections}
 
@@ -126,72 +358,505 @@ def generate_story_text(prompt: str) -> str:
 
         **Now, please write the next section of the story, focusing on this point from the outline:** '{point}'
         """
-        
-        try:
-            print(f"--- [LOG] Sending request to Gemini for story section {i+1}. ---")
-            response = model.generate_content(
-                section_prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.7,
-                    max_output_tokens=8192,
-                    response_mime_type="application/json",
-                    response_schema=models.StorySection
+
+def _plan_prompt(prompt: str, outline: str, point_count: int) -> str:
+    return f"""
+    You are planning a 30-minute sleep story for a child aged 8-12 about: {prompt}.
+    The story will be written one section per outline point, and every section will be written at the same time by a different writer.
+    So that the sections fit together, describe for each outline point where the story stands just before that section begins: where the character is, what they are doing and feeling, and what has already happened. Keep each description to one or two sentences.
+
+    **Full Story Outline:**
+    {outline}
+
+    **IMPORTANT:** Format the output as a JSON object with a single key "states" which is an array of exactly {point_count} strings, one per outline point, in order.
+    """
+
+def _parallel_section_prompt(expected_state: str, point: str, index: int, total: int) -> str:
+    """The rest of a parallel section prompt, following `_section_prefix`."""
+    return f"""
+        **Where the story stands as this section begins:**
+        {expected_state}
+
+        **Now, please write section {index + 1} of {total} of the story, focusing on this point from the outline:** '{point}'
+        """
+
+def _continuity_prompt(previous_ending: str, opening: str) -> str:
+    return f"""
+        You are editing a calm, soothing sleep story for a child aged 8-12. Two neighbouring sections were written separately, so the join between them may be abrupt or repetitive.
+
+        **The previous section ends with:**
+        ...{previous_ending}
+
+        **The next section opens with this paragraph:**
+        {opening}
+
+        Rewrite only the opening paragraph so that it follows on naturally from the end of the previous section. Keep its events, tone and length, and do not repeat what the previous section has just described.
+        """
+
+def generate_story_text(prompt: str, mode: str | None = None, llm_calls: list | None = None) -> str:
+    return asyncio.run(generate_story_text_async(prompt, mode, llm_calls))
+
+async def generate_story_text_async(prompt: str, mode: str | None = None, llm_calls: list | None = None,
+                                    on_section=None, checkpoint: _Checkpoint | None = None) -> str:
+    """
+    Generates the full story text. `mode` is "sequential" (each section sees a
+    summary of everything before it) or "parallel" (sections are planned up
+    front and written concurrently); it defaults to STORY_GENERATION_MODE.
+
+    If `llm_calls` is given, one dict per Gemini call (kind, section, token
+    counts and latency) is appended to it. If `on_section` is given, it is
+    awaited as `on_section(index, total, section_text)` once each section is
+    final.
+
+    If a loaded `checkpoint` is given, its saved outline and sections are
+    reused, and everything newly generated is saved to it.
+    """
+    mode = mode or STORY_GENERATION_MODE
+    checkpoint = checkpoint or _Checkpoint()
+    if mode not in ("sequential", "parallel"):
+        raise ValueError(f"Unknown story generation mode: {mode}")
+    logger.info("Starting story generation process (%s mode)", mode)
+
+    calls = llm_calls if llm_calls is not None else []
+    token = _llm_calls.set(calls)
+    try:
+        story_points = checkpoint.outline
+        if not story_points:
+            with telemetry.span("story.outline"):
+                story_points = await _generate_outline(prompt)
+            await checkpoint.save_outline(story_points)
+        outline = "\n".join(story_points)
+
+        if mode == "parallel":
+            return await _generate_sections_parallel(prompt, outline, story_points, on_section, checkpoint)
+        return await _generate_sections_sequential(prompt, outline, story_points, on_section, checkpoint)
+    finally:
+        _llm_calls.reset(token)
+        _log_llm_usage(calls)
+
+async def _generate_outline(prompt: str) -> list[str]:
+    # 1. Call Gemini 2.5 Pro to generate a story outline from the prompt.
+    outline_prompt = _outline_prompt(prompt)
+
+    try:
+        response = await _generate_content(
+            outline_prompt,
+            {
+                "response_mime_type": "application/json"
+            },
+            kind="outline",
+        )
+        outline_data = json.loads(response.text)
+        story_points = outline_data.get("outline", [])
+        logger.info("Parsed outline with %d points", len(story_points))
+        return story_points
+
+    except Exception as e:
+        logger.error("Failed to call Gemini API for outline: %s", e)
+        raise RuntimeError(f"Failed to call Gemini API for outline: {e}")
+
+async def _generate_section(section_prompt: str, i: int, point: str) -> str:
+    try:
+        response = await _generate_content(
+            section_prompt,
+            {
+                "response_mime_type": "application/json",
+                "response_schema": models.StorySection
+            },
+            kind="section",
+            section=i,
+        )
+        section_data = json.loads(response.text)
+        return section_data.get("story_section_text", "")
+
+    except Exception as e:
+        logger.error("Failed to call Gemini API for section '%s': %s", point, e)
+        raise RuntimeError(f"Failed to call Gemini API for section '{point}': {e}")
+
+async def _generate_sections_sequential(prompt: str, outline: str, story_points: list[str], on_section=None,
+                                       checkpoint: _Checkpoint | None = None) -> str:
+    # 2. Loop through each outline point, generating that section of the story.
+    checkpoint = checkpoint or _Checkpoint()
+    section_prefix = _section_prefix(prompt, outline)
+    full_story = ""
+    section_text = ""
+    summary_of_previous_sections = "The story has not yet begun."
+
+    logger.info("Starting to generate story sections")
+    for i, point in enumerate(story_points):
+        # Sections written by an earlier attempt are reused, along with the
+        # summary each was written from, which a rolling summary builds on.
+        if checkpoint.text(i) is not None:
+            section_text = checkpoint.text(i)
+            summary_of_previous_sections = checkpoint.context(i) or summary_of_previous_sections
+            full_story += section_text + SECTION_SEPARATOR
+            if on_section:
+                await on_section(i, len(story_points), section_text)
+            continue
+
+        logger.info("Generating section %d/%d: '%s'", i + 1, len(story_points), point)
+        if checkpoint.context(i) is not None:
+            summary_of_previous_sections = checkpoint.context(i)
+        # Generate an interim summary if we have some story text
+        elif full_story:
+            if SUMMARY_MODE == "rolling":
+                summarization_prompt = _rolling_summary_prompt(summary_of_previous_sections, section_text)
+            else:
+                summarization_prompt = _summary_prompt(full_story)
+            try:
+                summary_response = await _generate_content(
+                    summarization_prompt,
+                    {},
+                    kind="summary",
+                    section=i,
                 )
-            )
-            print(f"--- [LOG] Received response from Gemini for story section {i+1}. ---")
-            
-            section_data = json.loads(response.text)
-            section_text = section_data.get("story_section_text", "")
-            full_story += section_text + "\n\n[pause long]\n\n"
-            print(f"--- [LOG] Successfully generated and appended section {i+1}. ---")
-
-        except Exception as e:
-            print(f"!!! [ERROR] Failed to call Gemini API for section '{point}': {e}")
-            raise RuntimeError(f"Failed to call Gemini API for section '{point}': {e}")
-        except json.JSONDecodeError:
-            print(f"!!! [ERROR] Error decoding JSON for section {i+1}. Response text: {response.text}")
-
-            
+                summary_of_previous_sections = summary_response.text
+                await checkpoint.save_section(i, context=summary_of_previous_sections)
+            except Exception as e:
+                logger.warning("Could not generate summary: %s", e)
+                # A rolling summary builds on the previous one, so keep that
+                # rather than losing everything written so far.
+                if SUMMARY_MODE != "rolling":
+                    summary_of_previous_sections = "No summary available."
+
+        section_prompt = section_prefix + _section_prompt(summary_of_previous_sections, full_story, point)
+        section_text = await _generate_section(section_prompt, i, point)
+        await checkpoint.save_section(i, text=section_text)
+        full_story += section_text + SECTION_SEPARATOR
+        if on_section:
+            await on_section(i, len(story_points), section_text)
+
     return full_story
 
+async def _plan_sections(prompt: str, outline: str, story_points: list[str]) -> list[str]:
+    """
+    Asks for a short "where the story stands" note per outline point, so each
+    section can be written without waiting for the ones before it. Falls back
+    to the outline itself if the plan cannot be produced.
+    """
+    fallback = ["The story has not yet begun."] + [
+        f"The previous section covered: {point}" for point in story_points[:-1]
+    ]
+    try:
+        response = await _generate_content(
+            _plan_prompt(prompt, outline, len(story_points)),
+            {
+                "response_mime_type": "application/json"
+            },
+            kind="plan",
+        )
+        states = json.loads(response.text).get("states", [])
+    except Exception as e:
+        logger.warning("Could not generate section plan, using the outline instead: %s", e)
+        return fallback
+
+    if len(states) != len(story_points):
+        logger.warning("Section plan has %d states for %d points, using the outline instead", len(states), len(story_points))
+        return fallback
+    logger.info("Planned %d sections", len(states))
+    return states
+
+async def _smooth_seam(previous_section: str, section: str, i: int) -> str:
+    """Rewrites the opening paragraph of `section` so it follows on from `previous_section`."""
+    opening, separator, rest = section.partition("\n\n")
+    try:
+        response = await _generate_content(
+            _continuity_prompt(previous_section[-500:], opening),
+            {
+                "response_mime_type": "application/json",
+                "response_schema": models.StorySection
+            },
+            kind="continuity",
+            section=i,
+        )
+        new_opening = json.loads(response.text).get("story_section_text", "").strip()
+    except Exception as e:
+        logger.warning("Could not smooth the start of section %d, keeping it as written: %s", i + 1, e)
+        return section
+    if not new_opening:
+        return section
+    return new_opening + separator + rest
+
+async def _generate_sections_parallel(prompt: str, outline: str, story_points: list[str], on_section=None,
+                                     checkpoint: _Checkpoint | None = None) -> str:
+    checkpoint = checkpoint or _Checkpoint()
+    section_prefix = _section_prefix(prompt, outline)
+    states = [checkpoint.context(i) for i in range(len(story_points))]
+    if None in states:
+        states = await _plan_sections(prompt, outline, story_points)
+        for i, state in enumerate(states):
+            await checkpoint.save_section(i, context=state)
+
+    async def write_section(i: int, state: str, point: str) -> str:
+        # Sections are checkpointed as written, before their seams are smoothed.
+        if checkpoint.text(i) is not None:
+            return checkpoint.text(i)
+        section = await _generate_section(
+            section_prefix + _parallel_section_prompt(state, point, i, len(story_points)), i, point
+        )
+        await checkpoint.save_section(i, text=section)
+        return section
+
+    logger.info("Generating %d story sections in parallel", len(story_points))
+    # Let every section finish, and be checkpointed, before giving up on a failed one.
+    sections = await asyncio.gather(*(
+        write_section(i, state, point) for i, (state, point) in enumerate(zip(states, story_points))
+    ), return_exceptions=True)
+    for section in sections:
+        if isinstance(section, BaseException):
+            raise section
+
+    logger.info("Smoothing the seams between sections")
+    smoothed = await asyncio.gather(*(
+        _smooth_seam(sections[i - 1], sections[i], i)
+        for i in range(1, len(sections))
+    ))
+    sections = sections[:1] + list(smoothed)
+    if on_section:
+        for i, section in enumerate(sections):
+            await on_section(i, len(sections), section)
+
+    return "".join(section + SECTION_SEPARATOR for section in sections)
+
 def convert_text_to_audio(text: str) -> str:
-    """Converts text to an audio file using the Long Audio Synthesis API."""
-    print("--- [LOG] Starting Long Audio Synthesis process. ---")
+    """Converts text to an audio file and returns its public URL."""
+    return asyncio.run(convert_text_to_audio_async(text))
+
+async def convert_text_to_audio_async(text: str) -> str:
+    """Async version of `convert_text_to_audio`, using the TTS_ENGINE synthesis engine."""
+    if TTS_ENGINE == "long_audio":
+        return await _synthesize_long_audio(text)
+    return await _synthesize_chunked(text)
+
+def _pick_voice(text: str) -> str:
+    """Picks a voice from the text's hash, so the same text always gets the same voice."""
+    return VOICES[int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16) % len(VOICES)]
+
+def _audio_blob_name(text: str, voice_name: str, suffix: str = "", audio_format: str | None = None,
+                     fades: tuple[bool, bool] = (True, True)) -> str:
+    """
+    Content-addressed object name for the audio of `text` read by `voice_name`,
+    encoded as `audio_format` (AUDIO_FORMAT by default) with the given fades.
+    """
+    audio_format = audio_format or transcode.AUDIO_FORMAT
+    key = cache.make_key(
+        "audio", TTS_ENGINE, providers.TTS_PROVIDER, text, voice_name, TTS_SAMPLE_RATE, PAUSE_LONG_SECONDS,
+        audio_format, transcode.AUDIO_BITRATE, transcode.AUDIO_LOUDNESS_LUFS, transcode.AUDIO_FADE_SECONDS, fades,
+    )
+    return f"story-{key[:32]}{suffix}{transcode.extension(audio_format)}"
+
+async def _transcode(path: str, duration: float, fade_in: bool = True, fade_out: bool = True) -> str:
+    """Encodes a stitched WAV for publishing (see `transcode`) and returns the encoded file's path."""
+    with telemetry.span("audio.transcode", format=transcode.AUDIO_FORMAT), telemetry.TRANSCODE_SECONDS.time():
+        return await asyncio.to_thread(transcode.transcode, path, duration, TTS_SAMPLE_RATE, fade_in, fade_out)
+
+def _published_url(blob_name: str) -> str | None:
+    """Returns the URL of an already-published audio object, if caching is on and it exists."""
+    if cache.get_cache() is None:
+        return None
+    store = providers.get_blob_store()
+    if store.exists(blob_name):
+        return store.public_url(blob_name)
+    return None
+
+async def _synthesize_chunked(text: str) -> str:
+    """
+    Splits the story at its pause markers (and into API-sized chunks), runs
+    the chunks through the regular synthesize API concurrently, and stitches
+    the LINEAR16 results into one WAV on disk with real silence at the pauses.
+    """
+    logger.info("Starting chunked speech synthesis")
+    path = encoded_path = None
+    try:
+        voice_name = _pick_voice(text)
+        destination_blob_name = _audio_blob_name(text, voice_name)
+        public_url = await asyncio.to_thread(_published_url, destination_blob_name)
+        if public_url:
+            logger.info("Audio already published at %s", public_url)
+            return public_url
+
+        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
+            path = tmp.name
+        duration = await _synthesize_to_wav(text, path, voice_name)
+        logger.info("Stitched %.0f seconds of audio", duration)
+        encoded_path = await _transcode(path, duration)
+
+        public_url = await asyncio.to_thread(upload_audio, encoded_path, destination_blob_name)
+        logger.info("Published audio at %s", public_url)
+        return public_url
+
+    except Exception as e:
+        # Logged with its traceback by the caller that handles the failure.
+        raise RuntimeError(f"TTS Error: {e}") from e
+    finally:
+        for leftover in {path, encoded_path}:
+            if leftover and os.path.exists(leftover):
+                os.remove(leftover)
+
+async def _synthesize_to_wav(text: str, path: str, voice_name: str) -> float:
+    """
+    Synthesizes `text` chunk by chunk into a WAV file at `path` and returns
+    its duration in seconds.
+
+    Chunks are written out in order as they finish. At most
+    2 * TTS_MAX_CONCURRENCY chunks are outstanding at once, so only that many
+    chunks of audio are ever held in memory.
+    """
+    synthesizer = providers.get_speech_synthesizer()
+    semaphore = asyncio.Semaphore(TTS_MAX_CONCURRENCY)
+
+    async def synthesize(chunk_text: str) -> bytes:
+        key = cache.make_key("tts", synthesizer.name, voice_name, TTS_SAMPLE_RATE, chunk_text)
+        cached = await _cache_get(key, "tts")
+        if cached is not None:
+            return cached
+        async def attempt():
+            async with semaphore:
+                with telemetry.span("tts.chunk", voice=voice_name), telemetry.TTS_CALL_SECONDS.time(engine="chunked"):
+                    return await synthesizer.synthesize(chunk_text, voice_name, TTS_SAMPLE_RATE)
+
+        audio_content, _ = await ratelimit.call("tts", attempt)
+        await _cache_set(key, audio_content)
+        return audio_content
+
+    chunks = audio.split_for_synthesis(text)
+    logger.info("Synthesizing %d chunks with voice %s", len(chunks), voice_name)
+
+    pending = collections.deque()
+    try:
+        with audio.WavStitcher(path, TTS_SAMPLE_RATE) as stitcher:
+            next_chunk = 0
+            while pending or next_chunk < len(chunks):
+                while next_chunk < len(chunks) and len(pending) < 2 * TTS_MAX_CONCURRENCY:
+                    chunk_text, pause_after = chunks[next_chunk]
+                    pending.append((asyncio.create_task(synthesize(chunk_text)), pause_after))
+                    next_chunk += 1
+                task, pause_after = pending.popleft()
+                await asyncio.to_thread(stitcher.append_wav, await task)
+                if pause_after:
+                    stitcher.append_silence(PAUSE_LONG_SECONDS)
+        return stitcher.duration_seconds
+    finally:
+        for task, _ in pending:
+            task.cancel()
+
+async def _generate_progressively(story_id: int, prompt: str, progress: _ProgressRecorder,
+                                  checkpoint: _Checkpoint | None = None) -> tuple[str, str]:
+    """
+    Generates the story text while synthesizing each finished section into
+    its own published segment, then joins the segments into the full audio
+    file. Returns the story text and the full audio URL.
+    """
+    voice_name = _pick_voice(prompt)
+    work_dir = tempfile.mkdtemp(prefix=f"story-{story_id}-")
+    segment_tasks = []
+
+    async def synthesize_segment(i: int, total: int, section_text: str) -> str:
+        path = os.path.join(work_dir, f"segment-{i:03d}.wav")
+        try:
+            await _run_crud(crud.save_segment, story_id, i, status="synthesizing")
+            segment_text = section_text + SECTION_SEPARATOR
+            duration = await _synthesize_to_wav(segment_text, path, voice_name)
+            # Only the story's first and last segments fade, so segments play back seamlessly.
+            fades = (i == 0, i == total - 1)
+            blob_name = _audio_blob_name(segment_text, voice_name, suffix="-segment", fades=fades)
+            url = await asyncio.to_thread(_published_url, blob_name)
+            if not url:
+                encoded_path = await _transcode(path, duration, *fades)
+                url = await asyncio.to_thread(upload_audio, encoded_path, blob_name)
+            await _run_crud(crud.save_segment, story_id, i, status="ready", audio_url=url, duration_seconds=duration)
+            logger.info("Published segment %d of story %s (%.0f seconds)", i + 1, story_id, duration, extra={"story_id": story_id})
+            return path
+        except asyncio.CancelledError:
+            # Cancelled because another segment or the text failed; the segment
+            # is resynthesized when the story is resumed.
+            await _run_crud(crud.save_segment, story_id, i, status="pending")
+            raise
+        except Exception:
+            await _run_crud(crud.save_segment, story_id, i, status="failed")
+            raise
+
+    async def on_section(i: int, total: int, section_text: str):
+        segment_tasks.append(asyncio.create_task(synthesize_segment(i, total, section_text)))
+        await progress.section_done(i, total, section_text)
+
+    try:
+        try:
+            with telemetry.span("story.text"), telemetry.STAGE_SECONDS.time(stage="story"):
+                story_text = await generate_story_text_async(
+                    prompt, llm_calls=progress.llm_calls, on_section=on_section, checkpoint=checkpoint
+                )
+        except Exception:
+            for task in segment_tasks:
+                task.cancel()
+            raise
+        await progress.flush()
+
+        await _run_crud(crud.update_story_status, story_id, "generating_audio")
+        # Only the audio still outstanding once the text is done is timed here.
+        with telemetry.span("story.audio"), telemetry.STAGE_SECONDS.time(stage="audio"):
+            try:
+                paths = await asyncio.gather(*segment_tasks)
+            except Exception as e:
+                for task in segment_tasks:
+                    task.cancel()
+                raise RuntimeError(f"TTS Error: {e}")
+
+            blob_name = _audio_blob_name(story_text, voice_name)
+            audio_url = await asyncio.to_thread(_published_url, blob_name)
+            if not audio_url:
+                full_path = os.path.join(work_dir, "story.wav")
+                duration = await asyncio.to_thread(_join_wavs, paths, full_path)
+                encoded_path = await _transcode(full_path, duration)
+                audio_url = await asyncio.to_thread(upload_audio, encoded_path, blob_name)
+        return story_text, audio_url
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def _join_wavs(paths: list[str], destination: str) -> float:
+    """Concatenates same-format WAV files, one block at a time, and returns the duration in seconds."""
+    with audio.WavStitcher(destination, TTS_SAMPLE_RATE) as stitcher:
+        for path in paths:
+            with wave.open(path, "rb") as segment:
+                while frames := segment.readframes(TTS_SAMPLE_RATE * 10):
+                    stitcher.append_pcm(frames)
+    return stitcher.duration_seconds
+
+async def _synthesize_long_audio(text: str) -> str:
+    """
+    Synthesizes the whole story as one Long Audio Synthesis job written
+    straight to the bucket. The long-running operation is awaited rather than
+    polled from a blocked thread.
+    """
+    logger.info("Starting Long Audio Synthesis process")
+    if providers.TTS_PROVIDER != "google" or providers.STORAGE_PROVIDER != "gcs":
+        raise RuntimeError("TTS_ENGINE=long_audio needs TTS_PROVIDER=google and STORAGE_PROVIDER=gcs.")
 
     project_id = os.getenv("GCP_PROJECT_ID")
-    print(f"--- [LOG] GCP_PROJECT_ID: {project_id} ---")
     if not project_id:
         raise RuntimeError("GCP_PROJECT_ID environment variable not set.")
 
     try:
         from google.cloud import texttospeech_v1 as texttospeech
-        from google.oauth2 import service_account
-        import uuid
-
-        gcp_credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-        if not gcp_credentials_path:
-            raise RuntimeError("GOOGLE_APPLICATION_CREDENTIALS not set.")
 
-        credentials = service_account.Credentials.from_service_account_file(gcp_credentials_path)
-        client = texttospeech.TextToSpeechLongAudioSynthesizeClient(credentials=credentials)
+        client = clients.long_audio_client()
 
         input_text = texttospeech.SynthesisInput(text=text)
 
         audio_config = texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.LINEAR16)
 
-        voices = [
-            "en-US-Chirp3-HD-Achernar",
-            "en-US-Chirp3-HD-Gacrux",
-            "en-US-Chirp3-HD-Leda",
-            "en-US-Chirp3-HD-Sulafat",
-        ]
-        random_voice = random.choice(voices)
+        voice_name = _pick_voice(text)
+        # Long Audio Synthesis writes straight to the bucket, so it is published as WAV.
+        destination_blob_name = _audio_blob_name(text, voice_name, audio_format="wav")
+        public_url = await asyncio.to_thread(_published_url, destination_blob_name)
+        if public_url:
+            logger.info("Audio already published at %s", public_url)
+            return public_url
+
+        voice = texttospeech.VoiceSelectionParams(language_code="en-US", name=voice_name)
 
-        voice = texttospeech.VoiceSelectionParams(language_code="en-US", name=random_voice)
-        
         parent = f"projects/{project_id}/locations/us-central1"
-        
-        destination_blob_name = f"story-{uuid.uuid4()}.wav"
+
         output_gcs_uri = f"gs://{GCS_BUCKET_NAME}/{destination_blob_name}"
 
         request = texttospeech.SynthesizeLongAudioRequest(
@@ -202,39 +867,33 @@ def convert_text_to_audio(text: str) -> str:
             output_gcs_uri=output_gcs_uri,
         )
 
-        print("--- [LOG] Submitting Long Audio Synthesis request. ---")
-        operation = client.synthesize_long_audio(request=request)
-        
-        print("--- [LOG] Waiting for Long Audio Synthesis operation to complete... ---")
-        result = operation.result(timeout=600)  # 10-minute timeout
-        print("--- [LOG] Long Audio Synthesis operation complete. ---")
+        logger.info("Submitting Long Audio Synthesis request")
+        with telemetry.span("tts.long_audio", voice=voice_name), telemetry.TTS_CALL_SECONDS.time(engine="long_audio"):
+            # Only submitting is retried; a job that fails after starting is not resubmitted.
+            operation, _ = await ratelimit.call("tts", client.synthesize_long_audio, request=request)
+
+            logger.info("Waiting for Long Audio Synthesis operation to complete")
+            result = await operation.result(timeout=600)  # 10-minute timeout
+        logger.info("Long Audio Synthesis operation complete")
 
         # The public URL needs to be constructed manually
-        public_url = f"https://storage.googleapis.com/{GCS_BUCKET_NAME}/{destination_blob_name}"
-        
+        public_url = providers.get_blob_store().public_url(destination_blob_name)
+
         # Make the object public
-        storage_client = storage.Client(credentials=credentials)
-        bucket = storage_client.bucket(GCS_BUCKET_NAME)
-        blob = bucket.blob(destination_blob_name)
-        blob.make_public()
-        print(f"--- [LOG] Made GCS object public at: {public_url} ---")
+        blob = clients.bucket(GCS_BUCKET_NAME).blob(destination_blob_name)
+        await asyncio.to_thread(blob.make_public)
+        logger.info("Made GCS object public at %s", public_url)
 
         return public_url
 
     except Exception as e:
-        print(f"!!! [ERROR] An error occurred during Long Audio Synthesis: {e}")
-        print(f"!!! [ERROR] Full error: {e!r}")
+        logger.exception("An error occurred during Long Audio Synthesis: %s", e)
         raise RuntimeError(f"TTS Error: {e}")
 
-def upload_to_gcs(file_path: str, destination_blob_name: str) -> str:
-    """Uploads a file to the GCS bucket and makes it public."""
-    print(f"--- [LOG] Initializing GCS client for bucket: {GCS_BUCKET_NAME}. ---")
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(GCS_BUCKET_NAME)
-    blob = bucket.blob(destination_blob_name)
-
-    print(f"--- [LOG] Starting upload of '{file_path}' to '{destination_blob_name}'. ---")
-    blob.upload_from_filename(file_path)
-    print(f"--- [LOG] Finished uploading to GCS. ---")
-
-    return blob.public_url
+def upload_audio(file_path: str, destination_blob_name: str) -> str:
+    """Publishes an audio file to the configured blob store and returns its URL."""
+    logger.info("Uploading '%s' to '%s' (%s storage)", file_path, destination_blob_name, providers.STORAGE_PROVIDER)
+    with telemetry.span("storage.upload", blob=destination_blob_name), telemetry.UPLOAD_SECONDS.time():
+        return providers.get_blob_store().upload(
+            file_path, destination_blob_name, transcode.content_type(destination_blob_name)
+        )
@@ -0,0 +1,48 @@
+"""
+Encoding for stored story text.
+
+A finished story is tens of kilobytes of prose, so it lives in its own
+`story_texts` table rather than on the `stories` row every status poll reads.
+STORY_TEXT_COMPRESSION picks how new text is stored: "gzip" (default),
+"zstd" (needs the `zstandard` package) or "none". Each row records its own
+encoding, so changing the setting never breaks text written before it.
+"""
+import gzip
+import hashlib
+import os
+
+STORY_TEXT_COMPRESSION = os.getenv("STORY_TEXT_COMPRESSION", "gzip")
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd story text compression needs the 'zstandard' package.")
+    return zstandard
+
+def etag(text: str) -> str:
+    """A strong ETag for `text`, quoted as it appears in the header."""
+    return '"' + hashlib.sha256(text.encode("utf-8")).hexdigest()[:32] + '"'
+
+def encode(text: str, compression: str | None = None) -> tuple[str, bytes]:
+    """Returns `(encoding, body)` for storing `text`."""
+    compression = compression or STORY_TEXT_COMPRESSION
+    data = text.encode("utf-8")
+    if compression == "none":
+        return "identity", data
+    if compression == "gzip":
+        return "gzip", gzip.compress(data, compresslevel=6, mtime=0)
+    if compression == "zstd":
+        return "zstd", _zstd().ZstdCompressor(level=10).compress(data)
+    raise ValueError(f"Unknown story text compression: {compression}")
+
+def decode(encoding: str, body: bytes) -> str:
+    if encoding == "identity":
+        data = body
+    elif encoding == "gzip":
+        data = gzip.decompress(body)
+    elif encoding == "zstd":
+        data = _zstd().ZstdDecompressor().decompress(body)
+    else:
+        raise ValueError(f"Unknown story text encoding: {encoding}")
+    return data.decode("utf-8")
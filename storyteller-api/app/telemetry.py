@@ -0,0 +1,224 @@
+"""
+Metrics, tracing and logging for the generation pipeline.
+
+Metrics are kept in-process and rendered in the Prometheus text format by
+`GET /metrics`, so nothing needs to be running to collect them. Spans are
+sent to OpenTelemetry when the `opentelemetry` package is installed and are
+no-ops otherwise. `configure_logging` sets up structured (JSON) logs.
+"""
+import bisect
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from opentelemetry import trace as _otel_trace
+except ImportError:
+    _otel_trace = None
+
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+_QUEUE_BUCKETS = (0.1, 1, 5, 15, 30, 60, 300, 900, 1800, 3600)
+
+_registry = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key: tuple, extra: dict | None = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value) -> list[str]:
+        return [f"{self.name}{self._format_labels(key)} {value}"]
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the wall time of the block, whether or not it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_value(self, key, value) -> list[str]:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            lines.append(f"{self.name}_bucket{self._format_labels(key, {'le': le})} {cumulative}")
+        lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+        lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+LLM_CALL_SECONDS = Histogram(
+    "storyteller_llm_call_seconds", "Latency of Gemini calls, by kind and model.", ["kind", "model"])
+LLM_TOKENS_TOTAL = Counter(
+    "storyteller_llm_tokens_total", "Gemini tokens by kind, model and type (prompt, output, cached).",
+    ["kind", "model", "type"])
+TTS_CALL_SECONDS = Histogram(
+    "storyteller_tts_call_seconds", "Latency of Text-to-Speech requests, by engine.", ["engine"])
+UPLOAD_SECONDS = Histogram(
+    "storyteller_upload_seconds", "Time taken to upload and publish an audio object.")
+TRANSCODE_SECONDS = Histogram(
+    "storyteller_transcode_seconds", "Time taken to encode stitched audio for publishing.")
+QUEUE_WAIT_SECONDS = Histogram(
+    "storyteller_queue_wait_seconds", "Time from a story being queued to a worker claiming it.",
+    buckets=_QUEUE_BUCKETS)
+STAGE_SECONDS = Histogram(
+    "storyteller_stage_seconds", "Duration of each pipeline stage, by stage.", ["stage"],
+    buckets=_QUEUE_BUCKETS)
+JOBS_IN_FLIGHT = Gauge(
+    "storyteller_jobs_in_flight", "Stories currently being generated by this process.")
+JOBS_TOTAL = Counter(
+    "storyteller_jobs_total", "Story attempts finished by this process, by outcome (complete, failed, retried).", ["outcome"])
+RATE_LIMIT_WAIT_SECONDS = Histogram(
+    "storyteller_rate_limit_wait_seconds", "Time requests waited for the rate limiter, by service.", ["service"])
+RETRIES_TOTAL = Counter(
+    "storyteller_retries_total", "Gemini and Text-to-Speech requests retried, by service.", ["service"])
+ADMISSIONS_TOTAL = Counter(
+    "storyteller_admissions_total",
+    "Story requests by result (created, idempotent, pooled, deduplicated, client_quota, queue_full, "
+    "batch_created, batch_client_quota, batch_queue_full).", ["result"])
+CACHE_LOOKUPS_TOTAL = Counter(
+    "storyteller_cache_lookups_total", "Cache lookups, by kind and result.", ["kind", "result"])
+
+def render_metrics() -> str:
+    """Renders every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", METRICS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    """Serves `render_metrics()` on `port` from a daemon thread, for processes without the API."""
+    server = ThreadingHTTPServer(("", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+@contextmanager
+def span(name: str, **attributes):
+    """Wraps the block in an OpenTelemetry span, if OpenTelemetry is installed."""
+    if _otel_trace is None:
+        yield None
+        return
+    tracer = _otel_trace.get_tracer("storyteller")
+    with tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+# Attributes every LogRecord has; anything else was passed through `extra`.
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including `extra` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RESERVED and not name.startswith("_"):
+                entry[name] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def configure_logging():
+    """
+    Sends `app.*` logs to stderr, as JSON unless LOG_FORMAT=text. Modules run
+    with `python -m` log as `__main__`, so that logger is included too.
+    """
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "text":
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    else:
+        handler.setFormatter(JsonFormatter())
+    for name in ("app", "__main__"):
+        logger = logging.getLogger(name)
+        logger.handlers = [handler]
+        logger.setLevel(LOG_LEVEL)
+        logger.propagate = False
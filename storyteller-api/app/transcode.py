@@ -0,0 +1,86 @@
+"""
+Compresses stitched LINEAR16 audio for publishing.
+
+A 30-minute story is ~85 MB as 24 kHz WAV but a few MB as speech-tuned MP3 or
+Opus, so audio is run through ffmpeg before it is uploaded. ffmpeg reads the
+WAV from disk and writes the encoded file as it goes, so memory stays flat.
+Along the way it normalizes loudness (single-pass loudnorm) and adds gentle
+fades at the start and end.
+
+Configured with:
+    AUDIO_FORMAT         "mp3" (default), "opus" (Ogg Opus) or "wav" (no transcoding)
+    AUDIO_BITRATE        encoder bitrate, e.g. "48k" (default); Opus sounds fine at "24k"
+    AUDIO_LOUDNESS_LUFS  integrated loudness target, or "none" to skip loudnorm (its
+                         slowest step, about a second per minute of audio)
+    AUDIO_FADE_SECONDS   length of the fade in and fade out
+"""
+import os
+
+AUDIO_FORMAT = os.getenv("AUDIO_FORMAT", "mp3")
+AUDIO_BITRATE = os.getenv("AUDIO_BITRATE", "48k")
+AUDIO_LOUDNESS_LUFS = os.getenv("AUDIO_LOUDNESS_LUFS", "-20")
+AUDIO_FADE_SECONDS = float(os.getenv("AUDIO_FADE_SECONDS", "3"))
+
+# format: (file extension, content type, ffmpeg output options)
+FORMATS = {
+    "mp3": (".mp3", "audio/mpeg", {"acodec": "libmp3lame"}),
+    "opus": (".ogg", "audio/ogg", {"acodec": "libopus", "application": "voip"}),
+    "wav": (".wav", "audio/wav", None),
+}
+
+def _format(audio_format: str | None):
+    audio_format = audio_format or AUDIO_FORMAT
+    if audio_format not in FORMATS:
+        raise ValueError(f"Unknown audio format: {audio_format}")
+    return FORMATS[audio_format]
+
+def extension(audio_format: str | None = None) -> str:
+    return _format(audio_format)[0]
+
+def content_type(path: str) -> str:
+    """The content type for an audio file, from its extension."""
+    for file_extension, file_content_type, _ in FORMATS.values():
+        if path.endswith(file_extension):
+            return file_content_type
+    return "application/octet-stream"
+
+def _filters(duration_seconds: float, fade_in: bool, fade_out: bool) -> str:
+    filters = []
+    if AUDIO_LOUDNESS_LUFS != "none":
+        filters.append(f"loudnorm=I={float(AUDIO_LOUDNESS_LUFS)}:TP=-2:LRA=11")
+    fade = min(AUDIO_FADE_SECONDS, duration_seconds / 2)
+    if fade_in and fade > 0:
+        filters.append(f"afade=t=in:st=0:d={fade}")
+    if fade_out and fade > 0:
+        filters.append(f"afade=t=out:st={duration_seconds - fade:.3f}:d={fade}")
+    return ",".join(filters) or "anull"
+
+def transcode(source: str, duration_seconds: float, sample_rate: int,
+              fade_in: bool = True, fade_out: bool = True, audio_format: str | None = None) -> str:
+    """
+    Encodes the WAV at `source` into `audio_format` (AUDIO_FORMAT by default)
+    next to it and returns the new path. With "wav", returns `source` as is.
+    """
+    file_extension, _, options = _format(audio_format)
+    if options is None:
+        return source
+    import ffmpeg
+
+    destination = os.path.splitext(source)[0] + file_extension
+    stream = ffmpeg.input(source).output(
+        destination,
+        af=_filters(duration_seconds, fade_in, fade_out),
+        ac=1,
+        # loudnorm upsamples internally; go back to the synthesis rate.
+        ar=sample_rate,
+        audio_bitrate=AUDIO_BITRATE,
+        **options,
+    )
+    try:
+        stream.overwrite_output().run(capture_stdout=True, capture_stderr=True)
+    except FileNotFoundError:
+        raise RuntimeError("ffmpeg is not installed; set AUDIO_FORMAT=wav to publish uncompressed audio.")
+    except ffmpeg.Error as e:
+        stderr = (e.stderr or b"").decode("utf-8", "replace").strip().splitlines()
+        raise RuntimeError(f"ffmpeg failed: {stderr[-1] if stderr else e}")
+    return destination
@@ -0,0 +1,213 @@
+"""
+Story generation worker.
+
+Stories are queued as `pending` rows in the `stories` table. A worker claims a
+row with a short lease, runs the generation pipeline, and keeps the lease alive
+with periodic heartbeats. If a worker dies, its lease lapses and any other
+worker picks the story back up, so API and worker processes can be scaled and
+restarted independently.
+
+A story resumes from its checkpointed outline and sections, so a retry after
+a failed attempt or a crash only generates what is still missing. A failed
+attempt puts the story straight back in the queue until it has used up
+JOB_MAX_ATTEMPTS.
+
+Run a standalone worker with:
+
+    python -m app.worker --concurrency 4 --metrics-port 9100
+
+`--metrics-port` serves the worker's Prometheus metrics, which the API's
+`/metrics` endpoint cannot see from another process.
+
+The generation pipeline (`services`) is only imported once the worker's loop
+is running, in a background thread, so the API can start serving status and
+read requests before it and the provider SDKs have loaded.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from . import crud, database, profiles, providers, telemetry
+
+logger = logging.getLogger(__name__)
+
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "2"))
+
+def _services():
+    from . import services
+
+    return services
+
+class Worker:
+    """
+    Runs up to `concurrency` stories at once from the database-backed queue.
+
+    All slots share a single event loop running in a background thread, so a
+    worker can drive dozens of stories without a thread per job. Database
+    calls are short and are pushed to the default executor.
+    """
+
+    def __init__(self, concurrency: int = WORKER_CONCURRENCY, lease_seconds: int = JOB_LEASE_SECONDS):
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._in_flight = set()
+        self._loop = None
+        self._wakes = []
+        # Set if the worker could not start processing stories.
+        self.error = None
+        self._stopping = threading.Event()
+        self._ready = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts the worker's event loop in a background thread."""
+        logger.info("Worker %s starting with %d slots", self.worker_id, self.concurrency)
+        self._thread = threading.Thread(target=asyncio.run, args=(self._main(),), name="story-worker", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self, timeout: float | None = None):
+        """
+        Stops claiming new stories and waits up to `timeout` for running ones.
+        Anything still running when the process exits is picked up again by
+        another worker once its lease expires.
+        """
+        self._stopping.set()
+        self.notify()
+        if self._thread:
+            self._thread.join(timeout)
+
+    @property
+    def healthy(self) -> bool:
+        """Whether the worker is running and able to process stories."""
+        return self.error is None and self._thread is not None and self._thread.is_alive()
+
+    def notify(self):
+        """Wakes idle slots so a freshly queued story is picked up immediately."""
+        if self._loop and not self._loop.is_closed():
+            for wake in self._wakes:
+                self._loop.call_soon_threadsafe(wake.set)
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        # One event per slot, so a slot clearing its own never swallows
+        # a wake-up meant for another.
+        self._wakes = [asyncio.Event() for _ in range(self.concurrency)]
+        self._ready.set()
+        try:
+            await asyncio.to_thread(_services)
+            await asyncio.to_thread(providers.warm, profiles.models())
+        except Exception as e:
+            self.error = e
+            logger.exception("Worker %s could not load the generation pipeline and will not process stories: %s",
+                             self.worker_id, e)
+            return
+        heartbeat = asyncio.create_task(self._heartbeat_loop())
+        await asyncio.gather(*(self._slot_loop(wake) for wake in self._wakes))
+        heartbeat.cancel()
+
+    async def _slot_loop(self, wake: asyncio.Event):
+        while not self._stopping.is_set():
+            try:
+                await self._slot_iteration(wake)
+            except Exception as e:
+                # One job must never take the slot, and with it the worker, down.
+                logger.exception("Worker %s slot error: %s", self.worker_id, e)
+                await asyncio.sleep(WORKER_POLL_SECONDS)
+
+    async def _slot_iteration(self, wake: asyncio.Event):
+        wake.clear()
+        story = await asyncio.to_thread(self._claim)
+        if story is None:
+            try:
+                await asyncio.wait_for(wake.wait(), WORKER_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            return
+        # Rows from before the queue columns existed have no created_at.
+        if story.attempts == 1 and story.created_at is not None:
+            wait = (database.utcnow() - story.created_at).total_seconds()
+            telemetry.QUEUE_WAIT_SECONDS.observe(max(wait, 0.0))
+        await self._run(story.id, story.prompt, final_attempt=story.attempts >= JOB_MAX_ATTEMPTS)
+
+    def _claim(self):
+        db = database.SessionLocal()
+        try:
+            return crud.claim_next_story(db, self.worker_id, self.lease_seconds, JOB_MAX_ATTEMPTS)
+        except Exception as e:
+            logger.exception("Worker %s could not claim a story: %s", self.worker_id, e)
+            return None
+        finally:
+            db.close()
+
+    async def _run(self, story_id: int, prompt: str, final_attempt: bool = True):
+        self._in_flight.add(story_id)
+        logger.info("Worker %s claimed story %s", self.worker_id, story_id, extra={"story_id": story_id})
+        try:
+            await _services().generate_story_and_audio_async(
+                story_id=story_id, prompt=prompt, final_attempt=final_attempt
+            )
+        finally:
+            self._in_flight.discard(story_id)
+            await asyncio.to_thread(self._release, story_id)
+
+    def _release(self, story_id: int):
+        db = database.SessionLocal()
+        try:
+            crud.release_story(db, story_id, self.worker_id)
+        except Exception as e:
+            # The lease lapses on its own, so another worker picks the story up later.
+            logger.exception("Worker %s could not release story %s: %s", self.worker_id, story_id, e)
+        finally:
+            db.close()
+
+    async def _heartbeat_loop(self):
+        interval = max(self.lease_seconds / 4, 1)
+        while True:
+            await asyncio.sleep(interval)
+            if self._in_flight:
+                await asyncio.to_thread(self._heartbeat, list(self._in_flight))
+
+    def _heartbeat(self, story_ids):
+        db = database.SessionLocal()
+        try:
+            crud.heartbeat_stories(db, self.worker_id, story_ids, self.lease_seconds)
+        except Exception as e:
+            logger.exception("Worker %s heartbeat failed: %s", self.worker_id, e)
+        finally:
+            db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a story generation worker.")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY,
+                        help="Number of stories to generate at once.")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus metrics on this port.")
+    args = parser.parse_args()
+
+    telemetry.configure_logging()
+    if args.metrics_port:
+        telemetry.start_metrics_server(args.metrics_port)
+    database.init_db()
+    worker = Worker(concurrency=args.concurrency)
+    worker.start()
+    try:
+        while worker.healthy:
+            time.sleep(5)
+    except KeyboardInterrupt:
+        logger.info("Worker %s shutting down", worker.worker_id)
+        worker.stop(timeout=0)
+        return
+    # Exit non-zero so a supervisor restarts the process.
+    raise SystemExit(f"Worker {worker.worker_id} stopped: {worker.error}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+"""
+End-to-end load and latency benchmark for the story pipeline.
+
+Starts the API (with its embedded worker) in this process on a throwaway
+SQLite database, using the fake LLM and TTS providers and local storage, so
+nothing leaves the machine. `--concurrency` clients each POST a story to
+/stories and poll /stories/{id} until it is complete, until `--stories`
+stories have been generated.
+
+Reported:
+    throughput            completed stories per second
+    first_change_*        seconds from POST until the status first moves off "pending"
+    end_to_end_*          seconds from POST until the story is complete (p50/p95/p99)
+    poll_*                latency of GET /stories/{id}
+    db_write_*, db_commit_*  time spent in INSERT/UPDATE/DELETE statements and in
+                          session commits, which is where SQLite lock waits show up
+    rss_per_job_mb        peak resident memory growth per story in flight
+    llm_<stage>_*         calls, p50 latency and mean prompt/output tokens per call
+                          for each LLM stage (outline, summary, section, ...)
+
+Run from storyteller-api/:
+
+    python -m benchmarks.bench_pipeline --stories 40 --concurrency 8 --workers 8
+    python -m benchmarks.bench_pipeline --save-baseline benchmarks/baseline.json
+    python -m benchmarks.bench_pipeline --compare benchmarks/baseline.json
+    python -m benchmarks.bench_pipeline --compare benchmarks/baseline.json --env LLM_PROFILE=economy
+
+`--compare` exits with status 1 if any metric is more than `--tolerance`
+(default 20%) worse than the baseline.
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Metric name -> (True if a higher value is better, smallest absolute change
+# that counts). The floor keeps millisecond-scale jitter from failing a run.
+COMPARED_METRICS = {
+    "throughput": (True, 0.0),
+    "first_change_p50": (False, 0.05),
+    "first_change_p95": (False, 0.05),
+    "end_to_end_p50": (False, 0.1),
+    "end_to_end_p95": (False, 0.1),
+    "end_to_end_p99": (False, 0.1),
+    "poll_p95": (False, 0.01),
+    "db_write_p95": (False, 0.005),
+    "db_commit_p95": (False, 0.005),
+    "rss_per_job_mb": (False, 5.0),
+}
+
+def percentile(values: list, fraction: float):
+    """Nearest-rank percentile of `values`, or None if there are none."""
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, math.ceil(fraction * len(values)) - 1)]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the story pipeline against fake providers.")
+    parser.add_argument("--stories", type=int, default=20, help="Number of stories to generate.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of concurrent clients.")
+    parser.add_argument("--workers", type=int, default=4, help="Embedded worker job slots.")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="Seconds between status polls.")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds per fake LLM call.")
+    parser.add_argument("--tts-latency", type=float, default=0.05, help="Seconds per fake TTS request.")
+    parser.add_argument("--section-words", type=int, default=200, help="Words per generated section.")
+    parser.add_argument("--audio-format", default="wav", help="AUDIO_FORMAT for published audio.")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the app, e.g. STORY_GENERATION_MODE=parallel.")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for all stories.")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Write the results to PATH.")
+    parser.add_argument("--compare", metavar="PATH", help="Compare against the baseline at PATH.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression, as a fraction.")
+    return parser.parse_args(argv)
+
+def configure_environment(args, work_dir: str) -> dict:
+    """Points the app at fake providers and a scratch database. Must run before `app` is imported."""
+    config = {
+        "LLM_PROVIDER": "fake",
+        "TTS_PROVIDER": "fake",
+        "STORAGE_PROVIDER": "local",
+        "LOCAL_STORAGE_DIR": os.path.join(work_dir, "audio"),
+        "DATABASE_URL": f"sqlite:///{os.path.join(work_dir, 'bench.db')}",
+        "CACHE_BACKEND": "none",
+        "EMBEDDED_WORKER_CONCURRENCY": str(args.workers),
+        "WORKER_POLL_SECONDS": "0.5",
+        "FAKE_LLM_LATENCY_SECONDS": str(args.llm_latency),
+        "FAKE_TTS_LATENCY_SECONDS": str(args.tts_latency),
+        "FAKE_LLM_SECTION_WORDS": str(args.section_words),
+        "AUDIO_FORMAT": args.audio_format,
+        "LOG_LEVEL": "WARNING",
+        # Measure the pipeline itself, not quotas sized for the real APIs.
+        "LLM_REQUESTS_PER_MINUTE": "0",
+        "TTS_REQUESTS_PER_MINUTE": "0",
+        "CLIENT_MAX_ACTIVE_STORIES": "0",
+        "STORY_QUEUE_MAX_PENDING": "0",
+    }
+    for item in args.env:
+        key, _, value = item.partition("=")
+        config[key] = value
+    os.environ.update(config)
+    return config
+
+class DBWriteTimer:
+    """
+    Times every write statement on an engine, and every session commit
+    (which includes flushing pending writes), per thread.
+    """
+
+    def __init__(self, engine, sessionmaker):
+        from sqlalchemy import event
+
+        self.writes = []
+        self.commits = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._before_write)
+        event.listen(engine, "after_cursor_execute", self._after_write)
+        event.listen(sessionmaker, "before_commit", self._before_commit)
+        event.listen(sessionmaker, "after_commit", self._after_commit)
+        event.listen(sessionmaker, "after_rollback", self._after_rollback)
+
+    def _before_write(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE"):
+            self._local.write_started = time.perf_counter()
+
+    def _after_write(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(self._local, "write_started", None)
+        if started is not None:
+            self._local.write_started = None
+            with self._lock:
+                self.writes.append(time.perf_counter() - started)
+
+    def _before_commit(self, session):
+        self._local.commit_started = time.perf_counter()
+
+    def _after_commit(self, session):
+        started = getattr(self._local, "commit_started", None)
+        if started is not None:
+            self._local.commit_started = None
+            with self._lock:
+                self.commits.append(time.perf_counter() - started)
+
+    def _after_rollback(self, session):
+        self._local.commit_started = None
+
+class MemorySampler:
+    """Samples this process's resident memory and the worker's jobs in flight."""
+
+    def __init__(self, jobs_in_flight, interval: float = 0.05):
+        self.jobs_in_flight = jobs_in_flight
+        self.interval = interval
+        self.baseline = self._rss()
+        self.peak_rss = self.baseline
+        self.peak_jobs = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def _rss() -> int:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, self._rss())
+            self.peak_jobs = max(self.peak_jobs, self.jobs_in_flight())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(port: int):
+    import uvicorn
+    from app import main
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("The API server did not start.")
+        time.sleep(0.05)
+    return server, thread
+
+def run_client(base_url: str, story_numbers, poll_interval: float, deadline: float) -> list[dict]:
+    """POSTs each story in turn and polls it to completion, timing every step."""
+    results = []
+    with requests.Session() as session:
+        for number in story_numbers:
+            posted = time.perf_counter()
+            response = session.post(f"{base_url}/stories", json={"prompt": f"benchmark story {number}"})
+            response.raise_for_status()
+            story_id = response.json()["task_id"]
+            result = {"story_id": story_id, "first_change": None, "end_to_end": None, "status": "pending", "polls": []}
+            while time.time() < deadline:
+                started = time.perf_counter()
+                status = session.get(f"{base_url}/stories/{story_id}").json()["status"]
+                now = time.perf_counter()
+                result["polls"].append(now - started)
+                if status != "pending" and result["first_change"] is None:
+                    result["first_change"] = now - posted
+                if status in ("complete", "failed"):
+                    result["status"] = status
+                    result["end_to_end"] = now - posted
+                    break
+                time.sleep(poll_interval)
+            results.append(result)
+    return results
+
+def llm_stage_metrics(database) -> dict:
+    """Per-stage LLM call counts, p50 latency and mean tokens per call, from the call records."""
+    db = database.SessionLocal()
+    try:
+        calls = db.query(database.LLMCallDB).all()
+    finally:
+        db.close()
+    by_stage = {}
+    for call in calls:
+        by_stage.setdefault(call.kind, []).append(call)
+    metrics = {}
+    for stage, stage_calls in sorted(by_stage.items()):
+        metrics[f"llm_{stage}_calls"] = len(stage_calls)
+        metrics[f"llm_{stage}_latency_p50"] = percentile([(c.latency_ms or 0) / 1000 for c in stage_calls], 0.5)
+        metrics[f"llm_{stage}_prompt_tokens"] = sum(c.prompt_tokens or 0 for c in stage_calls) / len(stage_calls)
+        metrics[f"llm_{stage}_output_tokens"] = sum(c.output_tokens or 0 for c in stage_calls) / len(stage_calls)
+    return metrics
+
+def run(args) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="storyteller-bench-")
+    config = configure_environment(args, work_dir)
+
+    from app import database, telemetry
+
+    db_timer = DBWriteTimer(database.engine, database.SessionLocal)
+    port = free_port()
+    server, thread = start_server(port)
+    base_url = f"http://127.0.0.1:{port}"
+
+    def jobs_in_flight() -> int:
+        return int(sum(telemetry.JOBS_IN_FLIGHT._values.values()))
+
+    assignments = [range(i, args.stories, args.concurrency) for i in range(args.concurrency)]
+    deadline = time.time() + args.timeout
+    started = time.perf_counter()
+    with MemorySampler(jobs_in_flight) as memory, ThreadPoolExecutor(args.concurrency) as pool:
+        futures = [pool.submit(run_client, base_url, numbers, args.poll_interval, deadline) for numbers in assignments]
+        results = [result for future in futures for result in future.result()]
+    elapsed = time.perf_counter() - started
+
+    server.should_exit = True
+    thread.join(timeout=10)
+    stage_metrics = llm_stage_metrics(database)
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    completed = [r for r in results if r["status"] == "complete"]
+    first_changes = [r["first_change"] for r in results if r["first_change"] is not None]
+    end_to_end = [r["end_to_end"] for r in completed]
+    polls = [poll for r in results for poll in r["polls"]]
+    rss_growth = max(memory.peak_rss - memory.baseline, 0) / (1024 * 1024)
+    metrics = {
+        "stories": len(results),
+        "completed": len(completed),
+        "failed": sum(1 for r in results if r["status"] == "failed"),
+        "timed_out": sum(1 for r in results if r["status"] == "pending"),
+        "elapsed_seconds": elapsed,
+        "throughput": len(completed) / elapsed if elapsed else 0.0,
+        "first_change_p50": percentile(first_changes, 0.5),
+        "first_change_p95": percentile(first_changes, 0.95),
+        "end_to_end_p50": percentile(end_to_end, 0.5),
+        "end_to_end_p95": percentile(end_to_end, 0.95),
+        "end_to_end_p99": percentile(end_to_end, 0.99),
+        "poll_p50": percentile(polls, 0.5),
+        "poll_p95": percentile(polls, 0.95),
+        "db_writes": len(db_timer.writes),
+        "db_write_total_seconds": sum(db_timer.writes),
+        "db_write_p95": percentile(db_timer.writes, 0.95),
+        "db_write_max": max(db_timer.writes, default=None),
+        "db_commits": len(db_timer.commits),
+        "db_commit_p95": percentile(db_timer.commits, 0.95),
+        "db_commit_max": max(db_timer.commits, default=None),
+        "peak_rss_mb": memory.peak_rss / (1024 * 1024),
+        "peak_jobs_in_flight": memory.peak_jobs,
+        "rss_per_job_mb": rss_growth / max(memory.peak_jobs, 1),
+        **stage_metrics,
+    }
+    bench_config = {key: value for key, value in config.items() if key not in ("LOCAL_STORAGE_DIR", "DATABASE_URL")}
+    bench_config.update({"stories": args.stories, "concurrency": args.concurrency, "poll_interval": args.poll_interval})
+    return {"config": bench_config, "metrics": metrics}
+
+def compare(results: dict, baseline: dict, tolerance: float, compared_metrics: dict = COMPARED_METRICS) -> list[str]:
+    """Returns a description of every metric in `compared_metrics` more than `tolerance` worse than `baseline`."""
+    regressions = []
+    for name, (higher_is_better, floor) in compared_metrics.items():
+        current, previous = results["metrics"].get(name), baseline["metrics"].get(name)
+        if current is None or not previous or abs(current - previous) <= floor:
+            continue
+        change = (current - previous) / previous
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{name}: {previous:.4g} -> {current:.4g} ({change:+.0%})")
+    return regressions
+
+def print_report(results: dict, baseline: dict | None = None):
+    print(f"{'metric':<32}{'value':>14}" + (f"{'baseline':>14}" if baseline else ""))
+    for name, value in results["metrics"].items():
+        line = f"{name:<32}{'-' if value is None else format(value, '.4g'):>14}"
+        if baseline:
+            previous = baseline["metrics"].get(name)
+            line += f"{'-' if previous is None else format(previous, '.4g'):>14}"
+        print(line)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    results = run(args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if results["metrics"]["completed"] < results["metrics"]["stories"]:
+        print("Not every story completed.", file=sys.stderr)
+        return 1
+    if baseline:
+        if baseline["config"] != results["config"]:
+            print("Warning: the baseline was recorded with a different configuration.", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions against the baseline:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            return 1
+        print("No regressions against the baseline.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
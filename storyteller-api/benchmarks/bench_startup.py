@@ -0,0 +1,154 @@
+"""
+Cold start benchmark for the API.
+
+Measures, each in fresh Python processes:
+    import_seconds          time to `import app.main`
+    first_response_seconds  time from launching uvicorn until GET /stories/{id}
+                            answers, with the embedded worker enabled
+
+and checks that importing the API loads none of HEAVY_MODULES (the provider
+SDKs and the generation pipeline), which should only load in the background
+once the app is up. Medians over `--runs` are reported.
+
+Run from storyteller-api/:
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --save-baseline benchmarks/startup.json
+    python -m benchmarks.bench_startup --compare benchmarks/startup.json
+
+Exits with status 1 if a heavy module is imported at startup or, with
+`--compare`, if a metric is more than `--tolerance` worse than the baseline.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from .bench_pipeline import compare, free_port, print_report
+
+# Modules the status and read paths must not need.
+HEAVY_MODULES = (
+    "app.services", "google.generativeai", "google.cloud", "google.auth", "grpc", "ffmpeg", "requests",
+)
+
+COMPARED_METRICS = {
+    "import_seconds": (False, 0.1),
+    "first_response_seconds": (False, 0.3),
+}
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - started
+heavy = sorted({heavy for heavy in sys.argv[1:] for name in sys.modules
+                if name == heavy or name.startswith(heavy + ".")})
+print(json.dumps({"seconds": elapsed, "heavy": heavy}))
+"""
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark API import time and time to first response.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes to measure for each metric.")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for the server to answer.")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Write the results to PATH.")
+    parser.add_argument("--compare", metavar="PATH", help="Compare against the baseline at PATH.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression, as a fraction.")
+    return parser.parse_args(argv)
+
+def app_environment(work_dir: str) -> dict:
+    """Fake providers and a scratch database, so nothing leaves the machine."""
+    return {
+        **os.environ,
+        "LLM_PROVIDER": "fake",
+        "TTS_PROVIDER": "fake",
+        "STORAGE_PROVIDER": "local",
+        "LOCAL_STORAGE_DIR": os.path.join(work_dir, "audio"),
+        "DATABASE_URL": f"sqlite:///{os.path.join(work_dir, 'startup.db')}",
+        "CACHE_BACKEND": "none",
+        "LOG_LEVEL": "WARNING",
+        "PYTHONPATH": os.getcwd(),
+    }
+
+def measure_import(env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", _IMPORT_SCRIPT, *HEAVY_MODULES],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def measure_first_response(env: dict, timeout: float) -> float:
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                # The story does not exist; any answer means the read path is up.
+                requests.get(f"http://127.0.0.1:{port}/stories/1", timeout=1)
+                return time.perf_counter() - started
+            except requests.ConnectionError:
+                time.sleep(0.01)
+        raise RuntimeError("The API server did not answer in time.")
+    finally:
+        server.terminate()
+        server.wait()
+
+def run(args) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="storyteller-startup-")
+    try:
+        env = app_environment(work_dir)
+        imports = [measure_import(env) for _ in range(args.runs)]
+        first_responses = [measure_first_response(env, args.timeout) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "config": {"runs": args.runs},
+        "metrics": {
+            "import_seconds": round(statistics.median(run["seconds"] for run in imports), 4),
+            "first_response_seconds": round(statistics.median(first_responses), 4),
+        },
+        "heavy_modules": sorted({name for run in imports for name in run["heavy"]}),
+    }
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    results = run(args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if results["heavy_modules"]:
+        print("Importing the API loaded: " + ", ".join(results["heavy_modules"]), file=sys.stderr)
+        return 1
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance, COMPARED_METRICS)
+        if regressions:
+            print("Regressions against the baseline:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            return 1
+        print("No regressions against the baseline.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
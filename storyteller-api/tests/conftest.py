@@ -0,0 +1,61 @@
+"""
+Offline test setup: fake LLM and TTS providers, local audio storage and a
+scratch SQLite database for every test. The app reads its settings at import,
+so they are set here before anything imports `app`.
+
+Run from storyteller-api/ with:
+
+    python -m pytest tests
+"""
+import os
+import tempfile
+
+_work_dir = tempfile.mkdtemp(prefix="storyteller-tests-")
+os.environ.update({
+    "LLM_PROVIDER": "fake",
+    "TTS_PROVIDER": "fake",
+    "STORAGE_PROVIDER": "local",
+    "LOCAL_STORAGE_DIR": os.path.join(_work_dir, "audio"),
+    "DATABASE_URL": f"sqlite:///{os.path.join(_work_dir, 'default.db')}",
+    "CACHE_BACKEND": "none",
+    "AUDIO_FORMAT": "wav",
+    "FAKE_LLM_LATENCY_SECONDS": "0",
+    "FAKE_TTS_LATENCY_SECONDS": "0",
+    "FAKE_LLM_OUTLINE_POINTS": "3",
+    "FAKE_LLM_SECTION_WORDS": "40",
+    "LLM_REQUESTS_PER_MINUTE": "0",
+    "TTS_REQUESTS_PER_MINUTE": "0",
+    "WORKER_POLL_SECONDS": "0.1",
+    "LOG_LEVEL": "WARNING",
+})
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+from app import database, migrations
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = database._create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def session_factory(engine, monkeypatch):
+    """A migrated database that `database.SessionLocal` (and so the worker and pipeline) also uses."""
+    migrations.run(engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(database, "SessionLocal", factory)
+    return factory
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    yield session
+    session.close()
+
+@pytest.fixture
+def client(session_factory):
+    """The API, without its startup hooks, so no embedded worker runs."""
+    from fastapi.testclient import TestClient
+    from app import main
+    return TestClient(main.app)
@@ -0,0 +1,87 @@
+import ipaddress
+import sqlite3
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+from app import crud, main
+
+@pytest.fixture
+def limits(monkeypatch):
+    def set_limits(per_client=0, pending=0):
+        monkeypatch.setattr(main, "CLIENT_MAX_ACTIVE_STORIES", per_client)
+        monkeypatch.setattr(main, "STORY_QUEUE_MAX_PENDING", pending)
+    set_limits()
+    return set_limits
+
+def test_matching_prompt_joins_the_active_story(client, limits):
+    first = client.post("/stories", json={"prompt": "A fox in the snow"}).json()
+    second = client.post("/stories", json={"prompt": "a fox  in the snow"}).json()
+
+    assert second == {"task_id": first["task_id"], "status": "pending", "duplicate": True, "pooled": False}
+
+def test_client_over_its_quota_gets_429(client, limits):
+    limits(per_client=2)
+    for prompt in ("one", "two"):
+        assert client.post("/stories", json={"prompt": prompt}).status_code == 200
+
+    response = client.post("/stories", json={"prompt": "three"})
+
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == str(main.ADMISSION_RETRY_AFTER_SECONDS)
+    # Another client is not affected.
+    other = TestClient(main.app, client=("198.51.100.7", 50000))
+    assert other.post("/stories", json={"prompt": "three"}).status_code == 200
+
+def test_full_queue_gets_503(client, limits):
+    limits(pending=1)
+    assert client.post("/stories", json={"prompt": "one"}).status_code == 200
+
+    response = client.post("/stories", json={"prompt": "two"})
+
+    assert response.status_code == 503
+    assert "retry-after" in response.headers
+
+def test_idempotency_key_replays_its_story(client, limits):
+    headers = {"Idempotency-Key": "abc-123"}
+    first = client.post("/stories", json={"prompt": "a red kite"}, headers=headers).json()
+
+    replay = client.post("/stories", json={"prompt": "a red kite"}, headers=headers).json()
+    assert replay["task_id"] == first["task_id"] and replay["duplicate"]
+
+    reused = client.post("/stories", json={"prompt": "a blue kite"}, headers=headers)
+    assert reused.status_code == 422
+
+def test_spoofed_forwarded_for_does_not_change_the_client(session_factory, limits, monkeypatch):
+    limits(per_client=1)
+    monkeypatch.setattr(main, "TRUSTED_PROXY_IPS", [ipaddress.ip_network("10.0.0.0/8")])
+    proxy = TestClient(main.app, client=("10.1.2.3", 50000))
+
+    first = proxy.post("/stories", json={"prompt": "one"}, headers={"X-Forwarded-For": "6.6.6.6, 203.0.113.9"})
+    spoofed = proxy.post("/stories", json={"prompt": "two"}, headers={"X-Forwarded-For": "7.7.7.7, 203.0.113.9"})
+
+    assert first.status_code == 200
+    assert spoofed.status_code == 429
+    db = session_factory()
+    try:
+        assert crud.get_story(db, first.json()["task_id"]).client_id == "203.0.113.9"
+    finally:
+        db.close()
+
+def test_forwarded_for_from_an_untrusted_peer_is_ignored(session_factory, limits, monkeypatch):
+    limits(per_client=1)
+    monkeypatch.setattr(main, "TRUSTED_PROXY_IPS", [ipaddress.ip_network("10.0.0.0/8")])
+    direct = TestClient(main.app, client=("203.0.113.50", 50000))
+
+    assert direct.post("/stories", json={"prompt": "one"}, headers={"X-Forwarded-For": "1.1.1.1"}).status_code == 200
+    assert direct.post("/stories", json={"prompt": "two"}, headers={"X-Forwarded-For": "2.2.2.2"}).status_code == 429
+
+def test_database_lock_timeout_is_a_503(client, limits, monkeypatch):
+    def locked(**kwargs):
+        raise OperationalError("SELECT ...", {}, sqlite3.OperationalError("database is locked"))
+
+    monkeypatch.setattr(crud, "get_active_story_by_prompt", locked)
+
+    response = client.post("/stories", json={"prompt": "one"})
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(main.DATABASE_BUSY_RETRY_AFTER_SECONDS)
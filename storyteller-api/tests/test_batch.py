@@ -0,0 +1,49 @@
+import pytest
+from app import batch
+
+@pytest.fixture
+def limits(monkeypatch):
+    def set_limits(per_client=0, pending=0):
+        monkeypatch.setattr(batch, "BATCH_CLIENT_MAX_ACTIVE_STORIES", per_client)
+        monkeypatch.setattr(batch, "BATCH_QUEUE_MAX_PENDING", pending)
+    set_limits()
+    return set_limits
+
+def test_batch_is_queued_and_reported_as_a_whole(client, limits):
+    response = client.post("/stories:batch", json={"prompts": ["a fox", "an owl", "a heron"], "name": "birds"})
+
+    assert response.status_code == 202
+    queued = response.json()
+    assert queued["total"] == 3
+    status = client.get(queued["status_url"]).json()
+    assert status["name"] == "birds"
+    assert status["counts"] == {"pending": 3}
+    assert not status["finished"]
+    assert client.get("/batches/9999").status_code == 404
+
+@pytest.mark.parametrize("prompts", [
+    [],
+    ["a fox", "   "],
+    ["x" * (batch.BATCH_PROMPT_MAX_CHARS + 1)],
+    ["a fox"] * (batch.BATCH_MAX_PROMPTS + 1),
+])
+def test_invalid_batch_is_a_422(client, limits, prompts):
+    assert client.post("/stories:batch", json={"prompts": prompts}).status_code == 422
+
+def test_batch_over_the_client_quota_gets_429(client, limits):
+    limits(per_client=3)
+    assert client.post("/stories:batch", json={"prompts": ["one", "two"]}).status_code == 202
+
+    response = client.post("/stories:batch", json={"prompts": ["three", "four"]})
+
+    assert response.status_code == 429
+    assert "retry-after" in response.headers
+
+def test_batch_over_the_queue_bound_gets_503(client, limits):
+    limits(pending=2)
+
+    assert client.post("/stories:batch", json={"prompts": ["one", "two", "three"]}).status_code == 503
+
+def test_submit_checks_prompt_length():
+    with pytest.raises(RuntimeError, match="characters"):
+        batch.submit(None, ["x" * (batch.BATCH_PROMPT_MAX_CHARS + 1)])
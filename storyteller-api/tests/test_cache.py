@@ -0,0 +1,87 @@
+import os
+from datetime import datetime, timedelta, timezone
+from google.api_core.exceptions import NotFound
+from app import cache, clients
+
+def test_disk_cache_round_trip(tmp_path):
+    disk = cache.DiskCache(str(tmp_path), max_bytes=1000)
+    key = cache.make_key("section", "gemini", "a fox")
+
+    assert disk.get(key) is None
+    disk.set(key, b"Once upon a time.")
+    assert disk.get(key) == b"Once upon a time."
+
+def test_disk_cache_overwrite_keeps_its_size(tmp_path):
+    disk = cache.DiskCache(str(tmp_path), max_bytes=1000)
+    disk.set("aa", b"x" * 10)
+    disk.set("bb", b"x" * 10)
+
+    for _ in range(5):
+        disk.set("aa", b"x" * 100)
+
+    assert disk._size == 110 == sum(size for _, size, _ in disk._entries())
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    disk = cache.DiskCache(str(tmp_path), max_bytes=350)
+    for age, key in enumerate(["aa", "bb", "cc"]):
+        disk.set(key, b"x" * 100)
+        os.utime(disk._path(key), (1000 + age, 1000 + age))
+    disk.get("aa")
+
+    disk.set("dd", b"x" * 100)
+
+    assert disk.get("bb") is None
+    assert all(disk.get(key) is not None for key in ["aa", "cc", "dd"])
+    assert disk._size == 300
+
+class _Blob:
+    """Just enough of a storage blob; listed blobs carry their size and update time."""
+
+    def __init__(self, bucket, name, size=None, updated=None):
+        self.bucket, self.name = bucket, name
+        self.size, self.updated = size, updated
+        self.metadata = None
+
+    def upload_from_string(self, value):
+        self.bucket.clock += timedelta(seconds=1)
+        self.bucket.objects[self.name] = (value, self.bucket.clock)
+
+    def download_as_bytes(self):
+        if self.name not in self.bucket.objects:
+            raise NotFound(self.name)
+        return self.bucket.objects[self.name][0]
+
+    def patch(self):
+        self.bucket.clock += timedelta(seconds=1)
+        value, _ = self.bucket.objects[self.name]
+        self.bucket.objects[self.name] = (value, self.bucket.clock)
+
+    def delete(self):
+        del self.bucket.objects[self.name]
+
+class _Bucket:
+    def __init__(self):
+        self.objects = {}
+        self.clock = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    def blob(self, name):
+        return _Blob(self, name)
+
+    def list_blobs(self, prefix):
+        return [
+            _Blob(self, name, len(value), updated)
+            for name, (value, updated) in self.objects.items() if name.startswith(prefix)
+        ]
+
+def test_gcs_cache_round_trip_and_eviction(monkeypatch):
+    bucket = _Bucket()
+    monkeypatch.setattr(clients, "bucket", lambda name: bucket)
+    gcs = cache.GCSCache("stories", "cache/", max_bytes=250, evict_every=4)
+
+    assert gcs.get("missing") is None
+    for key in ["aa", "bb", "cc"]:
+        gcs.set(key, b"x" * 100)
+    assert gcs.get("aa") == b"x" * 100
+    gcs.set("dd", b"x" * 100)
+
+    assert sorted(bucket.objects) == ["cache/aa", "cache/dd"]
@@ -0,0 +1,71 @@
+import json
+import threading
+import time
+import pytest
+from app import crud, database, main
+
+def _events(body: str) -> list:
+    """The stream's status events, with "keep-alive" for each keep-alive comment."""
+    events = []
+    for message in body.split("\n\n"):
+        if message.startswith(": keep-alive"):
+            events.append("keep-alive")
+        elif message.startswith("event: status"):
+            events.append(json.loads(message.split("data: ", 1)[1]))
+    return events
+
+def _later(session_factory, *steps):
+    """Runs each (delay, fn(db)) step in the background, in order."""
+    def run():
+        for delay, step in steps:
+            time.sleep(delay)
+            db = session_factory()
+            try:
+                step(db)
+            finally:
+                db.close()
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+@pytest.fixture(autouse=True)
+def fast_recheck(monkeypatch):
+    monkeypatch.setattr(main, "EVENTS_RECHECK_SECONDS", 0.1)
+
+def test_finished_story_sends_its_status_and_ends(client, db):
+    story = crud.create_story_task(db, "a sleepy fox")
+    crud.complete_story(db, story.id, "Once upon a time.", "/files/fox.wav")
+
+    events = _events(client.get(f"/stories/{story.id}/events").text)
+
+    assert events == [{"task_id": story.id, "status": "complete", "audio_url": f"/stories/{story.id}/audio"}]
+
+def test_stream_forwards_updates_without_repeating_them(client, db, session_factory):
+    story_id = crud.create_story_task(db, "a sleepy fox").id
+    updates = _later(
+        session_factory,
+        (0.3, lambda db: crud.update_story_status(db, story_id, "generating_story")),
+        (0.5, lambda db: crud.complete_story(db, story_id, "Once upon a time.", "/files/fox.wav")),
+    )
+
+    response = client.get(f"/stories/{story_id}/events")
+    updates.join()
+
+    statuses = [event["status"] for event in _events(response.text) if event != "keep-alive"]
+    assert statuses == ["pending", "generating_story", "complete"]
+    assert "keep-alive" in _events(response.text)
+
+def test_stream_ends_when_the_story_is_deleted(client, db, session_factory):
+    story_id = crud.create_story_task(db, "a sleepy fox").id
+
+    def delete(db):
+        db.query(database.StoryDB).filter(database.StoryDB.id == story_id).delete()
+        db.commit()
+
+    deletion = _later(session_factory, (0.3, delete))
+    response = client.get(f"/stories/{story_id}/events")
+    deletion.join()
+
+    assert response.status_code == 200
+    assert [event["status"] for event in _events(response.text) if event != "keep-alive"] == ["pending"]
+    assert client.get(f"/stories/{story_id}/events").status_code == 404
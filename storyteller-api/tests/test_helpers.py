@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+from app import audio, audiofiles, ratelimit
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("bytes=0-99", (0, 100)),
+    ("bytes=100-", (100, 1000)),
+    ("bytes=-50", (950, 1000)),
+    ("bytes=900-5000", (900, 1000)),
+    ("bytes=0-0,5-9", None),
+    ("bytes=abc", None),
+    ("items=0-9", None),
+])
+def test_parse_range(header, expected):
+    assert audiofiles.parse_range(header, 1000) == expected
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=-0"])
+def test_parse_range_not_satisfiable(header):
+    with pytest.raises(audiofiles.RangeNotSatisfiable):
+        audiofiles.parse_range(header, 1000)
+
+def test_split_for_synthesis_respects_pauses_and_size():
+    text = f"First paragraph.\n\nSecond one.\n\n{audio.PAUSE_MARKER}\n\n" + "A long sentence here. " * 20
+
+    chunks = audio.split_for_synthesis(text, max_bytes=100)
+
+    assert chunks[0] == ("First paragraph.\n\nSecond one.", True)
+    assert all(len(chunk.encode("utf-8")) <= 100 for chunk, _ in chunks)
+    assert not any(pause for _, pause in chunks[1:])
+    rest = " ".join(chunk for chunk, _ in chunks[1:])
+    assert rest.split() == ("A long sentence here. " * 20).split()
+
+class _HttpError(Exception):
+    def __init__(self, code):
+        self.code = code
+
+@pytest.mark.parametrize("error, retryable", [
+    (_HttpError(429), True),
+    (_HttpError(503), True),
+    (_HttpError(400), False),
+    (TimeoutError(), True),
+    (ValueError(), False),
+])
+def test_is_retryable(error, retryable):
+    assert ratelimit.is_retryable(error) is retryable
+
+def test_call_retries_transient_errors(monkeypatch):
+    monkeypatch.setattr(ratelimit, "backoff_seconds", lambda retry: 0)
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise _HttpError(503)
+        return "ok"
+
+    assert asyncio.run(ratelimit.call("llm", flaky)) == ("ok", 2)
+
+def test_call_gives_up_on_permanent_errors(monkeypatch):
+    monkeypatch.setattr(ratelimit, "backoff_seconds", lambda retry: 0)
+    attempts = []
+
+    async def broken():
+        attempts.append(1)
+        raise _HttpError(400)
+
+    with pytest.raises(_HttpError):
+        asyncio.run(ratelimit.call("llm", broken))
+    assert len(attempts) == 1
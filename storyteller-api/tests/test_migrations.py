@@ -0,0 +1,46 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import Session
+from app import crud, migrations, storytext
+
+def _create_baseline_schema(engine):
+    """The `stories` table as it was before migrations existed."""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE stories (id INTEGER PRIMARY KEY, prompt VARCHAR, story_text VARCHAR, "
+            "audio_url VARCHAR, status VARCHAR)"
+        ))
+        conn.execute(text(
+            "INSERT INTO stories (prompt, story_text, audio_url, status) VALUES "
+            "('finished', 'Once upon a time.', '/files/story.wav', 'complete'), "
+            "('orphan', NULL, NULL, 'generating_story')"
+        ))
+
+def test_upgrades_baseline_schema(engine):
+    _create_baseline_schema(engine)
+
+    migrations.run(engine)
+
+    assert migrations.current_version(engine) == migrations.MIGRATIONS[-1][0]
+    columns = {column["name"] for column in inspect(engine).get_columns("stories")}
+    assert {"claimed_by", "attempts", "outline", "prompt_hash", "batch_id", "priority"} <= columns
+    assert "story_text" not in columns
+    with Session(engine) as db:
+        text_row = crud.get_story_text(db, 1)
+        assert storytext.decode(text_row.encoding, text_row.body) == "Once upon a time."
+        orphan = crud.get_story(db, 2)
+        assert orphan.status == "generating_story"
+        assert orphan.attempts == 0
+
+def test_running_twice_is_a_no_op(engine):
+    _create_baseline_schema(engine)
+    migrations.run(engine)
+
+    migrations.run(engine)
+
+    assert migrations.current_version(engine) == migrations.MIGRATIONS[-1][0]
+
+def test_fresh_database(engine):
+    migrations.run(engine)
+
+    assert migrations.current_version(engine) == migrations.MIGRATIONS[-1][0]
+    assert "story_batches" in inspect(engine).get_table_names()
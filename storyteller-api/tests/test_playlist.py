@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+from app import crud, services
+
+def test_playlist_lists_the_ready_segments_from_the_start(client, db):
+    story = crud.create_story_task(db, "a lighthouse keeper")
+    crud.save_segment(db, story.id, 0, status="ready", audio_url="/files/s0.wav", duration_seconds=61.2)
+    crud.save_segment(db, story.id, 1, status="synthesizing")
+    crud.save_segment(db, story.id, 2, status="ready", audio_url="/files/s2.wav", duration_seconds=58.0)
+
+    response = client.get(f"/stories/{story.id}/playlist.m3u8")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.apple.mpegurl"
+    lines = response.text.splitlines()
+    assert "#EXT-X-TARGETDURATION:62" in lines
+    assert "/files/s0.wav" in lines
+    assert "/files/s2.wav" not in lines
+    assert "#EXT-X-ENDLIST" not in lines
+    assert client.get(f"/stories/{story.id}").json()["playlist_url"] == f"/stories/{story.id}/playlist.m3u8"
+
+def test_playlist_is_closed_once_the_story_is_complete(client, db):
+    story = crud.create_story_task(db, "a lighthouse keeper")
+    crud.save_segment(db, story.id, 0, status="ready", audio_url="/files/s0.wav", duration_seconds=61.2)
+    crud.update_story_status(db, story.id, "complete")
+
+    assert client.get(f"/stories/{story.id}/playlist.m3u8").text.splitlines()[-1] == "#EXT-X-ENDLIST"
+
+def test_story_without_segments_has_no_playlist(client, db):
+    story = crud.create_story_task(db, "a lighthouse keeper")
+
+    response = client.get(f"/stories/{story.id}/playlist.m3u8")
+
+    assert response.status_code == 404
+    assert client.get(f"/stories/{story.id}").json()["playlist_url"] is None
+    assert client.get("/stories/9999/playlist.m3u8").status_code == 404
+
+def test_cancelled_segment_is_left_pending(db, monkeypatch):
+    story = crud.create_story_task(db, "a lighthouse keeper")
+    synthesizing = asyncio.Event()
+
+    async def stuck(text, path, voice_name):
+        synthesizing.set()
+        await asyncio.sleep(30)
+
+    async def fail_after_first_section(prompt, on_section=None, **kwargs):
+        await on_section(0, 3, "The keeper climbed the stairs.")
+        await synthesizing.wait()
+        raise RuntimeError("LLM quota exhausted")
+
+    monkeypatch.setattr(services, "_synthesize_to_wav", stuck)
+    monkeypatch.setattr(services, "generate_story_text_async", fail_after_first_section)
+
+    async def run():
+        progress = services._ProgressRecorder(story.id)
+        with pytest.raises(RuntimeError):
+            await services._generate_progressively(story.id, story.prompt, progress)
+        await asyncio.sleep(0.1)  # let the cancelled segment record its status
+
+    asyncio.run(run())
+
+    db.expire_all()
+    assert [segment.status for segment in crud.get_segments(db, story.id)] == ["pending"]
@@ -0,0 +1,55 @@
+import pytest
+from app import crud, database, pool
+
+def test_keywords_drop_stop_words_and_plurals():
+    assert pool.keywords("Tell me a bedtime story about the sleepy cats in a garden") == {"cat", "garden"}
+    assert pool.keywords("Glass houses") == {"glass", "house"}
+
+@pytest.mark.parametrize("a, b, expected", [
+    ({"cat", "fire"}, {"cat", "fire"}, 1.0),
+    ({"cat", "fire"}, {"cat", "garden"}, 1 / 3),
+    ({"cat"}, set(), 0.0),
+])
+def test_similarity(a, b, expected):
+    assert pool.similarity(a, b) == pytest.approx(expected)
+
+def _pool_story(db, seed_prompt: str, status: str = "complete") -> int:
+    story = crud.create_story_task(db, seed_prompt, client_id=pool.POOL_CLIENT_ID)
+    crud.save_pool_entry(db, seed_prompt, story.id)
+    crud.update_story_status(db, story.id, status)
+    return story.id
+
+def test_find_match_serves_the_closest_finished_story(db):
+    _pool_story(db, "A sleepy cat curling up by a warm fire")
+    garden = _pool_story(db, "A quiet walk through a moonlit garden")
+    _pool_story(db, "A moonlit garden walk with owls", status="generating_story")
+
+    story = pool.find_match(db, "a walk in the moonlit garden")
+
+    assert story.id == garden
+    entry = db.query(database.StoryPoolDB).filter(database.StoryPoolDB.story_id == garden).one()
+    db.refresh(entry)
+    assert entry.served == 1
+
+def test_find_match_needs_enough_overlap(db):
+    _pool_story(db, "A sleepy cat curling up by a warm fire")
+
+    assert pool.find_match(db, "a dragon guarding a mountain") is None
+
+def test_queue_seeds_skips_finished_and_retries_failed(db):
+    _pool_story(db, "A sleepy cat curling up by a warm fire")
+    failed = _pool_story(db, "A quiet walk through a moonlit garden", status="failed")
+
+    queued = pool.queue_seeds(db, ["A sleepy cat curling up by a warm fire", "A quiet walk through a moonlit garden"])
+
+    assert len(queued) == 1 and queued[0] != failed
+    assert crud.get_story(db, queued[0]).prompt == "A quiet walk through a moonlit garden"
+
+def test_request_opting_in_gets_the_pooled_story(client, db):
+    garden = _pool_story(db, "A quiet walk through a moonlit garden")
+
+    pooled = client.post("/stories", json={"prompt": "a moonlit garden walk", "allow_pooled": True}).json()
+    fresh = client.post("/stories", json={"prompt": "a moonlit garden walk"}).json()
+
+    assert pooled == {"task_id": garden, "status": "complete", "duplicate": False, "pooled": True}
+    assert fresh["task_id"] != garden and not fresh["pooled"]
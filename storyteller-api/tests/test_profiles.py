@@ -0,0 +1,68 @@
+import asyncio
+import json
+import pytest
+from app import profiles, services
+
+def test_default_profile_uses_the_default_model_everywhere():
+    loaded = profiles.load("default", None, environ={})
+
+    assert {profile.model for profile in loaded.values()} == {profiles.DEFAULT_MODEL}
+    assert loaded["section"].config == {"temperature": 0.7, "max_output_tokens": 8192}
+
+def test_economy_profile_moves_internal_calls_to_the_small_model():
+    loaded = profiles.load("economy", None, environ={})
+
+    assert {stage for stage, profile in loaded.items() if profile.model == profiles.SMALL_MODEL} == {
+        "plan", "summary", "continuity"
+    }
+    # Tuning settings from the default profile still apply.
+    assert loaded["summary"].config["max_output_tokens"] == 512
+
+def test_profile_file_then_environment_override(tmp_path):
+    profile_file = tmp_path / "profiles.json"
+    profile_file.write_text(json.dumps({
+        "default": {"config": {"top_p": 0.9}},
+        "outline": {"model": "gemini-1.5-pro-002", "config": {"temperature": 0.2}},
+    }))
+
+    loaded = profiles.load("default", str(profile_file), environ={
+        "LLM_MODEL_SUMMARY": "gemini-1.5-flash-8b-001",
+        "LLM_TEMPERATURE_OUTLINE": "0.4",
+        "LLM_MAX_OUTPUT_TOKENS_SECTION": "4096",
+    })
+
+    assert loaded["outline"] == profiles.StageProfile("gemini-1.5-pro-002", {"top_p": 0.9, "temperature": 0.4})
+    assert loaded["summary"].model == "gemini-1.5-flash-8b-001"
+    assert loaded["section"].config["max_output_tokens"] == 4096
+    assert all(profile.config["top_p"] == 0.9 for profile in loaded.values())
+
+@pytest.mark.parametrize("overrides, message", [
+    ({"epilogue": {"model": "gemini-1.5-pro-002"}}, "Unknown stage 'epilogue'"),
+    ("not json", "Could not read LLM_PROFILE_FILE"),
+])
+def test_bad_profile_file_is_an_error(tmp_path, overrides, message):
+    profile_file = tmp_path / "profiles.json"
+    profile_file.write_text(overrides if isinstance(overrides, str) else json.dumps(overrides))
+
+    with pytest.raises(RuntimeError, match=message):
+        profiles.load("default", str(profile_file), environ={})
+
+def test_unknown_profile_is_an_error():
+    with pytest.raises(RuntimeError, match="Unknown LLM_PROFILE"):
+        profiles.load("premium", None, environ={})
+
+def test_generation_config_keeps_the_output_format_settings():
+    config = profiles.generation_config("section", {"response_mime_type": "application/json", "temperature": 1.0})
+
+    assert config["response_mime_type"] == "application/json"
+    assert config["temperature"] == 1.0
+    assert config["max_output_tokens"] == profiles.get("section").config["max_output_tokens"]
+
+def test_each_call_goes_to_its_stage_model(monkeypatch):
+    monkeypatch.setattr(profiles, "PROFILES", profiles.load("economy", None, environ={}))
+    calls = []
+
+    asyncio.run(services.generate_story_text_async("a paper boat", mode="sequential", llm_calls=calls))
+
+    models = {call["kind"]: call["model"] for call in calls}
+    assert models == {"outline": profiles.DEFAULT_MODEL, "summary": profiles.SMALL_MODEL, "section": profiles.DEFAULT_MODEL}
@@ -0,0 +1,181 @@
+import asyncio
+import time
+from datetime import timedelta
+from app import crud, database, worker
+
+def _wait_for_status(session_factory, story_id: int, statuses, timeout: float = 60) -> str:
+    deadline = time.time() + timeout
+    while True:
+        db = session_factory()
+        try:
+            status = crud.get_story(db, story_id).status
+        finally:
+            db.close()
+        if status in statuses or time.time() > deadline:
+            return status
+        time.sleep(0.1)
+
+def test_claim_leases_the_oldest_pending_story(db):
+    first = crud.create_story_task(db, "first")
+    crud.create_story_task(db, "second")
+
+    story = crud.claim_next_story(db, "worker-a", lease_seconds=60, max_attempts=3)
+
+    assert story.id == first.id
+    assert story.claimed_by == "worker-a"
+    assert story.attempts == 1
+    assert story.lease_expires_at > database.utcnow()
+    assert crud.claim_next_story(db, "worker-b", lease_seconds=60, max_attempts=3).id != first.id
+
+def test_expired_lease_is_reclaimed(db):
+    story = crud.create_story_task(db, "orphan")
+    crud.claim_next_story(db, "dead-worker", lease_seconds=60, max_attempts=3)
+    db.query(database.StoryDB).filter(database.StoryDB.id == story.id).update(
+        {"status": "generating_story", "lease_expires_at": database.utcnow() - timedelta(seconds=1)}
+    )
+    db.commit()
+
+    reclaimed = crud.claim_next_story(db, "worker-b", lease_seconds=60, max_attempts=3)
+
+    assert reclaimed.id == story.id
+    assert reclaimed.claimed_by == "worker-b"
+    assert reclaimed.attempts == 2
+
+def test_story_out_of_attempts_is_failed(db):
+    story = crud.create_story_task(db, "doomed")
+    db.query(database.StoryDB).filter(database.StoryDB.id == story.id).update({"attempts": 3})
+    db.commit()
+
+    assert crud.claim_next_story(db, "worker-a", lease_seconds=60, max_attempts=3) is None
+    db.expire_all()
+    assert crud.get_story(db, story.id).status == "failed"
+
+def test_interactive_stories_are_claimed_before_batch_stories(db):
+    crud.create_story_batch(db, ["batch one", "batch two"], priority=-10)
+    interactive = crud.create_story_task(db, "interactive")
+
+    assert crud.claim_next_story(db, "worker-a", lease_seconds=60, max_attempts=3).id == interactive.id
+
+def test_worker_survives_a_failing_job(session_factory, monkeypatch):
+    services = worker._services()
+    generate = services.generate_story_and_audio_async
+    calls = []
+
+    async def fail_first(**kwargs):
+        calls.append(kwargs["story_id"])
+        if len(calls) == 1:
+            raise RuntimeError("database is locked")
+        await generate(**kwargs)
+
+    monkeypatch.setattr(services, "generate_story_and_audio_async", fail_first)
+    db = session_factory()
+    try:
+        failing = crud.create_story_task(db, "a story whose first job blows up").id
+        healthy = crud.create_story_task(db, "a quiet lake at dusk").id
+    finally:
+        db.close()
+
+    story_worker = worker.Worker(concurrency=1)
+    story_worker.start()
+    try:
+        assert _wait_for_status(session_factory, healthy, ("complete", "failed")) == "complete"
+        assert story_worker._thread.is_alive()
+        assert failing in calls
+    finally:
+        story_worker.stop(timeout=10)
+
+def test_worker_recovers_legacy_row_without_created_at(session_factory):
+    db = session_factory()
+    try:
+        story = crud.create_story_task(db, "a sleepy owl")
+        db.query(database.StoryDB).filter(database.StoryDB.id == story.id).update(
+            {"status": "generating_story", "created_at": None}
+        )
+        db.commit()
+        story_id = story.id
+    finally:
+        db.close()
+
+    story_worker = worker.Worker(concurrency=1)
+    story_worker.start()
+    try:
+        assert _wait_for_status(session_factory, story_id, ("complete", "failed")) == "complete"
+        assert story_worker._thread.is_alive()
+    finally:
+        story_worker.stop(timeout=10)
+
+def test_interactive_request_is_not_attached_to_batch_story(db):
+    crud.create_story_batch(db, ["a cat in a garden"], priority=-10)
+
+    assert crud.get_active_story_by_prompt(db, "A cat in a  garden") is None
+    assert crud.count_pending_stories(db) == 0
+    assert crud.count_pending_stories(db, batched=True) == 1
+
+def test_worker_that_cannot_load_the_pipeline_is_unhealthy(session_factory, monkeypatch, caplog):
+    def broken_import():
+        raise ImportError("no module named google")
+
+    monkeypatch.setattr(worker, "_services", broken_import)
+    story_worker = worker.Worker(concurrency=1)
+    story_worker.start()
+    story_worker._thread.join(timeout=10)
+
+    assert not story_worker.healthy
+    assert isinstance(story_worker.error, ImportError)
+    assert "could not load the generation pipeline" in caplog.text
+
+def test_notify_wakes_every_idle_slot(session_factory, monkeypatch):
+    monkeypatch.setattr(worker, "WORKER_POLL_SECONDS", 30)
+    services = worker._services()
+    started = []
+
+    async def slow(**kwargs):
+        started.append(kwargs["story_id"])
+        await asyncio.sleep(30)
+
+    monkeypatch.setattr(services, "generate_story_and_audio_async", slow)
+    story_worker = worker.Worker(concurrency=2)
+    story_worker.start()
+    try:
+        time.sleep(0.5)  # both slots find the queue empty and go idle
+        db = session_factory()
+        try:
+            story_ids = [crud.create_story_task(db, prompt).id for prompt in ("first", "second")]
+        finally:
+            db.close()
+        story_worker.notify()
+        deadline = time.time() + 5
+        while len(started) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        assert sorted(started) == story_ids
+    finally:
+        story_worker.stop(timeout=0)
+
+def test_resumed_attempt_keeps_the_first_stage_timestamps(db):
+    story = crud.create_story_task(db, "a patient heron")
+    crud.update_story_status(db, story.id, "generating_story")
+    crud.update_story_status(db, story.id, "generating_audio")
+    first = crud.get_story(db, story.id)
+    started, finished, audio_started = first.story_started_at, first.story_finished_at, first.audio_started_at
+
+    crud.requeue_story(db, story.id)
+    crud.update_story_status(db, story.id, "generating_story")
+    crud.update_story_status(db, story.id, "generating_audio")
+
+    db.expire_all()
+    story = crud.get_story(db, story.id)
+    assert (story.story_started_at, story.story_finished_at, story.audio_started_at) == (
+        started, finished, audio_started
+    )
+
+def test_manual_retry_times_the_story_afresh(db):
+    story = crud.create_story_task(db, "a patient heron")
+    crud.update_story_status(db, story.id, "generating_story")
+    crud.update_story_status(db, story.id, "failed")
+
+    assert crud.retry_story(db, story.id)
+
+    db.expire_all()
+    story = crud.get_story(db, story.id)
+    assert story.status == "pending"
+    assert story.story_started_at is None
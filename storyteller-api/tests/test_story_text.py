@@ -0,0 +1,110 @@
+import asyncio
+import os
+import pytest
+from app import crud, services, storytext
+
+@pytest.fixture
+def prompts(monkeypatch):
+    """Every LLM request made, as (kind, section, prompt)."""
+    generate = services._generate_content
+    recorded = []
+
+    async def record(prompt, generation_config, kind, section=None, **kwargs):
+        recorded.append((kind, section, prompt))
+        return await generate(prompt, generation_config, kind, section=section, **kwargs)
+
+    monkeypatch.setattr(services, "_generate_content", record)
+    return recorded
+
+def _sections(story: str) -> list[str]:
+    return [section for section in story.split(services.SECTION_SEPARATOR) if section]
+
+def test_parallel_mode_plans_then_writes_and_smooths_every_section(prompts):
+    calls = []
+
+    story = asyncio.run(services.generate_story_text_async("a sleepy fox", mode="parallel", llm_calls=calls))
+
+    kinds = [kind for kind, _, _ in prompts]
+    assert kinds[:2] == ["outline", "plan"]
+    assert kinds.count("section") == 3
+    assert sorted(section for kind, section, _ in prompts if kind == "continuity") == [1, 2]
+    assert "summary" not in kinds
+    assert len(_sections(story)) == 3
+    assert len(calls) == len(prompts)
+
+def test_parallel_mode_falls_back_to_the_outline_without_a_plan(monkeypatch):
+    generate = services._generate_content
+
+    async def bad_plan(prompt, generation_config, kind, **kwargs):
+        if kind == "plan":
+            raise RuntimeError("plan failed")
+        return await generate(prompt, generation_config, kind, **kwargs)
+
+    monkeypatch.setattr(services, "_generate_content", bad_plan)
+
+    story = asyncio.run(services.generate_story_text_async("a sleepy fox", mode="parallel"))
+
+    assert len(_sections(story)) == 3
+
+def test_rolling_summary_only_sends_the_newest_section(prompts, monkeypatch):
+    monkeypatch.setattr(services, "SUMMARY_MODE", "rolling")
+
+    story = asyncio.run(services.generate_story_text_async("a calm lake", mode="sequential"))
+
+    first, second, _ = _sections(story)
+    summaries = [(section, prompt) for kind, section, prompt in prompts if kind == "summary"]
+    assert [section for section, _ in summaries] == [1, 2]
+    # The second summary builds on the first one and the newest section only.
+    last_prompt = summaries[1][1]
+    assert second in last_prompt
+    assert first not in last_prompt
+    assert "Summary So Far" in last_prompt
+
+def test_full_summary_resends_the_whole_story(prompts):
+    story = asyncio.run(services.generate_story_text_async("a calm lake", mode="sequential"))
+
+    first, second, _ = _sections(story)
+    last_prompt = [prompt for kind, _, prompt in prompts if kind == "summary"][-1]
+    assert first in last_prompt and second in last_prompt
+
+def test_failed_attempt_resumes_from_its_checkpoints(db, prompts, monkeypatch):
+    story = crud.create_story_task(db, "a lost kite")
+    record = services._generate_content
+    failed = []
+
+    async def fail_last_section_once(prompt, generation_config, kind, section=None, **kwargs):
+        if kind == "section" and section == 2 and not failed:
+            failed.append(section)
+            raise RuntimeError("LLM quota exhausted")
+        return await record(prompt, generation_config, kind, section=section, **kwargs)
+
+    monkeypatch.setattr(services, "_generate_content", fail_last_section_once)
+
+    asyncio.run(services.generate_story_and_audio_async(story.id, story.prompt, final_attempt=False))
+
+    db.expire_all()
+    assert crud.get_story(db, story.id).status == "pending"
+    outline, sections = crud.get_checkpoint(db, story.id)
+    assert len(outline) == 3
+    assert [i for i, section in sorted(sections.items()) if section["text"]] == [0, 1]
+
+    first_attempt = len(prompts)
+    asyncio.run(services.generate_story_and_audio_async(story.id, story.prompt))
+
+    resumed = [(kind, section) for kind, section, _ in prompts[first_attempt:]]
+    assert resumed == [("section", 2)]
+    db.expire_all()
+    assert crud.get_story(db, story.id).status == "complete"
+    assert crud.get_checkpoint(db, story.id)[1] == {}
+    text_row = crud.get_story_text(db, story.id)
+    assert len(_sections(storytext.decode(text_row.encoding, text_row.body))) == 3
+
+@pytest.mark.parametrize("mode", ["sequential", "parallel"])
+def test_section_prompts_start_with_the_same_static_prefix(prompts, mode):
+    asyncio.run(services.generate_story_text_async("a paper boat", mode=mode))
+
+    section_prompts = [prompt for kind, _, prompt in prompts if kind == "section"]
+    shared = os.path.commonprefix(section_prompts)
+    assert len(section_prompts) == 3
+    assert "**Original User Request:** a paper boat" in shared
+    assert "**Full Story Outline:**" in shared
@@ -0,0 +1,49 @@
+import pytest
+from app import crud, storytext
+
+TEXT = "Once upon a time, a fox curled up by the fire.\n\n" * 20
+
+@pytest.fixture
+def story_id(db, monkeypatch):
+    monkeypatch.setattr(storytext, "STORY_TEXT_COMPRESSION", "gzip")
+    story = crud.create_story_task(db, "a sleepy fox")
+    crud.complete_story(db, story.id, TEXT, "/files/fox.wav")
+    return story.id
+
+def test_text_is_not_served_before_the_story_is_finished(client, db):
+    story = crud.create_story_task(db, "a sleepy fox")
+
+    assert client.get(f"/stories/{story.id}/text").json()["detail"] == "Story text is not ready"
+    assert client.get("/stories/9999/text").json()["detail"] == "Story not found"
+
+def test_identity_text_and_revalidation(client, story_id):
+    response = client.get(f"/stories/{story_id}/text", headers={"Accept-Encoding": "identity"})
+
+    assert response.status_code == 200
+    assert response.text == TEXT
+    assert "content-encoding" not in response.headers
+    assert response.headers["etag"] == storytext.etag(TEXT)
+    assert response.headers["vary"] == "Accept-Encoding"
+
+    revalidated = client.get(f"/stories/{story_id}/text",
+                             headers={"Accept-Encoding": "identity", "If-None-Match": response.headers["etag"]})
+    assert revalidated.status_code == 304
+
+def test_gzip_text_has_its_own_etag(client, story_id):
+    identity_etag = storytext.etag(TEXT)
+
+    response = client.get(f"/stories/{story_id}/text", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text == TEXT
+    gzip_etag = response.headers["etag"]
+    assert gzip_etag != identity_etag and gzip_etag.endswith('-gzip"')
+
+    stale = client.get(f"/stories/{story_id}/text", headers={"Accept-Encoding": "gzip", "If-None-Match": identity_etag})
+    assert stale.status_code == 200
+    fresh = client.get(f"/stories/{story_id}/text", headers={"Accept-Encoding": "gzip", "If-None-Match": gzip_etag})
+    assert fresh.status_code == 304
+    assert fresh.headers["etag"] == gzip_etag
+    # An identity client holding the gzip tag does not have its representation.
+    assert client.get(f"/stories/{story_id}/text",
+                      headers={"Accept-Encoding": "identity", "If-None-Match": gzip_etag}).status_code == 200